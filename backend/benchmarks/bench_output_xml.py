@@ -0,0 +1,106 @@
+"""
+Benchmark: parse output.xml bằng DOM (ET.fromstring) so với streaming (robot_output.parse_output_xml).
+
+Sinh một output.xml giả lập rồi đo thời gian và bộ nhớ đỉnh (tracemalloc) của hai cách.
+
+Chạy từ thư mục backend:
+    python benchmarks/bench_output_xml.py --tests 50000 --keywords 10
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from robot_output import parse_output_xml  # noqa: E402
+
+
+def generate_output_xml(path, tests, keywords, suites=20):
+    """Ghi một output.xml có cấu trúc giống Robot Framework"""
+    per_suite = max(tests // suites, 1)
+    passed = failed = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<robot generator="Robot 6.1" generated="20240101 10:00:00.000">\n')
+        f.write('<suite id="s1" name="Regression">\n')
+        written = 0
+        for s in range(suites):
+            f.write(f'<suite id="s1-s{s + 1}" name="Suite {s + 1}">\n')
+            for t in range(per_suite):
+                if written >= tests:
+                    break
+                status = "FAIL" if written % 17 == 0 else "PASS"
+                passed += status == "PASS"
+                failed += status == "FAIL"
+                f.write(f'<test id="s1-s{s + 1}-t{t + 1}" name="Test {written}">\n')
+                for k in range(keywords):
+                    f.write(f'<kw name="Step {k}" library="BuiltIn"><arg>value {k}</arg>'
+                            f'<msg timestamp="20240101 10:00:00.000" level="INFO">Executing step {k} of test {written}</msg>'
+                            f'<status status="PASS" starttime="20240101 10:00:00.000" endtime="20240101 10:00:00.010"/></kw>\n')
+                f.write(f'<status status="{status}" starttime="20240101 10:00:00.000" endtime="20240101 10:00:01.000">'
+                        f'{"Assertion failed" if status == "FAIL" else ""}</status>\n</test>\n')
+                written += 1
+            f.write('<status status="PASS" starttime="20240101 10:00:00.000" endtime="20240101 10:30:00.000"/>\n')
+            f.write('</suite>\n')
+        f.write('<status status="FAIL" starttime="20240101 10:00:00.000" endtime="20240101 11:00:00.000"/>\n')
+        f.write('</suite>\n')
+        f.write(f'<statistics><total><stat pass="{passed}" fail="{failed}" skip="0">All Tests</stat></total>'
+                '<tag></tag><suite></suite></statistics>\n')
+        f.write('<errors></errors>\n</robot>\n')
+
+
+def parse_dom(path):
+    """Cách cũ: đọc toàn bộ response.text rồi ET.fromstring"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    root = ET.fromstring(text)
+    total_stat = root.find('.//statistics').find('.//total').find('.//stat')
+    suite = root.find('.//suite')
+    return {
+        "passed_tests": int(total_stat.get('pass', 0)),
+        "failed_tests": int(total_stat.get('fail', 0)),
+        "suite": suite.get('name')
+    }
+
+
+def parse_stream(path):
+    """Cách mới: iterparse trên stream bytes (giống response.raw)"""
+    with open(path, "rb") as f:
+        return parse_output_xml(io.BufferedReader(f))
+
+
+def measure(fn, path):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DOM vs streaming output.xml parser")
+    parser.add_argument("--tests", type=int, default=20000)
+    parser.add_argument("--keywords", type=int, default=10)
+    parser.add_argument("--file", default="/tmp/bench_output.xml")
+    args = parser.parse_args()
+
+    generate_output_xml(args.file, args.tests, args.keywords)
+    size_mb = os.path.getsize(args.file) / (1024 * 1024)
+    print(f"output.xml: {args.tests} tests, {size_mb:.1f} MB")
+
+    for name, fn in (("DOM (ET.fromstring)", parse_dom), ("Streaming (iterparse)", parse_stream)):
+        result, elapsed, peak = measure(fn, args.file)
+        print(f"{name:24s} time={elapsed:7.2f}s  peak_mem={peak / (1024 * 1024):8.1f} MB  "
+              f"pass={result['passed_tests']} fail={result['failed_tests']}")
+
+    os.remove(args.file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Load test: latency của dashboard khi có một request Jenkins chậm đang chạy.
+
+Script dựng một Jenkins giả (stub) trả lời sau --jenkins-delay giây, sau đó:
+  1. đo latency của --requests request dashboard song song (baseline),
+  2. gửi --slow-calls request tới các route async gọi Jenkins (/api/projects/jenkins/jobs...)
+     và trong lúc chúng còn treo, đo lại latency dashboard.
+Với route async dùng client chặn (requests), bước 2 tăng đúng bằng thời gian Jenkins treo;
+với AsyncJenkinsClient hai con số phải gần nhau.
+
+Chạy backend trỏ vào stub (một worker để thấy rõ ảnh hưởng lên event loop):
+    JENKINS_URL=http://127.0.0.1:18080 uvicorn main:app --port 8000 --workers 1
+rồi từ thư mục backend:
+    python benchmarks/load_async_routes.py --base-url http://127.0.0.1:8000 --stub-port 18080
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+DASHBOARD_PATHS = ["/api/dashboard", "/api/reports/dashboard-stats"]
+SLOW_PATHS = ["/api/projects/jenkins/jobs", "/api/projects/jenkins/jobs/db"]
+
+
+def start_slow_jenkins(port, delay):
+    """Jenkins giả: mọi request đều trả {"jobs": []} sau delay giây"""
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def _reply(self):
+            time.sleep(delay)
+            body = b'{"jobs": []}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _reply
+        do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def timed_get(client, path):
+    started = time.perf_counter()
+    response = await client.get(path)
+    return time.perf_counter() - started, response.status_code
+
+
+async def dashboard_round(client, requests_count):
+    results = await asyncio.gather(*[
+        timed_get(client, DASHBOARD_PATHS[i % len(DASHBOARD_PATHS)])
+        for i in range(requests_count)
+    ])
+    return [latency for latency, _ in results]
+
+
+def summarize(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    print(f"{label:28s} n={len(ordered):4d}  p50={statistics.median(ordered) * 1000:8.1f}ms  "
+          f"p95={p95 * 1000:8.1f}ms  max={ordered[-1] * 1000:8.1f}ms")
+
+
+async def run(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.jenkins_delay * 4 + 30) as client:
+        # Warm-up: mở connection pool phía server và client
+        await dashboard_round(client, 5)
+
+        baseline = await dashboard_round(client, args.requests)
+        summarize("dashboard (baseline)", baseline)
+
+        slow_tasks = [
+            asyncio.create_task(timed_get(client, SLOW_PATHS[i % len(SLOW_PATHS)]))
+            for i in range(args.slow_calls)
+        ]
+        # Chờ các request chậm tới được Jenkins stub trước khi đo
+        await asyncio.sleep(min(0.5, args.jenkins_delay / 4))
+        during = await dashboard_round(client, args.requests)
+        summarize("dashboard (Jenkins slow)", during)
+
+        slow_results = await asyncio.gather(*slow_tasks)
+        summarize("slow Jenkins routes", [latency for latency, _ in slow_results])
+
+        ratio = statistics.median(during) / max(statistics.median(baseline), 1e-6)
+        print(f"p50 ratio during/baseline: {ratio:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async route load test with a slow Jenkins")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--stub-port", type=int, default=18080)
+    parser.add_argument("--jenkins-delay", type=float, default=5.0, help="giây Jenkins stub treo mỗi request")
+    parser.add_argument("--requests", type=int, default=50, help="số request dashboard mỗi vòng")
+    parser.add_argument("--slow-calls", type=int, default=4, help="số request Jenkins chậm chạy song song")
+    parser.add_argument("--no-stub", action="store_true", help="không dựng stub (backend trỏ vào Jenkins chậm khác)")
+    args = parser.parse_args()
+
+    server = None
+    if not args.no_stub:
+        server = start_slow_jenkins(args.stub_port, args.jenkins_delay)
+        print(f"Slow Jenkins stub on http://127.0.0.1:{args.stub_port} (delay {args.jenkins_delay}s)")
+    try:
+        asyncio.run(run(args))
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: render email report - biên dịch template (đọc file + inline CSS) cho mỗi email
+so với dùng template đã biên dịch sẵn lúc startup (email_templates.load_email_templates).
+
+Không cần database hay Jenkins: task_data giả đã có sẵn PM/thành viên và danh sách artifacts.
+
+Chạy từ thư mục backend:
+    python benchmarks/render_email.py --renders 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import email_templates  # noqa: E402
+
+
+def sample_task_data(index):
+    total = 120
+    passed = total - index % 7
+    return {
+        "task_id": f"TASK-{index:04d}",
+        "task_name": f"Regression <suite> #{index}",
+        "project_id": 1,
+        "project_name": "TestOps",
+        "project_manager": "Nguyễn Văn A",
+        "team_members": "B, C, D",
+        "job_name": "regression-job",
+        "build_number": index,
+        "total": total,
+        "passed": passed,
+        "start_time": "2025-01-01 10:00:00",
+        "end_time": "2025-01-01 10:05:30",
+        "duration": 330,
+        "artifacts": [
+            {"name": "output.xml", "filename": "output.xml.zip", "attached": True, "url": None},
+            {"name": "report.html", "filename": "report.html.zip", "attached": True, "url": None},
+            {"name": "log.html", "filename": None, "attached": False,
+             "url": f"http://jenkins/job/regression-job/{index}/robot/report/log.html"},
+        ],
+    }
+
+
+def summarize(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    print(f"{label:28s} n={len(ordered):5d}  p50={statistics.median(ordered) * 1e6:9.1f}us  "
+          f"p95={p95 * 1e6:9.1f}us  max={ordered[-1] * 1e6:9.1f}us")
+    return statistics.median(ordered)
+
+
+def measure(render, renders):
+    latencies = []
+    for index in range(renders):
+        task_data = sample_task_data(index)
+        started = time.perf_counter()
+        render(task_data)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Email report render benchmark")
+    parser.add_argument("--renders", type=int, default=2000, help="số email render mỗi chế độ")
+    parser.add_argument("--template-dir", default=email_templates.EMAIL_TEMPLATE_DIR)
+    args = parser.parse_args()
+
+    template_path = os.path.join(args.template_dir, "report.html")
+
+    def compile_each_time(task_data):
+        template = email_templates.compile_template(template_path)
+        return email_templates.render_template(template, email_templates.report_context(task_data))
+
+    email_templates.load_email_templates(args.template_dir)
+    html_size = len(email_templates.render_report_email(sample_task_data(0)).encode("utf-8"))
+    print(f"Rendered report: {html_size} bytes")
+
+    cold = summarize("compile per email", measure(compile_each_time, max(args.renders // 10, 1)))
+    warm = summarize("precompiled template", measure(email_templates.render_report_email, args.renders))
+    print(f"p50 speedup: {cold / max(warm, 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ARRAY, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, DateTime, Boolean, ARRAY, ForeignKey, JSON, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -51,11 +51,20 @@ class TestCase(Base):
     name = Column(String(200), nullable=False)
     description = Column(Text)
     project_id = Column(Integer, nullable=False)
-    status = Column(String(20), default="active")
+    status = Column(String(20), default="active")  # active, removed (đã xoá khỏi repo)
     priority = Column(String(20), default="medium")
+    source_path = Column(String(500))  # Đường dẫn file .robot trong repo
+    line_number = Column(Integer)
+    tags = Column(JSON)
+    deleted_at = Column(DateTime)  # Soft delete khi test không còn trong repo
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Khoá tự nhiên cho đồng bộ incremental (INSERT ... ON CONFLICT)
+        Index("idx_testcases_source", "project_id", "source_path", "name", unique=True),
+    )
+
 class Execution(Base):
     __tablename__ = "executions"
     
@@ -81,6 +90,7 @@ class Plan(Base):
     schedule_time = Column(String(100), nullable=False)
     status = Column(String(20), default="initialized")
     email_recipients = Column(Text)
+    email_digest = Column(String(10))  # off, hourly, daily, auto; NULL = EMAIL_DIGEST_DEFAULT
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship
@@ -109,6 +119,18 @@ class Report(Base):
     project_name = Column(String(200))
     task_type = Column(String(20))
 
+    __table_args__ = (
+        # Report mới nhất theo task (utils.get_latest_reports: LATERAL ... ORDER BY created_at DESC, id DESC LIMIT 1)
+        Index("idx_reports_task_created_id", "task_id", created_at.desc(), id.desc()),
+        Index(
+            "idx_reports_task_meaningful", "task_id", created_at.desc(), id.desc(),
+            postgresql_where=text("status NOT IN ('cancelled', 'aborted')")
+        ),
+        Index("idx_reports_created_at_id", created_at.desc(), id.desc()),
+        # Report của một build (webhook được xử lý lại)
+        Index("idx_reports_task_build", "task_id", "build_number"),
+    )
+
 class User(Base):
     __tablename__ = "users"
     
@@ -124,8 +146,18 @@ class Log(Base):
     level = Column(String(20), nullable=False)  # INFO, WARNING, ERROR, DEBUG
     message = Column(Text, nullable=False)
     source = Column(String(50))  # 'backend', 'jenkins'
+    job_name = Column(String(200))  # Jenkins job (log gửi qua /api/logs/jenkins)
+    build_number = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Bảng được phân vùng theo created_at (xem log_partitions.py);
+    # index full-text/trigram trên message được tạo trong log_search.py
+    __table_args__ = (
+        Index("idx_logs_source_level_created_at", "source", "level", "created_at"),
+        Index("idx_logs_created_at", "created_at"),
+        Index("idx_logs_job_build_created_at", "job_name", "build_number", "created_at"),
+    )
+
 class Cicd(Base):
     __tablename__ = "cicd"
     id = Column(Integer, primary_key=True, index=True)
@@ -137,6 +169,7 @@ class Cicd(Base):
     project_id = Column(Integer, nullable=False)
     status = Column(String(20), default="initialized")
     email_recipients = Column(Text)
+    email_digest = Column(String(10))  # off, hourly, daily, auto; NULL = EMAIL_DIGEST_DEFAULT
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class Notification(Base):
@@ -152,6 +185,14 @@ class Notification(Base):
     is_read = Column(Boolean, default=False)  # Đã đọc chưa
     read_at = Column(DateTime)  # Thời gian đọc
     created_at = Column(DateTime, default=datetime.utcnow)  # Thời gian tạo
+    idempotency_key = Column(String(100))  # task_id#build_number cho thông báo kết quả build
+
+    __table_args__ = (
+        Index("idx_notifications_idempotency_key", "idempotency_key", unique=True),
+        # Danh sách mới nhất (ORDER BY created_at DESC LIMIT) và đếm chưa đọc không quét cả bảng
+        Index("idx_notifications_created_at", "created_at"),
+        Index("idx_notifications_unread", "is_read", postgresql_where=text("is_read = false")),
+    )
 
 class JenkinsJob(Base):
     __tablename__ = "jenkins_jobs"
@@ -165,9 +206,202 @@ class JenkinsJob(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(300), unique=True, nullable=False)  # job_name#build_number
+    task_id = Column(String(50), nullable=False)
+    job_name = Column(String(200), nullable=False)
+    build_number = Column(Integer, nullable=False)
+    payload = Column(JSON, nullable=False)  # Body gốc Jenkins gửi về
+    status = Column(String(20), default="pending", index=True)  # pending, processing, retry, done, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    result = Column(JSON)
+    progress = Column(JSON)  # Các bước không idempotent đã xong, ví dụ {"jenkins_config": "<thời điểm>"}
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime)  # Lúc worker nhận event (lease của trạng thái processing)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(300), unique=True, nullable=False)  # task_id#build_number#kind
+    kind = Column(String(30), nullable=False, default="task_report")
+    task_id = Column(String(50))
+    payload = Column(JSON, nullable=False)  # task_data để dựng email
+    recipients = Column(JSON, nullable=False)  # Danh sách địa chỉ nhận
+    delivered_recipients = Column(JSON)  # Địa chỉ đã nhận (các lô RCPT TO đã gửi xong) - retry không gửi lại
+    status = Column(String(20), default="pending")  # pending, sending, retry, sent, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime)  # Lúc worker nhận email (lease của trạng thái sending)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("idx_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+class EmailDigestItem(Base):
+    __tablename__ = "email_digest_items"
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String(255), nullable=False)
+    digest_window = Column(String(10), nullable=False)  # hourly, daily
+    window_start = Column(DateTime, nullable=False)  # UTC
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), nullable=False)
+    task_id = Column(String(50))
+    build_number = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_email_digest_items_window", "recipient", "digest_window", "window_start", "report_id", unique=True),
+        # Một build chỉ vào một digest của mỗi người nhận, dù được xử lý lại ở cửa sổ khác
+        Index("idx_email_digest_items_build", "recipient", "digest_window", "task_id", "build_number", unique=True),
+    )
+
+class TestResult(Base):
+    __tablename__ = "test_results"
+
+    id = Column(BigInteger, primary_key=True)
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), nullable=False)
+    suite = Column(String(500))  # Tên đầy đủ của suite (Root.Child)
+    name = Column(String(500), nullable=False)  # Tên test case
+    status = Column(String(10), nullable=False)  # PASS, FAIL, SKIP, NOT RUN
+    duration_ms = Column(Integer)
+    message_hash = Column(String(32))  # md5 của message lỗi, nội dung lưu ở test_messages
+
+    __table_args__ = (
+        Index("idx_test_results_report_id", "report_id", "id"),
+        Index("idx_test_results_report_status", "report_id", "status", "id"),
+        Index("idx_test_results_name_report", "name", report_id.desc(), id.desc()),
+    )
+
+class TestMessage(Base):
+    __tablename__ = "test_messages"
+
+    message_hash = Column(String(32), primary_key=True)
+    message = Column(Text, nullable=False)
+
+class DashboardStat(Base):
+    __tablename__ = "dashboard_stats"
+
+    # Ví dụ: projects.total, tasks.execution.status.running, reports.created.2024-01-31
+    # (trigger ghi vào dòng con "<key>#<stripe>", xem stats_rollup.py)
+    stat_key = Column(String(100), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ReportTrend(Base):
+    __tablename__ = "report_trends"
+
+    granularity = Column(String(10), primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    project_id = Column(Integer, primary_key=True, default=0)  # 0 = không có project
+    task_type = Column(String(20), primary_key=True, default="")  # execution, plan, cicd
+    total = Column(Integer, nullable=False, default=0)
+    success = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    cancelled = Column(Integer, nullable=False, default=0)
+
+class LogStat(Base):
+    __tablename__ = "log_stats_hourly"
+
+    # Số dòng log theo giờ, source và level - cập nhật bởi log_sink khi ghi mỗi lô
+    bucket_start = Column(DateTime, primary_key=True)
+    source = Column(String(50), primary_key=True, default="")
+    level = Column(String(20), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+class LogErrorStat(Base):
+    __tablename__ = "log_error_stats"
+
+    # Số lỗi theo giờ và message đã chuẩn hoá (chữ số thay bằng #) để lấy top lỗi
+    bucket_start = Column(DateTime, primary_key=True)
+    source = Column(String(50), primary_key=True, default="")
+    message_key = Column(String(200), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    sample_message = Column(Text)
+    last_seen = Column(DateTime)
+
+class RepositoryHead(Base):
+    __tablename__ = "repository_heads"
+
+    # Commit mới nhất của ref kèm ETag của GitHub để gửi If-None-Match
+    owner = Column(String(100), primary_key=True)
+    repo = Column(String(100), primary_key=True)
+    ref = Column(String(200), primary_key=True, default="HEAD")
+    commit_sha = Column(String(40), nullable=False)
+    etag = Column(String(200))
+    checked_at = Column(DateTime, default=datetime.utcnow)
+
+class RepositoryInventory(Base):
+    __tablename__ = "repository_inventories"
+
+    owner = Column(String(100), primary_key=True)
+    repo = Column(String(100), primary_key=True)
+    commit_sha = Column(String(40), primary_key=True)
+    files = Column(JSON, nullable=False)  # Danh sách file .robot: name, path, size, sha, download_url
+    complete = Column(Boolean)  # True khi inventory dựng từ cây đầy đủ; dòng cũ (NULL) bị quét lại
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_repository_inventories_last_used", "last_used_at"),
+    )
+
+class RobotBlob(Base):
+    __tablename__ = "robot_blobs"
+
+    # Kết quả parse file .robot theo git blob SHA - nội dung giống nhau thì SHA giống nhau
+    blob_sha = Column(String(40), primary_key=True)
+    test_cases = Column(JSON, nullable=False)  # [{name, tags, line}]
+    parsed_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# Cột mới của các bảng đã có sẵn - create_all không ALTER bảng cũ
+ADDED_COLUMNS = [
+    ("testcases", "source_path", "VARCHAR(500)"),
+    ("testcases", "line_number", "INTEGER"),
+    ("testcases", "tags", "JSON"),
+    ("testcases", "deleted_at", "TIMESTAMP"),
+    ("logs", "job_name", "VARCHAR(200)"),
+    ("logs", "build_number", "INTEGER"),
+    ("plans", "email_digest", "VARCHAR(10)"),
+    ("cicd", "email_digest", "VARCHAR(10)"),
+    ("notifications", "idempotency_key", "VARCHAR(100)"),
+    ("webhook_events", "claimed_at", "TIMESTAMP"),
+    ("email_outbox", "claimed_at", "TIMESTAMP"),
+    ("repository_inventories", "complete", "BOOLEAN"),
+    ("email_outbox", "delivered_recipients", "JSON"),
+    ("email_digest_items", "task_id", "VARCHAR(50)"),
+    ("email_digest_items", "build_number", "INTEGER"),
+    ("webhook_events", "progress", "JSON"),
+]
+
+# Index đã được thay bằng index khác tên (đổi cột/điều kiện) - xoá trên database cũ
+REPLACED_INDEXES = [
+    "idx_test_results_name",
+    "idx_reports_task_created_at",
+]
+
 # Create tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for table_name, column_name, column_type in ADDED_COLUMNS:
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_name} {column_type}"))
+        for index_name in REPLACED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    # create_all không thêm index mới vào bảng đã tồn tại
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 # Get database session
 def get_db():
@@ -0,0 +1,176 @@
+"""
+Attachments của email report: tải output.xml, report.html, log.html từ Jenkins song song,
+nén ngay trong lúc stream (zip hoặc gzip) vào bộ nhớ - không ghi file tạm.
+
+- Mỗi file chỉ giữ một bản đã nén; dữ liệu gốc đi qua theo từng chunk.
+- File gốc lớn hơn EMAIL_ARTIFACT_MAX_BYTES, hoặc tổng dung lượng nén vượt
+  EMAIL_ATTACHMENTS_MAX_BYTES (bỏ file lớn nhất trước), không được đính kèm
+  mà thay bằng link tới artifact trên Jenkins.
+- EMAIL_ATTACHMENT_COMPRESSION: zip (mặc định, mở được trên mọi máy), gzip, none.
+"""
+import io
+import os
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.mime.application import MIMEApplication
+from typing import List, Optional
+
+from jenkins_client import get_jenkins_client
+
+REPORT_ARTIFACTS = ["output.xml", "report.html", "log.html"]
+EMAIL_ATTACHMENT_COMPRESSION = os.getenv("EMAIL_ATTACHMENT_COMPRESSION", "zip")
+EMAIL_ARTIFACT_MAX_BYTES = int(os.getenv("EMAIL_ARTIFACT_MAX_BYTES", str(100 * 1024 * 1024)))
+# Base64 làm email lớn thêm ~4/3 - 15MB nén vẫn dưới giới hạn 20-25MB của đa số mail server
+EMAIL_ATTACHMENTS_MAX_BYTES = int(os.getenv("EMAIL_ATTACHMENTS_MAX_BYTES", str(15 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+
+class ArtifactTooLarge(Exception):
+    pass
+
+
+@dataclass
+class ReportArtifact:
+    name: str  # Tên file gốc trên Jenkins (log.html)
+    url: str  # Link artifact trên Jenkins (dùng khi không đính kèm)
+    filename: Optional[str] = None  # Tên file đính kèm (log.html.zip)
+    content: Optional[bytes] = None  # Nội dung đã nén; None = không đính kèm
+    original_size: int = 0
+    error: Optional[str] = None
+
+    @property
+    def attached(self):
+        return self.content is not None
+
+    @property
+    def size(self):
+        return len(self.content) if self.content is not None else 0
+
+
+def artifact_url(job_name, build_number, file_name, jenkins_url=None):
+    base = (jenkins_url or os.getenv("JENKINS_URL", "http://localhost:8080")).rstrip("/")
+    return f"{base}/job/{job_name}/{build_number}/robot/report/{file_name}"
+
+
+class _Compressor:
+    """Ghi từng chunk vào buffer đã nén theo định dạng cấu hình"""
+
+    def __init__(self, name, compression):
+        self.buffer = io.BytesIO()
+        self.compression = compression
+        self._zip = None
+        self._entry = None
+        self._gzip = None
+        if compression == "zip":
+            self.filename = f"{name}.zip"
+            self._zip = zipfile.ZipFile(self.buffer, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+            self._entry = self._zip.open(name, "w", force_zip64=True)
+        elif compression == "gzip":
+            self.filename = f"{name}.gz"
+            self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: định dạng gzip
+        else:
+            self.filename = name
+
+    def write(self, chunk):
+        if self._entry is not None:
+            self._entry.write(chunk)
+        elif self._gzip is not None:
+            self.buffer.write(self._gzip.compress(chunk))
+        else:
+            self.buffer.write(chunk)
+
+    def finish(self):
+        if self._entry is not None:
+            self._entry.close()
+            self._zip.close()
+        elif self._gzip is not None:
+            self.buffer.write(self._gzip.flush())
+        return self.buffer.getvalue()
+
+
+def fetch_artifact(job_name, build_number, name, compression=None, max_bytes=None):
+    """Stream một artifact từ Jenkins và nén trong bộ nhớ. Lỗi/quá lớn thì trả về artifact chỉ có link"""
+    compression = compression or EMAIL_ATTACHMENT_COMPRESSION
+    max_bytes = max_bytes or EMAIL_ARTIFACT_MAX_BYTES
+    artifact = ReportArtifact(name=name, url=artifact_url(job_name, build_number, name))
+    try:
+        response = get_jenkins_client().get(artifact.url, stream=True)
+        try:
+            if response.status_code != 200:
+                artifact.error = f"HTTP {response.status_code}"
+                return artifact
+            declared = int(response.headers.get("Content-Length") or 0)
+            if declared > max_bytes:
+                raise ArtifactTooLarge(f"{declared} bytes")
+
+            compressor = _Compressor(name, compression)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                artifact.original_size += len(chunk)
+                if artifact.original_size > max_bytes:
+                    raise ArtifactTooLarge(f"> {max_bytes} bytes")
+                compressor.write(chunk)
+            artifact.content = compressor.finish()
+            artifact.filename = compressor.filename
+        finally:
+            response.close()
+    except ArtifactTooLarge as e:
+        artifact.error = f"too large ({e})"
+    except Exception as e:
+        artifact.error = str(e)
+
+    if artifact.attached:
+        print(f"[DEBUG] Attachment {artifact.filename}: {artifact.original_size} -> {artifact.size} bytes")
+    else:
+        print(f"[WARNING] Could not attach {name}: {artifact.error} - sending link instead")
+    return artifact
+
+
+def limit_attachments_size(artifacts, max_total_bytes=None):
+    """Vượt giới hạn tổng: bỏ đính kèm file lớn nhất trước, thay bằng link"""
+    max_total_bytes = max_total_bytes or EMAIL_ATTACHMENTS_MAX_BYTES
+    while sum(artifact.size for artifact in artifacts) > max_total_bytes:
+        largest = max((a for a in artifacts if a.attached), key=lambda a: a.size)
+        largest.content = None
+        largest.error = "attachments over size limit"
+        print(f"[WARNING] Attachments over {max_total_bytes} bytes - linking {largest.name} instead")
+    return artifacts
+
+
+def fetch_report_artifacts(job_name, build_number, names=None, max_total_bytes=None) -> List[ReportArtifact]:
+    """Tải song song các artifact của build; áp giới hạn tổng dung lượng đính kèm"""
+    names = names or REPORT_ARTIFACTS
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="artifact-fetch") as executor:
+        artifacts = list(executor.map(lambda name: fetch_artifact(job_name, build_number, name), names))
+    return limit_attachments_size(artifacts, max_total_bytes)
+
+
+def fetch_builds_artifacts(builds, names=None, max_total_bytes=None) -> List[ReportArtifact]:
+    """
+    Artifact của nhiều build [(job_name, build_number)] cho một email (digest).
+    Tên file đính kèm có tiền tố job-build để không trùng; giới hạn tổng áp cho cả email.
+    """
+    names = names or REPORT_ARTIFACTS
+    jobs = [(job_name, build_number, name) for job_name, build_number in builds for name in names]
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(jobs), 6), thread_name_prefix="artifact-fetch") as executor:
+        artifacts = list(executor.map(lambda job: fetch_artifact(*job), jobs))
+    for (job_name, build_number, _), artifact in zip(jobs, artifacts):
+        if artifact.filename:
+            artifact.filename = f"{job_name}-{build_number}-{artifact.filename}"
+    return limit_attachments_size(artifacts, max_total_bytes)
+
+
+def mime_attachments(artifacts: List[ReportArtifact]):
+    """Các phần MIME (base64 trong bộ nhớ) cho những artifact được đính kèm"""
+    parts = []
+    for artifact in artifacts:
+        if not artifact.attached:
+            continue
+        subtype = {"zip": "zip", "gz": "gzip"}.get(artifact.filename.rsplit(".", 1)[-1], "octet-stream")
+        part = MIMEApplication(artifact.content, _subtype=subtype)
+        part.add_header("Content-Disposition", "attachment", filename=artifact.filename)
+        parts.append(part)
+    return parts
@@ -0,0 +1,308 @@
+"""
+Email digest cho task chạy dày: plan có cron ngắn, CI/CD chạy theo mỗi push.
+
+Thay vì một email đầy đủ (kèm 3 file) cho mỗi build, report được ghi vào email_digest_items
+theo (người nhận, cửa sổ giờ/ngày). Mỗi người nhận có đúng một dòng email_outbox kind='digest'
+cho mỗi cửa sổ (idempotency key digest#<cửa sổ>#<bắt đầu>#<người nhận>), hẹn gửi lúc cửa sổ
+đóng + EMAIL_DIGEST_GRACE_SECONDS. Cửa sổ được tính theo created_at của report (không theo lúc xử lý),
+và mỗi build (task_id, build_number) chỉ vào digest của một người nhận một lần (unique index) -
+webhook retry qua mốc giờ không làm report xuất hiện trong hai digest. Email digest gộp mọi report của cửa sổ: bảng theo task với
+sparkline tỉ lệ passed, và chỉ đính kèm artifacts của các build failed.
+
+Chế độ theo task (cột email_digest của plans/cicd, NULL thì dùng EMAIL_DIGEST_DEFAULT):
+  off    - mỗi build một email (như trước)
+  hourly - gộp theo giờ
+  daily  - gộp theo ngày (giờ Việt Nam)
+  auto   - gộp theo giờ khi task có từ EMAIL_DIGEST_AUTO_THRESHOLD build trong 60 phút gần nhất
+"""
+import html
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal, EmailDigestItem, Project, Report
+
+DIGEST_MODES = ("off", "hourly", "daily", "auto")
+EMAIL_DIGEST_DEFAULT = os.getenv("EMAIL_DIGEST_DEFAULT", "off")
+EMAIL_DIGEST_AUTO_THRESHOLD = int(os.getenv("EMAIL_DIGEST_AUTO_THRESHOLD", "4"))
+EMAIL_DIGEST_GRACE_SECONDS = int(os.getenv("EMAIL_DIGEST_GRACE_SECONDS", "120"))
+# Số build failed gần nhất được đính kèm artifacts; build failed khác chỉ có link
+EMAIL_DIGEST_MAX_FAILED_ATTACHMENTS = int(os.getenv("EMAIL_DIGEST_MAX_FAILED_ATTACHMENTS", "3"))
+EMAIL_DIGEST_RETENTION_DAYS = int(os.getenv("EMAIL_DIGEST_RETENTION_DAYS", "7"))
+SPARKLINE_POINTS = 24
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+FAILED_STATUSES = {"failure", "failed"}
+VIETNAM_TZ = timezone(timedelta(hours=7))
+
+_last_prune = 0.0
+
+
+def normalize_digest_mode(value):
+    """Giá trị email_digest từ API: None/"" là mặc định, còn lại phải thuộc DIGEST_MODES"""
+    if value is None or not str(value).strip():
+        return None
+    mode = str(value).strip().lower()
+    if mode not in DIGEST_MODES:
+        raise ValueError(f"email_digest must be one of: {', '.join(DIGEST_MODES)}")
+    return mode
+
+
+def digest_window_for(db, task_id, mode, moment=None):
+    """
+    Cửa sổ digest (hourly/daily) cho report mới của task, hoặc None nếu gửi ngay.
+    moment: created_at của report - chế độ auto đếm build trong 60 phút trước đó, nên xử lý lại
+    (retry) cho cùng kết quả.
+    """
+    mode = mode or EMAIL_DIGEST_DEFAULT
+    if mode in ("hourly", "daily"):
+        return mode
+    if mode == "auto" and task_id:
+        moment = moment or datetime.utcnow()
+        recent = db.query(Report.id).filter(
+            Report.task_id == task_id,
+            Report.created_at >= moment - timedelta(hours=1),
+            Report.created_at <= moment
+        ).limit(EMAIL_DIGEST_AUTO_THRESHOLD).count()
+        if recent >= EMAIL_DIGEST_AUTO_THRESHOLD:
+            return "hourly"
+    return None
+
+
+def window_bounds(window, moment=None):
+    """(bắt đầu, kết thúc) UTC không timezone của cửa sổ chứa moment; ngày tính theo giờ Việt Nam"""
+    moment = moment or datetime.utcnow()
+    if window == "daily":
+        local = moment.replace(tzinfo=timezone.utc).astimezone(VIETNAM_TZ)
+        local_start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        start = local_start.astimezone(timezone.utc).replace(tzinfo=None)
+        return start, start + timedelta(days=1)
+    start = moment.replace(minute=0, second=0, microsecond=0)
+    return start, start + timedelta(hours=1)
+
+
+def add_to_digest(report_id, recipients, window, db=None):
+    """
+    Ghi report vào digest của từng người nhận và đảm bảo mỗi người có một email digest hẹn giờ.
+    Cửa sổ là cửa sổ chứa created_at của report; nếu email của cửa sổ đó đã tới hạn gửi
+    (report được xử lý lại muộn) thì report vào cửa sổ hiện tại. Build đã có trong digest
+    của người nhận (kể cả ở cửa sổ khác) thì bỏ qua.
+    """
+    from email_outbox import enqueue_email
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        report = db.query(Report.task_id, Report.build_number, Report.created_at).filter(Report.id == report_id).first()
+        now = datetime.utcnow()
+        window_start, window_end = window_bounds(window, (report.created_at if report else None) or now)
+        if window_end + timedelta(seconds=EMAIL_DIGEST_GRACE_SECONDS) <= now:
+            window_start, window_end = window_bounds(window, now)
+        db.execute(insert(EmailDigestItem).values([
+            {
+                "recipient": recipient, "digest_window": window, "window_start": window_start,
+                "report_id": report_id,
+                "task_id": report.task_id if report else None,
+                "build_number": report.build_number if report else None
+            }
+            for recipient in recipients
+        ]).on_conflict_do_nothing())
+        db.commit()
+
+        send_at = window_end + timedelta(seconds=EMAIL_DIGEST_GRACE_SECONDS)
+        created = 0
+        for recipient in recipients:
+            key = f"digest#{window}#{window_start:%Y%m%d%H}#{recipient}"
+            payload = {
+                "window": window,
+                "window_start": window_start.isoformat(),
+                "window_end": window_end.isoformat(),
+            }
+            _, is_new = enqueue_email(payload, [recipient], key, kind="digest", db=db, send_at=send_at)
+            created += int(is_new)
+        _prune_digest_items(db)
+        return {
+            "success": True,
+            "queued": True,
+            "digest": window,
+            "message": f"Report added to {window} digest for {len(recipients)} recipients ({created} new digests)"
+        }
+    finally:
+        if own_session:
+            db.close()
+
+
+def _prune_digest_items(db):
+    """Xoá item của các cửa sổ cũ (đã gửi), tối đa một lần mỗi giờ cho mỗi process"""
+    global _last_prune
+    if time.monotonic() - _last_prune < 3600:
+        return
+    _last_prune = time.monotonic()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=EMAIL_DIGEST_RETENTION_DAYS)
+        db.query(EmailDigestItem).filter(EmailDigestItem.window_start < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Failed to prune email digest items: {e}")
+
+
+def is_failed(report):
+    return (report.status or "").lower() in FAILED_STATUSES or (report.failed_tests or 0) > 0
+
+
+def pass_rate(report):
+    total = report.total_tests or 0
+    return (report.passed_tests or 0) / total * 100 if total else 0.0
+
+
+def sparkline(values):
+    """Chuỗi ký tự khối ▁..█ cho các giá trị 0..100 (hiển thị được trên mọi mail client)"""
+    top = len(SPARKLINE_BLOCKS) - 1
+    return "".join(SPARKLINE_BLOCKS[round(max(0.0, min(value, 100.0)) / 100 * top)] for value in values)
+
+
+def load_digest(recipient, window, window_start):
+    """
+    Các report của một digest, gom theo task theo thứ tự thời gian:
+    {"reports": [...], "tasks": OrderedDict(task_id -> {...})}
+    """
+    from utils import resolve_tasks
+
+    db = SessionLocal()
+    try:
+        reports = db.query(Report).join(EmailDigestItem, EmailDigestItem.report_id == Report.id).filter(
+            EmailDigestItem.recipient == recipient,
+            EmailDigestItem.digest_window == window,
+            EmailDigestItem.window_start == window_start
+        ).order_by(Report.created_at, Report.id).all()
+        task_info = resolve_tasks(db, [report.task_id for report in reports])
+        db.expunge_all()
+        _fill_missing_report_fields(db, reports, task_info)
+    finally:
+        db.close()
+
+    tasks = OrderedDict()
+    for report in reports:
+        task = tasks.setdefault(report.task_id, {
+            "task_id": report.task_id,
+            "task_name": task_info.get(report.task_id, {}).get("task_name") or report.task_id,
+            "project_name": report.project_name or "",
+            "reports": [],
+        })
+        task["reports"].append(report)
+    return {"reports": reports, "tasks": tasks}
+
+
+def _fill_missing_report_fields(db, reports, task_info):
+    """
+    Report plan tạo trước khi webhook ghi jenkins_job/project_name: lấy job từ task và tên từ project
+    để digest vẫn có artifacts và link Jenkins cho các build đó (object đã expunge, không ghi DB)
+    """
+    missing_projects = {report.project_id for report in reports if not report.project_name and report.project_id}
+    project_names = dict(
+        db.query(Project.id, Project.name).filter(Project.id.in_(missing_projects)).all()
+    ) if missing_projects else {}
+    for report in reports:
+        if not report.jenkins_job:
+            report.jenkins_job = task_info.get(report.task_id, {}).get("jenkins_job")
+        if not report.project_name:
+            report.project_name = project_names.get(report.project_id)
+        if not report.jenkins_job and is_failed(report):
+            print(f"[WARNING] Digest: report {report.id} ({report.task_id}) has no Jenkins job - "
+                  f"failed build #{report.build_number} gets no attachments or links")
+
+
+def digest_subject(window, window_start, digest):
+    reports = digest["reports"]
+    failed = sum(1 for report in reports if is_failed(report))
+    local_start = window_start.replace(tzinfo=timezone.utc).astimezone(VIETNAM_TZ)
+    label = f"{local_start:%d/%m/%Y}" if window == "daily" else f"{local_start:%d/%m/%Y %H:00}"
+    return f"[TestOps] Digest {label} - {len(reports)} builds, {failed} failed"
+
+
+def failed_builds(digest):
+    """(job, build) của các build failed mới nhất được đính kèm artifacts"""
+    failed = [report for report in reversed(digest["reports"]) if is_failed(report) and report.jenkins_job]
+    return [(report.jenkins_job, report.build_number) for report in failed[:EMAIL_DIGEST_MAX_FAILED_ATTACHMENTS]]
+
+
+def _task_rows_html(digest):
+    from email_attachments import artifact_url
+
+    rows = []
+    for task in digest["tasks"].values():
+        reports = task["reports"]
+        failed = sum(1 for report in reports if is_failed(report))
+        last = reports[-1]
+        rates = [pass_rate(report) for report in reports[-SPARKLINE_POINTS:]]
+        color = "#dc3545" if is_failed(last) else "#28a745"
+        report_link = artifact_url(last.jenkins_job, last.build_number, "report.html") if last.jenkins_job else ""
+        last_label = f"#{last.build_number} {html.escape((last.status or '').upper())}"
+        if report_link:
+            last_label = f'<a href="{html.escape(report_link, quote=True)}">{last_label}</a>'
+        rows.append(
+            "<tr>"
+            f"<td><strong>{html.escape(task['task_name'])}</strong><br>"
+            f"<small>{html.escape(task['task_id'])} · {html.escape(task['project_name'])}</small></td>"
+            f"<td>{len(reports)}</td>"
+            f"<td style=\"color: {'#dc3545' if failed else '#28a745'}; font-weight: bold;\">{failed}</td>"
+            f"<td class=\"sparkline\" title=\"Tỷ lệ passed theo build\">{sparkline(rates)} "
+            f"<small>{rates[-1]:.0f}%</small></td>"
+            f"<td style=\"color: {color}; font-weight: bold;\">{last_label}</td>"
+            "</tr>"
+        )
+    return "\n".join(rows)
+
+
+def _failed_list_html(digest, artifacts):
+    from email_attachments import artifact_url
+
+    attached_files = [artifact.filename for artifact in artifacts if artifact.attached]
+    items = []
+    for report in reversed(digest["reports"]):
+        if not is_failed(report):
+            continue
+        # File đính kèm của digest có tiền tố <job>-<build>- (fetch_builds_artifacts)
+        prefix = f"{report.jenkins_job}-{report.build_number}-"
+        link = artifact_url(report.jenkins_job, report.build_number, "log.html") if report.jenkins_job else ""
+        note = "có file đính kèm" if any(name.startswith(prefix) for name in attached_files) else "xem trên Jenkins"
+        note = f"<a href=\"{html.escape(link, quote=True)}\">{note}</a>" if link else "không có job Jenkins"
+        items.append(
+            f"<li>{html.escape(report.jenkins_job or report.task_id)} #{report.build_number} - "
+            f"{report.failed_tests or 0}/{report.total_tests or 0} testcase failed ({note})</li>"
+        )
+    return "\n".join(items) or "<li>Không có build failed 🎉</li>"
+
+
+def render_digest_email(window, window_start, window_end, digest, artifacts):
+    """HTML email digest theo template digest.<window>.html hoặc digest.html"""
+    from email_templates import select_template, render_template, to_vietnam_time, attachment_list_html
+
+    reports = digest["reports"]
+    failed = sum(1 for report in reports if is_failed(report))
+    total_tests = sum(report.total_tests or 0 for report in reports)
+    passed_tests = sum(report.passed_tests or 0 for report in reports)
+    context = {
+        "window": window,
+        "window_label": "Tổng hợp theo ngày" if window == "daily" else "Tổng hợp theo giờ",
+        "result_color": "#dc3545" if failed else "#28a745",
+        "window_start": to_vietnam_time(window_start),
+        "window_end": to_vietnam_time(window_end),
+        "total_builds": len(reports),
+        "failed_builds": failed,
+        "passed_builds": len(reports) - failed,
+        "task_count": len(digest["tasks"]),
+        "total_tests": total_tests,
+        "pass_rate": f"{(passed_tests / total_tests * 100) if total_tests else 0:.1f}",
+        "sparkline": sparkline([pass_rate(report) for report in reports[-SPARKLINE_POINTS:]]),
+        "task_rows_html": _task_rows_html(digest),
+        "failed_list_html": _failed_list_html(digest, artifacts),
+        "attachment_list_html": attachment_list_html([
+            {"name": artifact.name, "filename": artifact.filename, "attached": artifact.attached, "url": artifact.url}
+            for artifact in artifacts
+        ]) or "<li>Không có file đính kèm</li>",
+    }
+    return render_template(select_template("digest", result=window), context)
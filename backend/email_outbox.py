@@ -0,0 +1,414 @@
+"""
+Hàng đợi email gửi đi (outbox) và pool kết nối SMTP dùng lại.
+
+Webhook/route chỉ ghi một dòng vào bảng email_outbox rồi trả về ngay. Một luồng dispatcher
+lấy các email đến hạn (FOR UPDATE SKIP LOCKED - chạy nhiều worker uvicorn không gửi trùng),
+giao cho EMAIL_WORKERS luồng gửi. Dòng được nhận giữ lease (claimed_at) EMAIL_LEASE_SECONDS giây:
+email 'sending' chỉ được nhận lại khi lease đã hết (worker gửi đã dừng giữa chừng), không phải
+mỗi lần một worker khởi động. Mỗi luồng mượn một kết nối SMTP đã starttls + login
+từ pool, dùng lại cho nhiều email (NOOP kiểm tra khi kết nối nằm chờ lâu, mở lại sau
+EMAIL_SMTP_MAX_MESSAGES email hoặc khi server đóng kết nối).
+Mỗi email gửi một lần cho tất cả người nhận (RCPT TO theo lô EMAIL_MAX_RECIPIENTS; khi mất kết nối
+giữa chừng chỉ gửi lại các lô chưa gửi). Mỗi lô gửi xong được ghi vào delivered_recipients,
+nên lần retry (sau lỗi SMTP bất kỳ) chỉ gửi cho người chưa nhận.
+Gửi lỗi thì retry với exponential backoff, quá EMAIL_MAX_ATTEMPTS lần thì 'failed'.
+"""
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+
+from database import SessionLocal, EmailOutbox
+
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "1800"))
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "5"))
+EMAIL_MAX_RECIPIENTS = int(os.getenv("EMAIL_MAX_RECIPIENTS", "50"))
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "30"))
+EMAIL_SMTP_MAX_MESSAGES = int(os.getenv("EMAIL_SMTP_MAX_MESSAGES", "100"))
+EMAIL_SMTP_IDLE_SECONDS = float(os.getenv("EMAIL_SMTP_IDLE_SECONDS", "60"))
+# Thời gian tối đa cho một lần gửi (tải attachments + nhiều lệnh SMTP, mỗi lệnh tối đa EMAIL_SMTP_TIMEOUT)
+EMAIL_LEASE_SECONDS = float(os.getenv("EMAIL_LEASE_SECONDS", str(EMAIL_SMTP_TIMEOUT * 10)))
+
+_metrics = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "smtp_connections_opened": 0,
+    "smtp_connections_reused": 0,
+    "smtp_reconnects": 0,
+    "last_send_seconds": None,
+    "last_error": None,
+}
+_metrics_lock = threading.Lock()
+
+
+def _count(key, value=1):
+    with _metrics_lock:
+        _metrics[key] += value
+
+
+def _set_metric(key, value):
+    with _metrics_lock:
+        _metrics[key] = value
+
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent_count = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SmtpConnectionPool:
+    """Tối đa size kết nối SMTP đã xác thực, dùng lại giữa các email"""
+
+    def __init__(self, host, port, username, password, size=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size or EMAIL_WORKERS
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=EMAIL_SMTP_TIMEOUT)
+        smtp.ehlo()
+        if smtp.has_extn("starttls"):
+            smtp.starttls()
+            smtp.ehlo()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        _count("smtp_connections_opened")
+        return _PooledConnection(smtp)
+
+    def _checkout(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if connection.sent_count >= EMAIL_SMTP_MAX_MESSAGES:
+                connection.close()
+                continue
+            if time.monotonic() - connection.last_used > EMAIL_SMTP_IDLE_SECONDS:
+                # Kết nối nằm chờ lâu - server có thể đã đóng
+                try:
+                    if connection.smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP failed")
+                except (smtplib.SMTPException, OSError):
+                    connection.close()
+                    continue
+            _count("smtp_connections_reused")
+            return connection
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        connection = None
+        try:
+            connection = self._checkout()
+            yield connection
+            connection.last_used = time.monotonic()
+            self._idle.put(connection)
+            connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+            self._slots.release()
+
+    def send(self, message, from_addr, recipients, on_sent=None):
+        """
+        Gửi message tới recipients (RCPT TO theo lô); mở lại kết nối một lần nếu server đã đóng
+        và chỉ gửi tiếp các lô chưa gửi xong. on_sent(chunk) được gọi sau mỗi lô đã gửi.
+        """
+        chunks = [recipients[i:i + EMAIL_MAX_RECIPIENTS] for i in range(0, len(recipients), EMAIL_MAX_RECIPIENTS)]
+        delivered = 0
+        for attempt in range(2):
+            try:
+                with self.connection() as connection:
+                    for chunk in chunks[delivered:]:
+                        connection.smtp.send_message(message, from_addr=from_addr, to_addrs=chunk)
+                        connection.sent_count += 1
+                        delivered += 1
+                        if on_sent:
+                            on_sent(chunk)
+                return
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                _count("smtp_reconnects")
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    """Pool SMTP dùng chung, cấu hình từ EMAIL_SMTP_SERVER/EMAIL_SMTP_PORT/EMAIL_USERNAME/EMAIL_PASSWORD"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SmtpConnectionPool(
+                    os.getenv("EMAIL_SMTP_SERVER", "smtp-mail.outlook.com"),
+                    int(os.getenv("EMAIL_SMTP_PORT", "587")),
+                    os.getenv("EMAIL_USERNAME", ""),
+                    os.getenv("EMAIL_PASSWORD", "")
+                )
+    return _pool
+
+
+def _retry_delay(attempts):
+    """Exponential backoff: base * 2^(attempts-1), có giới hạn trên"""
+    return min(EMAIL_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), EMAIL_RETRY_MAX_SECONDS)
+
+
+def enqueue_email(task_data, recipients, idempotency_key, kind="task_report", db=None, send_at=None):
+    """
+    Ghi email vào outbox và đánh thức dispatcher. Trả về (outbox, created);
+    created=False nếu email với idempotency_key này đã có (ví dụ webhook được xử lý lại).
+    send_at: gửi không sớm hơn thời điểm này (UTC) - dùng cho digest gửi lúc cửa sổ đóng.
+    """
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        existing = db.query(EmailOutbox).filter(EmailOutbox.idempotency_key == idempotency_key).first()
+        if existing:
+            return existing, False
+
+        outbox = EmailOutbox(
+            idempotency_key=idempotency_key,
+            kind=kind,
+            task_id=task_data.get("task_id"),
+            payload=task_data,
+            recipients=list(recipients),
+            status="pending",
+            attempts=0,
+            next_attempt_at=send_at or datetime.utcnow()
+        )
+        db.add(outbox)
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            existing = db.query(EmailOutbox).filter(EmailOutbox.idempotency_key == idempotency_key).first()
+            if existing:
+                return existing, False
+            raise
+        db.refresh(outbox)
+        _count("enqueued")
+        _wakeup.set()
+        return outbox, True
+    finally:
+        if own_session:
+            db.close()
+
+
+def _claim_batch(db, limit):
+    """
+    Lấy tối đa limit email đến hạn và chuyển sang 'sending' (bỏ qua dòng worker khác đang khoá).
+    Email 'sending' có lease quá EMAIL_LEASE_SECONDS (worker gửi đã dừng) cũng được nhận lại.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=EMAIL_LEASE_SECONDS)
+    rows = db.query(EmailOutbox).filter(or_(
+        and_(EmailOutbox.status.in_(["pending", "retry"]), EmailOutbox.next_attempt_at <= now),
+        and_(EmailOutbox.status == "sending", or_(EmailOutbox.claimed_at.is_(None), EmailOutbox.claimed_at < stale))
+    )).order_by(EmailOutbox.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+    for row in rows:
+        if row.status == "sending":
+            print(f"[WARNING] Email {row.idempotency_key} lease expired - sending again")
+        row.status = "sending"
+        row.claimed_at = now
+        row.attempts = (row.attempts or 0) + 1
+    db.commit()
+    return [row.id for row in rows]
+
+
+def deliver_email(outbox_id):
+    """Worker: gửi một email trong outbox"""
+    from routes.email import get_email_service
+
+    db = SessionLocal()
+    try:
+        outbox = db.query(EmailOutbox).filter(EmailOutbox.id == outbox_id).first()
+        if outbox is None:
+            return
+
+        def record_sent(chunk):
+            # Commit ngay: nếu lô sau lỗi, lần retry bỏ qua các địa chỉ đã nhận
+            outbox.delivered_recipients = list(outbox.delivered_recipients or []) + list(chunk)
+            db.commit()
+
+        started = time.monotonic()
+        try:
+            delivered = set(outbox.delivered_recipients or [])
+            task_data = dict(outbox.payload or {})
+            task_data["recipients"] = [r for r in outbox.recipients if r not in delivered]
+            if not task_data["recipients"]:
+                result = {"success": True}
+            elif outbox.kind == "digest":
+                result = get_email_service().deliver_digest(task_data, on_sent=record_sent)
+            else:
+                result = get_email_service().deliver_task_report(task_data, on_sent=record_sent)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error") or "Unknown email error")
+        except Exception as e:
+            error = str(e)
+            _set_metric("last_error", error)
+            outbox.last_error = error
+            if outbox.attempts >= EMAIL_MAX_ATTEMPTS:
+                outbox.status = "failed"
+                _count("failed")
+                print(f"[ERROR] Email {outbox.idempotency_key} failed after {outbox.attempts} attempts: {error}")
+            else:
+                delay = _retry_delay(outbox.attempts)
+                outbox.status = "retry"
+                outbox.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                _count("retried")
+                print(f"[WARNING] Email {outbox.idempotency_key} attempt {outbox.attempts} failed: {error} - retry in {delay}s")
+            db.commit()
+            return
+
+        outbox.status = "sent"
+        outbox.sent_at = datetime.utcnow()
+        outbox.last_error = None
+        db.commit()
+        _count("sent")
+        _set_metric("last_send_seconds", round(time.monotonic() - started, 3))
+        print(f"[DEBUG] Email {outbox.idempotency_key} sent to {len(outbox.recipients)} recipients")
+    except Exception as e:
+        print(f"[ERROR] Email worker error for outbox {outbox_id}: {e}")
+    finally:
+        db.close()
+
+
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_dispatcher = None
+_executor = None
+
+
+def _release_claims(outbox_ids):
+    """Trả các email đã nhận nhưng chưa giao cho worker (dispatcher đang dừng) về 'retry'"""
+    db = SessionLocal()
+    try:
+        db.query(EmailOutbox).filter(
+            EmailOutbox.id.in_(outbox_ids), EmailOutbox.status == "sending"
+        ).update({
+            EmailOutbox.status: "retry",
+            EmailOutbox.claimed_at: None,
+            EmailOutbox.attempts: EmailOutbox.attempts - 1,
+            EmailOutbox.next_attempt_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        print(f"[WARNING] Email dispatcher failed to release outbox rows: {e}")
+    finally:
+        db.close()
+
+
+def _dispatch_loop():
+    while not _stopping.is_set():
+        # Giữ tham chiếu riêng: shutdown_email_dispatcher(wait=False) có thể gán _executor = None
+        executor = _executor
+        if executor is None:
+            return
+        claimed = []
+        try:
+            db = SessionLocal()
+            try:
+                claimed = _claim_batch(db, EMAIL_WORKERS)
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"[WARNING] Email dispatcher failed to claim outbox rows: {e}")
+
+        if claimed:
+            futures = []
+            for index, outbox_id in enumerate(claimed):
+                if _stopping.is_set():
+                    _release_claims(claimed[index:])
+                    break
+                try:
+                    futures.append(executor.submit(deliver_email, outbox_id))
+                except RuntimeError:
+                    # Executor đã shutdown giữa chừng
+                    _release_claims(claimed[index:])
+                    break
+            wait(futures)
+            continue
+        _wakeup.wait(EMAIL_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_email_dispatcher():
+    global _dispatcher, _executor
+    if _dispatcher is not None:
+        return
+    _stopping.clear()
+    _executor = ThreadPoolExecutor(max_workers=EMAIL_WORKERS, thread_name_prefix="email-worker")
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="email-dispatcher", daemon=True)
+    _dispatcher.start()
+
+
+def shutdown_email_dispatcher(wait=True):
+    """Dừng dispatcher; email chưa gửi xong được nhận lại khi lease hết hạn"""
+    global _dispatcher, _executor
+    _stopping.set()
+    _wakeup.set()
+    if _dispatcher is not None:
+        _dispatcher.join(EMAIL_SMTP_TIMEOUT if wait else 1)
+        _dispatcher = None
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+    if _pool is not None:
+        _pool.close_all()
+
+
+def get_outbox_stats(db):
+    """Số email theo trạng thái và các bộ đếm của process này"""
+    rows = db.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all()
+    counts = {status: count for status, count in rows}
+    kinds = db.query(EmailOutbox.kind, func.count(EmailOutbox.id)).group_by(EmailOutbox.kind).all()
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {
+        "workers": EMAIL_WORKERS,
+        "max_attempts": EMAIL_MAX_ATTEMPTS,
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "retry": counts.get("retry", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "by_kind": {kind: count for kind, count in kinds},
+        "metrics": metrics
+    }
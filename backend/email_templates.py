@@ -0,0 +1,438 @@
+"""
+Template engine cho email report.
+
+- Template là file HTML trong EMAIL_TEMPLATE_DIR (mặc định backend/email_templates), biến
+  dạng $tên theo string.Template. Mọi giá trị đều được escape HTML, trừ biến có hậu tố _html
+  (ví dụ $attachment_list_html) là HTML đã dựng sẵn.
+- Template được biên dịch một lần lúc startup (load_email_templates): stylesheet khai báo bằng
+  <link rel="stylesheet" href="..."> được inline vào thuộc tính style của từng thẻ (mail client
+  như Outlook/Gmail bỏ qua <style>); rule không inline được (:hover, ::before, :last-child,
+  @media) giữ lại trong <style> với !important để không bị style inline đè.
+- Chọn template theo project và kết quả mà không cần sửa code - file cụ thể nhất có mặt được dùng:
+      report.project-<id>.<result>.html > report.project-<id>.html > report.<result>.html > report.html
+  với <result> là passed, failed hoặc no_tests.
+  Email digest (email_digest.py) dùng digest.<hourly|daily>.html > digest.html theo cùng quy tắc.
+- Thông tin project (PM, thành viên) được cache EMAIL_PROJECT_CACHE_TTL giây,
+  xoá cache khi project được sửa/xoá (invalidate_project_team).
+
+Đo tốc độ render: python benchmarks/render_email.py
+"""
+import html
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from html.parser import HTMLParser
+from string import Template
+
+EMAIL_TEMPLATE_DIR = os.getenv(
+    "EMAIL_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_templates")
+)
+EMAIL_PROJECT_CACHE_TTL = float(os.getenv("EMAIL_PROJECT_CACHE_TTL", "300"))
+NOT_UPDATED = "Chưa cập nhật"
+VIETNAM_TZ = timezone(timedelta(hours=7))
+
+# Thẻ không hiển thị - không nhận style inline
+_NON_VISUAL_TAGS = {"html", "head", "meta", "title", "link", "style", "script", "br"}
+_VOID_TAGS = {"meta", "link", "br", "img", "hr", "input"}
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_SIMPLE_SELECTOR = re.compile(r"^(\*|[a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+)*)$")
+_LINK_STYLESHEET = re.compile(r"<link\s+rel=\"stylesheet\"\s+href=\"([^\"]+)\"\s*/?>", re.I)
+
+_templates = {}
+_templates_lock = threading.Lock()
+_project_cache = {}
+_project_cache_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------------
+# CSS inliner (chạy một lần khi biên dịch template)
+# ---------------------------------------------------------------------------
+
+def _split_css_blocks(css):
+    """[(prelude, body)] ở mức ngoài cùng; body của @media giữ nguyên cả ngoặc lồng nhau"""
+    blocks = []
+    depth = 0
+    start = 0
+    prelude = ""
+    for index, char in enumerate(css):
+        if char == "{":
+            if depth == 0:
+                prelude = css[start:index].strip()
+                start = index + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:index].strip()))
+                start = index + 1
+    return blocks
+
+
+def _parse_selector(selector):
+    """
+    Selector inline được: chuỗi hậu duệ của selector đơn (tag, .class, tag.class, *).
+    Trả về [(tag hoặc None, {class...})] hoặc None nếu không inline được.
+    """
+    parts = []
+    for token in selector.split():
+        match = _SIMPLE_SELECTOR.match(token)
+        if not match:
+            return None
+        tag = match.group(1)
+        classes = {name for name in match.group(2).split(".") if name}
+        parts.append((None if tag in (None, "*") else tag.lower(), classes))
+    return parts or None
+
+
+def _specificity(parts):
+    return (sum(len(classes) for _, classes in parts), sum(1 for tag, _ in parts if tag))
+
+
+def _declarations(body):
+    return [declaration.strip() for declaration in body.split(";") if declaration.strip()]
+
+
+def _important(body):
+    declarations = []
+    for declaration in _declarations(body):
+        if "!important" not in declaration:
+            declaration += " !important"
+        declarations.append(declaration)
+    return "; ".join(declarations)
+
+
+def compile_css(css):
+    """Tách CSS thành rule inline được [(selector, parts, specificity, thứ tự, declarations)] và CSS còn lại"""
+    rules = []
+    leftover = []
+    for order, (prelude, body) in enumerate(_split_css_blocks(_CSS_COMMENT.sub("", css))):
+        if prelude.startswith("@"):
+            inner = " ".join(
+                f"{inner_prelude} {{ {_important(inner_body)} }}"
+                for inner_prelude, inner_body in _split_css_blocks(body)
+            )
+            leftover.append(f"{prelude} {{ {inner} }}")
+            continue
+        for selector in prelude.split(","):
+            selector = selector.strip()
+            parts = _parse_selector(selector)
+            if parts is None:
+                leftover.append(f"{selector} {{ {_important(body)} }}")
+            else:
+                rules.append((selector, parts, _specificity(parts), order, _declarations(body)))
+    return rules, "\n".join(leftover)
+
+
+def _matches(element, parts):
+    tag, classes = parts
+    return (tag is None or tag == element[0]) and classes <= element[1]
+
+
+def _selector_matches(parts, stack):
+    """parts khớp phần tử cuối của stack, các phần trước khớp tổ tiên theo thứ tự"""
+    if not _matches(stack[-1], parts[-1]):
+        return False
+    position = len(stack) - 2
+    for part in reversed(parts[:-1]):
+        while position >= 0 and not _matches(stack[position], part):
+            position -= 1
+        if position < 0:
+            return False
+        position -= 1
+    return True
+
+
+class _InlineStyler(HTMLParser):
+    """Dựng lại HTML, thêm style inline theo các rule CSS khớp với từng thẻ"""
+
+    def __init__(self, rules):
+        super().__init__(convert_charrefs=False)
+        self.rules = sorted(rules, key=lambda rule: (rule[2], rule[3]))
+        self.matched = set()
+        self.stack = []
+        self.out = []
+
+    def _start(self, tag, attrs, closing):
+        attrs = list(attrs)
+        classes = set()
+        for name, value in attrs:
+            if name == "class" and value:
+                classes.update(value.split())
+        if tag not in _NON_VISUAL_TAGS:
+            stack = self.stack + [(tag, classes)]
+            declarations = []
+            for index, (_, parts, _, _, rule_declarations) in enumerate(self.rules):
+                if _selector_matches(parts, stack):
+                    declarations.extend(rule_declarations)
+                    self.matched.add(index)
+            if declarations:
+                existing = next((value for name, value in attrs if name == "style"), None)
+                # Style viết sẵn trong thẻ vẫn thắng, như trong trình duyệt
+                style = "; ".join(declarations + ([existing.strip().rstrip(";")] if existing else []))
+                attrs = [(name, value) for name, value in attrs if name != "style"] + [("style", style)]
+        rendered = "".join(
+            f" {name}" if value is None else f' {name}="{html.escape(value, quote=True)}"'
+            for name, value in attrs
+        )
+        self.out.append(f"<{tag}{rendered}{' /' if closing else ''}>")
+        if not closing and tag not in _VOID_TAGS:
+            self.stack.append((tag, classes))
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, closing=True)
+
+    def handle_endtag(self, tag):
+        # Đóng tới thẻ cùng tên gần nhất (bỏ qua thẻ không được đóng)
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        self.out.append(data)
+
+    def handle_entityref(self, name):
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self.out.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        self.out.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.out.append(f"<!{decl}>")
+
+
+def inline_css(markup, css):
+    """
+    HTML với CSS đã inline; rule không inline được nằm trong <style> ở cuối <head>.
+    Rule không khớp thẻ nào (dành cho HTML chèn qua biến *_html) cũng được giữ lại trong <style>.
+    """
+    rules, leftover = compile_css(css)
+    styler = _InlineStyler(rules)
+    styler.feed(markup)
+    styler.close()
+    result = "".join(styler.out)
+    unmatched = [
+        f"{selector} {{ {'; '.join(declarations)} }}"
+        for index, (selector, _, _, _, declarations) in enumerate(styler.rules)
+        if index not in styler.matched
+    ]
+    leftover = "\n".join(unmatched + ([leftover] if leftover else []))
+    if leftover:
+        style_block = f"<style>\n{leftover}\n</style>\n"
+        if "</head>" in result:
+            result = result.replace("</head>", style_block + "</head>", 1)
+        else:
+            result = style_block + result
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Biên dịch và chọn template
+# ---------------------------------------------------------------------------
+
+def compile_template(path):
+    """Đọc template, inline stylesheet được <link> tới (đường dẫn tương đối với template)"""
+    with open(path, encoding="utf-8") as f:
+        markup = f.read()
+    css = []
+
+    def collect(match):
+        with open(os.path.join(os.path.dirname(path), match.group(1)), encoding="utf-8") as css_file:
+            css.append(css_file.read())
+        return ""
+
+    markup = _LINK_STYLESHEET.sub(collect, markup)
+    if css:
+        markup = inline_css(markup, "\n".join(css))
+    return Template(markup)
+
+
+def load_email_templates(directory=None):
+    """Biên dịch mọi file *.html trong thư mục template; gọi lúc startup. Trả về danh sách tên"""
+    global _templates
+    directory = directory or EMAIL_TEMPLATE_DIR
+    compiled = {}
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".html"):
+            try:
+                compiled[file_name[:-len(".html")]] = compile_template(os.path.join(directory, file_name))
+            except Exception as e:
+                print(f"[WARNING] Failed to compile email template {file_name}: {e}")
+    with _templates_lock:
+        _templates = compiled
+    print(f"✅ Email templates compiled: {', '.join(compiled) or 'none'}")
+    return list(compiled)
+
+
+def select_template(kind="report", project_id=None, result=None):
+    """Template cụ thể nhất có mặt cho (kind, project, kết quả)"""
+    if not _templates:
+        load_email_templates()
+    result = (result or "").lower()
+    candidates = []
+    if project_id is not None:
+        if result:
+            candidates.append(f"{kind}.project-{project_id}.{result}")
+        candidates.append(f"{kind}.project-{project_id}")
+    if result:
+        candidates.append(f"{kind}.{result}")
+    candidates.append(kind)
+    for name in candidates:
+        template = _templates.get(name)
+        if template is not None:
+            return template
+    raise LookupError(f"Email template '{kind}' not found in {EMAIL_TEMPLATE_DIR}")
+
+
+def render_template(template, context):
+    """Thay biến; giá trị được escape HTML trừ biến *_html. Biến không có trong context giữ nguyên"""
+    values = {
+        key: value if key.endswith("_html") else html.escape("" if value is None else str(value))
+        for key, value in context.items()
+    }
+    return template.safe_substitute(values)
+
+
+# ---------------------------------------------------------------------------
+# Email report
+# ---------------------------------------------------------------------------
+
+ARTIFACT_DESCRIPTIONS = {
+    "output.xml": ("📄", "Kết quả test chi tiết"),
+    "report.html": ("📊", "Báo cáo HTML"),
+    "log.html": ("📝", "Log chi tiết"),
+}
+
+RESULT_STYLES = {
+    "NO_TESTS": ("Không có testcase", "#6c757d", "⚠️"),
+    "PASSED": ("PASSED", "#28a745", "✅"),
+    "FAILED": ("FAILED", "#dc3545", "❌"),
+}
+
+
+def to_vietnam_time(value):
+    """Thời gian UTC (chuỗi ISO hoặc datetime) sang giờ Việt Nam dd/mm/YYYY HH:MM:SS"""
+    if not value or value == "N/A":
+        return "N/A"
+    try:
+        moment = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.astimezone(VIETNAM_TZ).strftime("%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return str(value)
+
+
+def attachment_list_html(artifacts):
+    """Danh sách file đính kèm; file quá lớn/lỗi tải chỉ có link Jenkins"""
+    items = []
+    for artifact in artifacts:
+        icon, description = ARTIFACT_DESCRIPTIONS.get(artifact["name"], ("📎", "File kết quả"))
+        if artifact.get("attached"):
+            label = f"{html.escape(artifact['filename'])} - {description}"
+        else:
+            label = (
+                f"{html.escape(artifact['name'])} - {description} "
+                f"(<a href=\"{html.escape(artifact['url'] or '', quote=True)}\">xem trên Jenkins</a>)"
+            )
+        items.append(f'<li><span class="attachment-icon">{icon}</span> <span>{label}</span></li>')
+    return "\n".join(items)
+
+
+def report_result(task_data):
+    """PASSED nếu tất cả testcase passed, FAILED nếu có testcase failed, NO_TESTS nếu không có testcase"""
+    total_tests = task_data.get("total", 0) or 0
+    passed_tests = task_data.get("passed", 0) or 0
+    if total_tests == 0:
+        return "NO_TESTS"
+    return "PASSED" if passed_tests >= total_tests else "FAILED"
+
+
+def report_context(task_data):
+    """Biến của template report từ task_data"""
+    total_tests = task_data.get("total", 0) or 0
+    passed_tests = task_data.get("passed", 0) or 0
+    result = report_result(task_data)
+    result_text, result_color, result_icon = RESULT_STYLES[result]
+    pass_rate = (passed_tests / total_tests * 100) if total_tests > 0 else 0
+    artifacts = task_data.get("artifacts") or [
+        {"name": name, "filename": name, "attached": True, "url": None} for name in ARTIFACT_DESCRIPTIONS
+    ]
+
+    # Các trường đơn giản của task_data cũng dùng được trong template tuỳ biến
+    context = {
+        key: value for key, value in task_data.items()
+        if isinstance(value, (str, int, float)) and not key.endswith("_html")
+    }
+    context.update({
+        "result": result,
+        "result_text": result_text,
+        "result_color": result_color,
+        "result_icon": result_icon,
+        "project_manager": task_data.get("project_manager") or NOT_UPDATED,
+        "team_members": task_data.get("team_members") or NOT_UPDATED,
+        "start_time": to_vietnam_time(task_data.get("start_time")),
+        "end_time": to_vietnam_time(task_data.get("end_time")),
+        "duration": task_data.get("duration", "N/A"),
+        "total_tests": total_tests,
+        "passed_tests": passed_tests,
+        "failed_tests": total_tests - passed_tests,
+        "pass_rate": f"{pass_rate:.1f}",
+        "fail_rate": f"{100 - pass_rate:.1f}",
+        "attachment_list_html": attachment_list_html(artifacts),
+    })
+    return context
+
+
+def render_report_email(task_data):
+    """HTML email report cho task_data, dùng template phù hợp với project và kết quả"""
+    template = select_template("report", task_data.get("project_id"), report_result(task_data))
+    return render_template(template, report_context(task_data))
+
+
+# ---------------------------------------------------------------------------
+# Cache thông tin project cho email
+# ---------------------------------------------------------------------------
+
+def get_project_team(project_id):
+    """{project_manager, team_members} của project, cache EMAIL_PROJECT_CACHE_TTL giây"""
+    now = time.monotonic()
+    with _project_cache_lock:
+        cached = _project_cache.get(project_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    team = {"project_manager": NOT_UPDATED, "team_members": NOT_UPDATED}
+    if project_id is not None:
+        from database import SessionLocal, Project
+        db = SessionLocal()
+        try:
+            project = db.query(Project.project_manager, Project.members).filter(Project.id == project_id).first()
+            if project:
+                team["project_manager"] = project.project_manager or NOT_UPDATED
+                if project.members and isinstance(project.members, list):
+                    team["team_members"] = ", ".join(project.members)
+        finally:
+            db.close()
+
+    with _project_cache_lock:
+        _project_cache[project_id] = (now + EMAIL_PROJECT_CACHE_TTL, team)
+    return team
+
+
+def invalidate_project_team(project_id=None):
+    """Xoá cache của một project (hoặc toàn bộ khi project_id là None)"""
+    with _project_cache_lock:
+        if project_id is None:
+            _project_cache.clear()
+        else:
+            _project_cache.pop(project_id, None)
@@ -0,0 +1,45 @@
+"""
+GitHub REST client bất đồng bộ (httpx) dùng chung cho các route async.
+
+Một httpx.AsyncClient cho cả process (pool keep-alive tới api.github.com),
+token lấy từ GITHUB_TOKEN nếu có để tránh giới hạn 60 request/giờ của API ẩn danh.
+"""
+import os
+
+import httpx
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", "10"))
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", "20"))
+
+_client = None
+
+
+def github_headers():
+    headers = {"Accept": "application/vnd.github+json"}
+    token = os.getenv("GITHUB_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+def get_async_github_client():
+    """httpx.AsyncClient dùng chung, base_url là GitHub API"""
+    global _client
+    if _client is None:
+        limits = httpx.Limits(max_connections=GITHUB_POOL_SIZE, max_keepalive_connections=GITHUB_POOL_SIZE)
+        _client = httpx.AsyncClient(
+            base_url=GITHUB_API_URL,
+            headers=github_headers(),
+            timeout=httpx.Timeout(GITHUB_TIMEOUT, connect=5),
+            limits=limits,
+            transport=httpx.AsyncHTTPTransport(retries=2, limits=limits)
+        )
+    return _client
+
+
+async def close_async_github_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
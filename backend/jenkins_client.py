@@ -0,0 +1,289 @@
+"""
+Jenkins HTTP client dùng chung cho toàn bộ backend.
+
+- Một requests.Session duy nhất cho cả process với connection pool (keep-alive),
+  không còn tạo Session + bắt tay TCP/TLS mới cho mỗi request.
+- CSRF crumb được cache theo TTL và tự lấy lại khi Jenkins trả về 403.
+- Retry có backoff cho các request đọc (GET/HEAD) khi lỗi kết nối hoặc 502/503/504.
+- Timeout theo loại endpoint thay vì timeout=30 cố định.
+- AsyncJenkinsClient (httpx) cho các route async def, không block event loop.
+
+Cấu hình qua biến môi trường: JENKINS_URL, JENKINS_USER, JENKINS_TOKEN / JENKINS_PASS,
+JENKINS_POOL_SIZE, JENKINS_RETRIES, JENKINS_BACKOFF, JENKINS_CRUMB_TTL,
+JENKINS_CONNECT_TIMEOUT, JENKINS_TIMEOUT_{CRUMB,API,CONFIG,BUILD,ARTIFACT}.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
+
+# Timeout (giây) đọc response theo loại endpoint
+ENDPOINT_TIMEOUTS = {
+    "crumb": float(os.getenv("JENKINS_TIMEOUT_CRUMB", "5")),
+    "api": float(os.getenv("JENKINS_TIMEOUT_API", "10")),
+    "config": float(os.getenv("JENKINS_TIMEOUT_CONFIG", "15")),
+    "build": float(os.getenv("JENKINS_TIMEOUT_BUILD", "15")),
+    "artifact": float(os.getenv("JENKINS_TIMEOUT_ARTIFACT", "60")),
+}
+CONNECT_TIMEOUT = float(os.getenv("JENKINS_CONNECT_TIMEOUT", "5"))
+RETRY_STATUSES = (502, 503, 504)
+
+_ARTIFACT_MARKERS = ("/ws/", "/artifact/", "/robot/report/", "/consoleText", "/logText/")
+_BUILD_SUFFIXES = ("/build", "/buildWithParameters", "/stop", "/doDelete", "/createItem", "/enable", "/disable")
+
+
+def endpoint_kind(url):
+    """Phân loại endpoint Jenkins để chọn timeout"""
+    path = url.split("?", 1)[0]
+    if "/crumbIssuer/" in path:
+        return "crumb"
+    if path.endswith("/config.xml"):
+        return "config"
+    if any(marker in path for marker in _ARTIFACT_MARKERS):
+        return "artifact"
+    if path.endswith(_BUILD_SUFFIXES):
+        return "build"
+    return "api"
+
+
+def _default_auth():
+    user = os.getenv("JENKINS_USER")
+    secret = os.getenv("JENKINS_TOKEN") or os.getenv("JENKINS_PASS")
+    if user and secret:
+        return (user, secret)
+    return None
+
+
+class JenkinsClient:
+    """Client Jenkins thread-safe, dùng chung trong process (xem get_jenkins_client)"""
+
+    def __init__(self, base_url=None, auth=None, pool_size=None, retries=None, backoff=None, crumb_ttl=None):
+        self.base_url = (base_url or JENKINS_URL).rstrip("/")
+        self.crumb_ttl = float(crumb_ttl if crumb_ttl is not None else os.getenv("JENKINS_CRUMB_TTL", "600"))
+
+        pool_size = int(pool_size or os.getenv("JENKINS_POOL_SIZE", "20"))
+        retries = int(retries if retries is not None else os.getenv("JENKINS_RETRIES", "3"))
+        backoff = float(backoff if backoff is not None else os.getenv("JENKINS_BACKOFF", "0.5"))
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.auth = auth if auth is not None else _default_auth()
+
+        self._crumb = None
+        self._crumb_expires_at = 0
+        self._crumb_lock = threading.Lock()
+
+    def url(self, path):
+        """Nhận URL đầy đủ hoặc path tương đối (/job/...)"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def timeout_for(self, url):
+        return (CONNECT_TIMEOUT, ENDPOINT_TIMEOUTS[endpoint_kind(url)])
+
+    def get_crumb(self, force=False):
+        """Header CSRF crumb (dict rỗng nếu Jenkins không bật CSRF), cache theo TTL"""
+        with self._crumb_lock:
+            if not force and self._crumb is not None and time.monotonic() < self._crumb_expires_at:
+                return dict(self._crumb)
+            crumb = {}
+            try:
+                crumb_url = self.url("/crumbIssuer/api/json")
+                response = self.session.get(crumb_url, timeout=self.timeout_for(crumb_url))
+                if response.status_code == 200:
+                    data = response.json()
+                    crumb = {data["crumbRequestField"]: data["crumb"]}
+                else:
+                    print(f"[WARNING] Failed to get Jenkins crumb: {response.status_code}")
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"[WARNING] Failed to get Jenkins crumb: {e}")
+                # Không cache khi lỗi kết nối - lần sau thử lại
+                return {}
+            self._crumb = crumb
+            self._crumb_expires_at = time.monotonic() + self.crumb_ttl
+            return dict(crumb)
+
+    def invalidate_crumb(self):
+        with self._crumb_lock:
+            self._crumb = None
+            self._crumb_expires_at = 0
+
+    def request(self, method, path, headers=None, timeout=None, **kwargs):
+        url = self.url(path)
+        method = method.upper()
+        mutating = method in ("POST", "PUT", "DELETE")
+        request_headers = dict(headers or {})
+        if mutating:
+            request_headers.update(self.get_crumb())
+        if timeout is None:
+            timeout = self.timeout_for(url)
+
+        response = self.session.request(method, url, headers=request_headers, timeout=timeout, **kwargs)
+
+        if mutating and response.status_code == 403:
+            # Crumb hết hạn (ví dụ Jenkins restart) - lấy crumb mới và thử lại một lần
+            self.invalidate_crumb()
+            request_headers.update(self.get_crumb(force=True))
+            response = self.session.request(method, url, headers=request_headers, timeout=timeout, **kwargs)
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_jenkins_client():
+    """JenkinsClient dùng chung cho cả process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = JenkinsClient()
+    return _client
+
+
+class AsyncJenkinsClient:
+    """
+    Bản asyncio của JenkinsClient dựa trên httpx.AsyncClient: cùng pool keep-alive,
+    crumb cache theo TTL, retry GET có backoff và timeout theo loại endpoint.
+    Chỉ dùng trong event loop của server (xem get_async_jenkins_client).
+    """
+
+    def __init__(self, base_url=None, auth=None, pool_size=None, retries=None, backoff=None, crumb_ttl=None):
+        self.base_url = (base_url or JENKINS_URL).rstrip("/")
+        self.crumb_ttl = float(crumb_ttl if crumb_ttl is not None else os.getenv("JENKINS_CRUMB_TTL", "600"))
+        self.retries = int(retries if retries is not None else os.getenv("JENKINS_RETRIES", "3"))
+        self.backoff = float(backoff if backoff is not None else os.getenv("JENKINS_BACKOFF", "0.5"))
+
+        pool_size = int(pool_size or os.getenv("JENKINS_POOL_SIZE", "20"))
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = httpx.AsyncClient(
+            auth=auth if auth is not None else _default_auth(),
+            limits=limits,
+            # Transport tự retry lỗi kết nối; retry theo status code xử lý trong request()
+            transport=httpx.AsyncHTTPTransport(retries=self.retries, limits=limits)
+        )
+
+        self._crumb = None
+        self._crumb_expires_at = 0
+        self._crumb_lock = asyncio.Lock()
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def timeout_for(self, url):
+        return httpx.Timeout(ENDPOINT_TIMEOUTS[endpoint_kind(url)], connect=CONNECT_TIMEOUT)
+
+    async def get_crumb(self, force=False):
+        async with self._crumb_lock:
+            if not force and self._crumb is not None and time.monotonic() < self._crumb_expires_at:
+                return dict(self._crumb)
+            crumb = {}
+            try:
+                crumb_url = self.url("/crumbIssuer/api/json")
+                response = await self.client.get(crumb_url, timeout=self.timeout_for(crumb_url))
+                if response.status_code == 200:
+                    data = response.json()
+                    crumb = {data["crumbRequestField"]: data["crumb"]}
+                else:
+                    print(f"[WARNING] Failed to get Jenkins crumb: {response.status_code}")
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                print(f"[WARNING] Failed to get Jenkins crumb: {e}")
+                return {}
+            self._crumb = crumb
+            self._crumb_expires_at = time.monotonic() + self.crumb_ttl
+            return dict(crumb)
+
+    async def invalidate_crumb(self):
+        async with self._crumb_lock:
+            self._crumb = None
+            self._crumb_expires_at = 0
+
+    async def request(self, method, path, headers=None, timeout=None, **kwargs):
+        url = self.url(path)
+        method = method.upper()
+        mutating = method in ("POST", "PUT", "DELETE")
+        request_headers = dict(headers or {})
+        if mutating:
+            request_headers.update(await self.get_crumb())
+        if timeout is None:
+            timeout = self.timeout_for(url)
+
+        attempts = 1 if mutating else self.retries + 1
+        for attempt in range(attempts):
+            try:
+                response = await self.client.request(method, url, headers=request_headers, timeout=timeout, **kwargs)
+            except httpx.TimeoutException:
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    break
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        if mutating and response.status_code == 403:
+            await self.invalidate_crumb()
+            request_headers.update(await self.get_crumb(force=True))
+            response = await self.client.request(method, url, headers=request_headers, timeout=timeout, **kwargs)
+        return response
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_async_client = None
+
+
+def get_async_jenkins_client():
+    """AsyncJenkinsClient dùng chung cho event loop của server"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncJenkinsClient()
+    return _async_client
+
+
+async def close_async_jenkins_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,296 @@
+"""
+Phân vùng bảng logs theo thời gian (PostgreSQL declarative partitioning).
+
+- logs là bảng PARTITION BY RANGE (created_at), mỗi partition một tháng hoặc một ngày
+  (LOG_PARTITION_INTERVAL=month|day), tên logs_pYYYYMM / logs_pYYYYMMDD, thêm logs_default
+  để không mất log nếu partition chưa được tạo kịp.
+- Retention: partition có cận trên cũ hơn LOG_RETENTION_DAYS bị DROP nguyên partition
+  (không DELETE từng dòng, không để lại bloat). LOG_RETENTION_DAYS=0 là giữ vô hạn.
+- Bảo trì (tạo trước LOG_PARTITION_PREMAKE partition, áp retention) chạy lúc startup
+  và định kỳ mỗi LOG_PARTITION_MAINTENANCE_HOURS giờ.
+
+Trên DB cũ, bảng logs thường được chuyển sang bảng phân vùng bằng lệnh bảo trì
+(copy theo lô, giữ nguyên id và sequence):
+    python log_partitions.py convert
+Startup chỉ tự chuyển khi bảng logs còn rỗng; bảng có dữ liệu thì giữ nguyên tới khi chạy lệnh trên.
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database import engine, Log
+
+LOG_PARTITION_INTERVAL = os.getenv("LOG_PARTITION_INTERVAL", "month")
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_PARTITION_PREMAKE = int(os.getenv("LOG_PARTITION_PREMAKE", "2"))
+LOG_PARTITION_MAINTENANCE_HOURS = float(os.getenv("LOG_PARTITION_MAINTENANCE_HOURS", "6"))
+LOG_CONVERT_BATCH_SIZE = int(os.getenv("LOG_CONVERT_BATCH_SIZE", "5000"))
+
+_maintenance_timer = None
+_stopped = False
+
+
+def period_start(moment, interval=None):
+    """Đầu kỳ (tháng/ngày) chứa moment"""
+    interval = interval or LOG_PARTITION_INTERVAL
+    if interval == "day":
+        return datetime(moment.year, moment.month, moment.day)
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_period(start, interval=None):
+    interval = interval or LOG_PARTITION_INTERVAL
+    if interval == "day":
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def partition_name(start, interval=None):
+    interval = interval or LOG_PARTITION_INTERVAL
+    if interval == "day":
+        return f"logs_p{start:%Y%m%d}"
+    return f"logs_p{start:%Y%m}"
+
+
+def is_partitioned(connection):
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = 'logs' AND c.relnamespace = 'public'::regnamespace"
+    )).first() is not None
+
+
+def list_partitions(connection):
+    """[(tên partition, cận dưới, cận trên)] của logs, không gồm logs_default"""
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'public.logs'::regclass"
+    )).fetchall()
+    partitions = []
+    for name, bound in rows:
+        # FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00')
+        if "FROM (" not in bound:
+            continue
+        lower = bound.split("FROM ('", 1)[1].split("'", 1)[0]
+        upper = bound.split("TO ('", 1)[1].split("'", 1)[0]
+        partitions.append((name, datetime.fromisoformat(lower), datetime.fromisoformat(upper)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def ensure_partition(connection, start):
+    """Tạo partition cho kỳ bắt đầu tại start nếu chưa có"""
+    end = next_period(start)
+    name = partition_name(start)
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}')"
+    ))
+    return name
+
+
+def _swap_in_partitioned_table(connection):
+    """
+    Đổi tên bảng logs thường thành logs_unpartitioned và tạo bảng logs phân vùng rỗng thay thế.
+    Chỉ là DDL (không copy dữ liệu) nên khoá ACCESS EXCLUSIVE được giữ rất ngắn;
+    log mới được ghi thẳng vào bảng phân vùng ngay sau đó.
+    """
+    oldest = connection.execute(text("SELECT MIN(created_at) FROM logs")).scalar()
+    connection.execute(text("LOCK TABLE logs IN ACCESS EXCLUSIVE MODE"))
+    connection.execute(text("ALTER TABLE logs RENAME TO logs_unpartitioned"))
+    # Giữ primary key (copy theo id), đổi tên để không trùng logs_pkey của bảng mới;
+    # các index khác của bảng cũ không còn dùng và sẽ trùng tên với index của bảng mới
+    pkey = connection.execute(text(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = 'public.logs_unpartitioned'::regclass AND contype = 'p'"
+    )).scalar()
+    if pkey:
+        connection.execute(text(f"ALTER TABLE logs_unpartitioned RENAME CONSTRAINT {pkey} TO logs_unpartitioned_pkey"))
+    index_names = connection.execute(text(
+        "SELECT indexrelid::regclass::text FROM pg_index "
+        "WHERE indrelid = 'public.logs_unpartitioned'::regclass AND NOT indisprimary"
+    )).scalars().all()
+    for index_name in index_names:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    # Sequence của cột SERIAL bị xoá theo bảng cũ nếu còn OWNED BY
+    connection.execute(text("ALTER SEQUENCE IF EXISTS logs_id_seq OWNED BY NONE"))
+    connection.execute(text("""
+        CREATE TABLE logs (
+            id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
+            level VARCHAR(20) NOT NULL,
+            message TEXT NOT NULL,
+            source VARCHAR(50),
+            job_name VARCHAR(200),
+            build_number INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """))
+    connection.execute(text("CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT"))
+
+    now = datetime.utcnow()
+    start = period_start(oldest or now)
+    if LOG_RETENTION_DAYS > 0:
+        # Không tạo partition cho dữ liệu sắp bị xoá ngay ở lần bảo trì đầu tiên
+        start = max(start, period_start(now - timedelta(days=LOG_RETENTION_DAYS)))
+    while start <= now:
+        ensure_partition(connection, start)
+        start = next_period(start)
+    # Bảng mới còn rỗng: tạo index lúc này rẻ, các lô copy sau cập nhật index dần
+    for index in Log.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def _has_unpartitioned_table(connection):
+    return connection.execute(text("SELECT to_regclass('public.logs_unpartitioned')")).scalar() is not None
+
+
+def convert_logs_table(batch_size=None):
+    """
+    Chuyển bảng logs thường sang bảng phân vùng. Chạy bằng lệnh bảo trì, không chạy lúc startup
+    (trừ khi bảng logs còn rỗng):
+        python log_partitions.py convert [batch_size]
+
+    Bước 1 đổi bảng (DDL, khoá ngắn). Bước 2 chuyển dữ liệu cũ từ logs_unpartitioned sang theo lô
+    LOG_CONVERT_BATCH_SIZE dòng, mỗi lô một transaction (DELETE ... RETURNING + INSERT), nên không
+    khoá bảng lâu và chạy lại được nếu bị ngắt giữa chừng. Trong lúc chuyển, log cũ chưa copy
+    tạm thời chưa hiện trong /api/logs. Log đã quá LOG_RETENTION_DAYS được bỏ luôn.
+    """
+    batch_size = batch_size or LOG_CONVERT_BATCH_SIZE
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            _swap_in_partitioned_table(connection)
+            print("[DEBUG] Bảng logs đã chuyển sang bảng phân vùng, bắt đầu copy dữ liệu cũ")
+        elif not _has_unpartitioned_table(connection):
+            print("[DEBUG] Bảng logs đã là bảng phân vùng, không cần chuyển đổi")
+            return 0
+
+    # Index full-text/trigram trên bảng mới (bảng cũ đã bỏ index của nó)
+    from log_search import install_log_search
+    install_log_search()
+
+    cutoff = None
+    if LOG_RETENTION_DAYS > 0:
+        cutoff = period_start(datetime.utcnow() - timedelta(days=LOG_RETENTION_DAYS))
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            copied = connection.execute(text("""
+                WITH batch AS (
+                    DELETE FROM logs_unpartitioned
+                    WHERE id IN (SELECT id FROM logs_unpartitioned ORDER BY id LIMIT :batch_size)
+                    RETURNING id, level, message, source, job_name, build_number, created_at
+                )
+                INSERT INTO logs (id, level, message, source, job_name, build_number, created_at)
+                SELECT id, level, message, source, job_name, build_number, COALESCE(created_at, now() AT TIME ZONE 'utc')
+                FROM batch
+                WHERE CAST(:cutoff AS timestamp) IS NULL OR created_at IS NULL OR created_at >= :cutoff
+            """), {"batch_size": batch_size, "cutoff": cutoff}).rowcount
+            remaining = connection.execute(text("SELECT 1 FROM logs_unpartitioned LIMIT 1")).first()
+            if remaining is None:
+                connection.execute(text("DROP TABLE logs_unpartitioned"))
+                connection.execute(text("ALTER SEQUENCE IF EXISTS logs_id_seq OWNED BY logs.id"))
+        moved += copied
+        if remaining is None:
+            break
+        print(f"[DEBUG] Đã copy {moved} dòng log sang bảng phân vùng")
+    print(f"✅ Converted logs table to a partitioned table ({moved} rows copied)")
+    return moved
+
+
+def drop_partitions_before(connection, cutoff):
+    """DROP các partition có cận trên <= cutoff. Trả về danh sách partition đã xoá"""
+    dropped = []
+    for name, _, upper in list_partitions(connection):
+        if upper <= cutoff:
+            connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def maintain_log_partitions():
+    """Tạo trước partition cho các kỳ sắp tới và xoá partition hết hạn retention"""
+    dropped = []
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return dropped
+        now = datetime.utcnow()
+        start = period_start(now)
+        for _ in range(LOG_PARTITION_PREMAKE + 1):
+            ensure_partition(connection, start)
+            start = next_period(start)
+        if LOG_RETENTION_DAYS > 0:
+            # Cắt tại đầu giờ để bucket của log_stats_hourly/log_error_stats bị xoá trọn vẹn
+            cutoff = (now - timedelta(days=LOG_RETENTION_DAYS)).replace(minute=0, second=0, microsecond=0)
+            dropped = drop_partitions_before(connection, cutoff)
+            # Dòng rơi vào logs_default (ngoài mọi partition) cũng phải theo retention
+            connection.execute(text("DELETE FROM logs_default WHERE created_at < :cutoff"), {"cutoff": cutoff})
+            connection.execute(text("DELETE FROM log_stats_hourly WHERE bucket_start < :cutoff"), {"cutoff": cutoff})
+            connection.execute(text("DELETE FROM log_error_stats WHERE bucket_start < :cutoff"), {"cutoff": cutoff})
+    if dropped:
+        print(f"[DEBUG] Dropped expired log partitions: {', '.join(dropped)}")
+    return dropped
+
+
+def install_log_partitions():
+    """
+    Gọi lúc startup sau create_tables: bảo trì và lên lịch bảo trì định kỳ khi logs đã phân vùng.
+    Không copy dữ liệu lúc startup - bảng logs thường có dữ liệu phải chuyển bằng
+    python log_partitions.py convert.
+    """
+    try:
+        with engine.begin() as connection:
+            partitioned = is_partitioned(connection)
+            empty = partitioned or connection.execute(text("SELECT 1 FROM logs LIMIT 1")).first() is None
+            converting = partitioned and _has_unpartitioned_table(connection)
+        if not partitioned:
+            if not empty:
+                print("[WARNING] Bảng logs chưa phân vùng - chạy 'python log_partitions.py convert' để chuyển đổi")
+                return
+            # DB mới tạo bằng create_all: bảng rỗng, chuyển đổi chỉ là DDL
+            convert_logs_table()
+        elif converting:
+            print("[WARNING] Chuyển đổi bảng logs chưa xong - chạy lại 'python log_partitions.py convert'")
+        # Index của model (source, level, created_at) ... tạo trên bảng cha, tự áp dụng cho mọi partition
+        for index in Log.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+        maintain_log_partitions()
+        _schedule_maintenance()
+        print("✅ Log partitions verified")
+    except Exception as e:
+        print(f"[WARNING] Failed to set up log partitions: {e}")
+
+
+def _run_maintenance():
+    try:
+        maintain_log_partitions()
+    except Exception as e:
+        print(f"[WARNING] Log partition maintenance failed: {e}")
+    _schedule_maintenance()
+
+
+def _schedule_maintenance():
+    global _maintenance_timer
+    if _stopped or LOG_PARTITION_MAINTENANCE_HOURS <= 0:
+        return
+    _maintenance_timer = threading.Timer(LOG_PARTITION_MAINTENANCE_HOURS * 3600, _run_maintenance)
+    _maintenance_timer.daemon = True
+    _maintenance_timer.start()
+
+
+def stop_log_partition_maintenance():
+    global _stopped
+    _stopped = True
+    if _maintenance_timer is not None:
+        _maintenance_timer.cancel()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        convert_logs_table(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print("Usage: python log_partitions.py convert [batch_size]")
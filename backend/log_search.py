@@ -0,0 +1,113 @@
+"""
+Tìm kiếm toàn văn trên logs.message.
+
+- Full-text: index GIN trên to_tsvector('simple', message). Dùng cấu hình 'simple'
+  (không stemming) vì log trộn tiếng Việt, tiếng Anh và mã như TASK-001, build #12.
+- Cú pháp truy vấn: từ thường (AND), "cụm từ" (phrase, đúng thứ tự), tiền tố* (prefix),
+  -từ (loại trừ), OR giữa hai vế - phân tích bằng websearch_to_tsquery (PostgreSQL 11+) để từ
+  được tách đúng như trong index.
+- Chuỗi con tuỳ ý (mode=substring): ILIKE dùng index GIN pg_trgm.
+- Snippet được tô sáng bằng ts_headline, chỉ tính cho các dòng của trang kết quả.
+"""
+import html
+import re
+
+from sqlalchemy import Text, cast, func, literal_column, text
+
+from database import engine
+
+# Ký tự điều khiển làm dấu tô sáng, sau khi escape HTML mới đổi thành <mark>
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+HEADLINE_OPTIONS = (
+    f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+    "MaxFragments=2, MaxWords=25, MinWords=8, FragmentDelimiter=\" … \""
+)
+SNIPPET_CONTEXT = 80
+
+# Tạo trên bảng cha logs - áp dụng cho mọi partition. Mỗi câu chạy riêng: thiếu quyền
+# CREATE EXTENSION thì chỉ mất chế độ substring, full-text vẫn dùng được.
+SEARCH_INDEX_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS idx_logs_message_fts ON logs USING gin (to_tsvector('simple', message))",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS idx_logs_message_trgm ON logs USING gin (message gin_trgm_ops)",
+]
+
+_QUERY_TERM = re.compile(r'(-?)"([^"]*)"|(\S+)')
+# Có ít nhất một chữ/số - parser text search của PostgreSQL sinh được lexeme
+_SEARCHABLE = re.compile(r"[^\W_]", re.UNICODE)
+
+
+def build_tsquery(query):
+    """
+    Biểu thức tsquery (SQLAlchemy) cho chuỗi tìm kiếm của người dùng, None nếu không có từ để tìm.
+
+    Từ, "cụm từ", -loại trừ và OR do websearch_to_tsquery('simple', ...) xử lý, nên từ được tách
+    giống hệt to_tsvector của index: output.xml, host.domain là một lexeme, robot_output được tách
+    tại dấu _. Từ có dấu * (tiền tố) được tách bằng phraseto_tsquery rồi thêm :* vào lexeme cuối,
+    kết hợp AND với phần còn lại. Chuỗi người dùng chỉ đi vào SQL dưới dạng tham số.
+    """
+    base_terms = []
+    prefix_terms = []  # [(loại trừ, từ không có *)]
+    searchable = False
+    for match in _QUERY_TERM.finditer(query or ""):
+        negated, phrase, word = match.group(1), match.group(2), match.group(3)
+        if phrase is not None:
+            base_terms.append(f'{negated}"{phrase}"')
+            searchable = searchable or (not negated and bool(_SEARCHABLE.search(phrase)))
+            continue
+        if word.upper() == "OR":
+            base_terms.append(word)
+            continue
+        negated = word.startswith("-") and len(word) > 1
+        term = word[1:] if negated else word
+        if term.endswith("*") and _SEARCHABLE.search(term):
+            prefix_terms.append((negated, term.rstrip("*")))
+        else:
+            base_terms.append(word)
+        searchable = searchable or (not negated and bool(_SEARCHABLE.search(term)))
+
+    # Chỉ có điều kiện loại trừ thì không tìm được gì bằng index
+    if not searchable:
+        return None
+
+    simple = literal_column("'simple'")
+    tsquery = func.websearch_to_tsquery(simple, " ".join(base_terms)) if base_terms else None
+    for negated, term in prefix_terms:
+        # phraseto_tsquery trả về dạng 'robot' <-> 'output' (PostgreSQL tự quote lexeme)
+        prefix = func.to_tsquery(simple, func.concat(
+            "!(" if negated else "(", cast(func.phraseto_tsquery(simple, term), Text), ":*)"
+        ))
+        tsquery = prefix if tsquery is None else tsquery.op("&&")(prefix)
+    return tsquery
+
+
+def highlight_html(headline):
+    """Escape HTML của snippet rồi đổi dấu tô sáng thành <mark>...</mark>"""
+    escaped = html.escape(headline or "")
+    return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+
+def substring_snippet(message, needle):
+    """Snippet quanh lần xuất hiện đầu tiên của needle (không phân biệt hoa thường), đã tô sáng"""
+    message = message or ""
+    index = message.lower().find(needle.lower())
+    if index < 0:
+        return html.escape(message[:SNIPPET_CONTEXT * 2])
+    start = max(index - SNIPPET_CONTEXT, 0)
+    end = min(index + len(needle) + SNIPPET_CONTEXT, len(message))
+    snippet = (
+        message[start:index] + HIGHLIGHT_START + message[index:index + len(needle)] + HIGHLIGHT_STOP
+        + message[index + len(needle):end]
+    )
+    return ("… " if start else "") + highlight_html(snippet) + (" …" if end < len(message) else "")
+
+
+def install_log_search():
+    """Tạo các index tìm kiếm (idempotent); lỗi từng câu chỉ được cảnh báo"""
+    for statement in SEARCH_INDEX_STATEMENTS:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(statement))
+        except Exception as e:
+            print(f"[WARNING] Failed to create log search index: {e}")
@@ -0,0 +1,194 @@
+"""
+Ghi log vào bảng logs theo lô, ngoài luồng xử lý request.
+
+log_backend_event / add_jenkins_log chỉ đưa dòng log vào một hàng đợi có giới hạn
+(không mở transaction, không commit). Một luồng nền gom các dòng và ghi bằng một
+câu INSERT nhiều dòng khi đủ LOG_BATCH_SIZE dòng hoặc sau LOG_FLUSH_INTERVAL giây,
+kèm cập nhật bảng thống kê theo giờ (log_stats.py).
+
+Khi hàng đợi đầy (DB chậm/mất kết nối) áp dụng LOG_OVERFLOW_POLICY:
+  - drop_new: bỏ dòng log mới (mặc định)
+  - drop_oldest: bỏ dòng cũ nhất trong hàng đợi để nhận dòng mới
+Số dòng bị bỏ được đếm trong get_log_sink_stats(). shutdown_log_sink() ghi nốt
+những gì còn trong hàng đợi trước khi process dừng.
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop_new")
+LOG_SHUTDOWN_TIMEOUT = float(os.getenv("LOG_SHUTDOWN_TIMEOUT", "5"))
+
+
+class LogSink:
+    """Hàng đợi log có giới hạn + một luồng ghi theo lô"""
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None, overflow_policy=None):
+        self.queue = queue.Queue(maxsize=max_size or LOG_QUEUE_SIZE)
+        self.batch_size = batch_size or LOG_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else LOG_FLUSH_INTERVAL
+        self.overflow_policy = overflow_policy or LOG_OVERFLOW_POLICY
+        self.stats = {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def emit(self, level, message, source="backend", created_at=None, job_name=None, build_number=None):
+        """Đưa một dòng log vào hàng đợi, không bao giờ block. Trả về False nếu dòng bị bỏ"""
+        row = {
+            "level": level.upper(),
+            "message": message,
+            "source": source,
+            "job_name": job_name,
+            "build_number": build_number,
+            "created_at": created_at or datetime.now(timezone.utc)
+        }
+        if self._stopping.is_set():
+            # Đang tắt: ghi thẳng để không mất log cuối cùng
+            self._write([row])
+            return True
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            try:
+                self.queue.get_nowait()
+                self._count("dropped")
+                self.queue.put_nowait(row)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self._count("dropped")
+        return False
+
+    def _drain(self, batch=None):
+        """Lấy thêm dòng có sẵn trong hàng đợi (không chờ) cho tới khi đủ lô"""
+        batch = batch if batch is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = self._drain([first])
+            # Chưa đủ lô: đợi thêm trong khoảng flush_interval để gom thêm dòng
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                self._drain(batch)
+            self._write(batch)
+        self.flush()
+
+    def _write(self, rows):
+        """Ghi một lô bằng một câu INSERT nhiều dòng"""
+        if not rows:
+            return
+        from sqlalchemy import insert
+        from database import SessionLocal, Log
+        from log_stats import record_log_rows
+        db = SessionLocal()
+        try:
+            db.execute(insert(Log), rows)
+            # Bộ đếm thống kê theo giờ cập nhật cùng transaction với lô log
+            record_log_rows(db, rows)
+            db.commit()
+            self._count("written", len(rows))
+            self._count("batches")
+        except Exception as e:
+            db.rollback()
+            self._count("failed", len(rows))
+            print(f"[WARNING] Failed to write {len(rows)} log rows: {e}")
+        finally:
+            db.close()
+
+    def flush(self):
+        """Ghi hết các dòng đang nằm trong hàng đợi (gọi từ luồng bất kỳ)"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout if timeout is not None else LOG_SHUTDOWN_TIMEOUT)
+            self._thread = None
+        self.flush()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.queue.qsize()
+        stats["capacity"] = self.queue.maxsize
+        stats["overflow_policy"] = self.overflow_policy
+        return stats
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink():
+    """LogSink dùng chung cho cả process"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = LogSink()
+    return _sink
+
+
+def enqueue_log(level, message, source="backend", created_at=None, job_name=None, build_number=None):
+    return get_log_sink().emit(
+        level, message, source=source, created_at=created_at, job_name=job_name, build_number=build_number
+    )
+
+
+def flush_log_sink():
+    """Ghi ngay các dòng đang chờ (ví dụ để dòng vừa thêm hiện ra ở lần đọc tiếp theo)"""
+    get_log_sink().flush()
+
+
+def get_log_sink_stats():
+    return get_log_sink().get_stats()
+
+
+def shutdown_log_sink(timeout=None):
+    if _sink is not None:
+        _sink.shutdown(timeout)
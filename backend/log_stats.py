@@ -0,0 +1,237 @@
+"""
+Thống kê log tổng hợp theo giờ: log_stats_hourly (source, level) và log_error_stats
+(top lỗi theo message đã chuẩn hoá).
+
+log_sink cập nhật các bộ đếm trong cùng transaction với INSERT của mỗi lô log,
+nên /api/logs/stats chỉ đọc bảng tổng hợp (số dòng tỉ lệ với số giờ, không phải số log).
+Xoá log cũng cập nhật tăng dần: bucket bị xoá nguyên khối thì xoá theo (clear_log_stats),
+giờ chỉ bị xoá một phần thì trừ các dòng đã xoá (forget_log_rows).
+Rebuild toàn bộ từ bảng logs chỉ khi khởi tạo lần đầu hoặc chạy tay (POST /api/logs/stats/rebuild):
+    python log_stats.py rebuild
+"""
+import re
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text, func
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal, Log, LogStat, LogErrorStat
+
+_DIGITS = re.compile(r"[0-9]+")
+MESSAGE_KEY_LENGTH = 200
+SAMPLE_MESSAGE_LENGTH = 1000
+
+
+def normalize_message(message):
+    """Khoá nhóm lỗi: thay chữ số (id, build number, thời gian) bằng # và cắt độ dài"""
+    return _DIGITS.sub("#", message or "")[:MESSAGE_KEY_LENGTH]
+
+
+def utc_naive(moment):
+    """Thời điểm UTC không timezone (như cột TIMESTAMP của bảng logs)"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def hour_bucket(moment):
+    """Đầu giờ (UTC, không timezone) chứa moment"""
+    return utc_naive(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def record_log_rows(db, rows, sign=1):
+    """
+    Cộng (sign=1) hoặc trừ (sign=-1, dòng đã xoá) các dòng log (dict level/message/source/created_at)
+    vào bảng tổng hợp; không commit
+    """
+    level_counts = defaultdict(int)
+    error_counts = {}
+    for row in rows:
+        bucket = hour_bucket(row["created_at"])
+        source = row.get("source") or ""
+        level_counts[(bucket, source, row["level"])] += 1
+        if row["level"] == "ERROR":
+            key = (bucket, source, normalize_message(row["message"]))
+            count, _, last_seen = error_counts.get(key, (0, None, None))
+            created_at = utc_naive(row["created_at"])
+            error_counts[key] = (
+                count + 1,
+                row["message"][:SAMPLE_MESSAGE_LENGTH],
+                max(last_seen, created_at) if last_seen else created_at
+            )
+
+    if level_counts:
+        stmt = insert(LogStat).values([
+            {"bucket_start": bucket, "source": source, "level": level, "count": sign * count}
+            for (bucket, source, level), count in level_counts.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["bucket_start", "source", "level"],
+            set_={"count": LogStat.count + stmt.excluded.count}
+        ))
+    if error_counts:
+        stmt = insert(LogErrorStat).values([
+            {
+                "bucket_start": bucket, "source": source, "message_key": key, "count": sign * count,
+                "sample_message": sample, "last_seen": last_seen
+            }
+            for (bucket, source, key), (count, sample, last_seen) in error_counts.items()
+        ])
+        set_ = {"count": LogErrorStat.count + stmt.excluded.count}
+        if sign > 0:
+            set_["sample_message"] = stmt.excluded.sample_message
+            set_["last_seen"] = func.greatest(LogErrorStat.last_seen, stmt.excluded.last_seen)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["bucket_start", "source", "message_key"],
+            set_=set_
+        ))
+
+
+def forget_log_rows(db, rows):
+    """Trừ các dòng log đã xoá (kết quả DELETE ... RETURNING) khỏi bảng tổng hợp; không commit"""
+    if not rows:
+        return
+    record_log_rows(db, rows, sign=-1)
+    db.query(LogStat).filter(LogStat.count <= 0).delete(synchronize_session=False)
+    db.query(LogErrorStat).filter(LogErrorStat.count <= 0).delete(synchronize_session=False)
+
+
+def clear_log_stats(db, source=None, before=None):
+    """
+    Xoá các bucket có log bị xoá hết: theo source và/hoặc bucket_start < before (before phải là
+    đầu giờ). Không truyền gì nghĩa là xoá toàn bộ. Không commit.
+    """
+    for model in (LogStat, LogErrorStat):
+        query = db.query(model)
+        if source is not None:
+            query = query.filter(model.source == source)
+        if before is not None:
+            query = query.filter(model.bucket_start < before)
+        query.delete(synchronize_session=False)
+
+
+def rebuild_log_stats(db):
+    """Tính lại hai bảng tổng hợp từ bảng logs bằng hai câu GROUP BY"""
+    db.execute(text("DELETE FROM log_stats_hourly"))
+    db.execute(text("DELETE FROM log_error_stats"))
+    db.execute(text("""
+        INSERT INTO log_stats_hourly (bucket_start, source, level, count)
+        SELECT date_trunc('hour', created_at), COALESCE(source, ''), level, COUNT(*)
+        FROM logs
+        WHERE created_at IS NOT NULL
+        GROUP BY 1, 2, 3
+    """))
+    db.execute(text("""
+        INSERT INTO log_error_stats (bucket_start, source, message_key, count, sample_message, last_seen)
+        SELECT date_trunc('hour', created_at), COALESCE(source, ''),
+               left(regexp_replace(message, '[0-9]+', '#', 'g'), :key_length),
+               COUNT(*), left(MAX(message), :sample_length), MAX(created_at)
+        FROM logs
+        WHERE created_at IS NOT NULL AND level = 'ERROR'
+        GROUP BY 1, 2, 3
+    """), {"key_length": MESSAGE_KEY_LENGTH, "sample_length": SAMPLE_MESSAGE_LENGTH})
+    db.commit()
+    buckets = db.query(LogStat).count()
+    print(f"[DEBUG] Rebuilt log stats ({buckets} buckets)")
+    return buckets
+
+
+def get_log_stats_summary(db, hours=24, top_errors=10, source=None):
+    """
+    Tổng số log theo source/level (toàn bộ và trong cửa sổ hours giờ gần nhất),
+    histogram theo giờ và top lỗi trong cửa sổ - chỉ đọc bảng tổng hợp.
+    """
+    window_start = hour_bucket(datetime.utcnow()) - timedelta(hours=hours - 1)
+
+    totals = db.query(
+        LogStat.source,
+        LogStat.level,
+        func.sum(LogStat.count),
+        func.sum(LogStat.count).filter(LogStat.bucket_start >= window_start)
+    )
+    if source:
+        totals = totals.filter(LogStat.source == source)
+    totals = totals.group_by(LogStat.source, LogStat.level).all()
+
+    histogram_query = db.query(LogStat.bucket_start, LogStat.level, func.sum(LogStat.count)).filter(
+        LogStat.bucket_start >= window_start
+    )
+    if source:
+        histogram_query = histogram_query.filter(LogStat.source == source)
+    histogram = defaultdict(lambda: defaultdict(int))
+    for bucket, level, count in histogram_query.group_by(LogStat.bucket_start, LogStat.level):
+        histogram[bucket][level.lower()] += int(count or 0)
+
+    errors_query = db.query(
+        LogErrorStat.message_key,
+        func.sum(LogErrorStat.count).label("total"),
+        func.max(LogErrorStat.sample_message),
+        func.max(LogErrorStat.last_seen)
+    ).filter(LogErrorStat.bucket_start >= window_start)
+    if source:
+        errors_query = errors_query.filter(LogErrorStat.source == source)
+    errors = errors_query.group_by(LogErrorStat.message_key).order_by(text("total DESC")).limit(top_errors).all()
+
+    by_source = defaultdict(int)
+    by_level = defaultdict(int)
+    window_total = 0
+    for row_source, level, total, in_window in totals:
+        by_source[row_source or "unknown"] += int(total or 0)
+        by_level[level.lower()] += int(total or 0)
+        window_total += int(in_window or 0)
+
+    # Giờ không có log vẫn có mặt trong histogram (giá trị 0)
+    buckets = []
+    bucket = window_start
+    for _ in range(hours):
+        counts = histogram.get(bucket, {})
+        buckets.append({
+            "hour": bucket.isoformat(),
+            "total": sum(counts.values()),
+            **{level: counts.get(level, 0) for level in ("info", "warning", "error", "debug")}
+        })
+        bucket += timedelta(hours=1)
+
+    return {
+        "total_logs": sum(by_source.values()),
+        "by_source": dict(by_source),
+        "by_level": dict(by_level),
+        "window_hours": hours,
+        "window_total": window_total,
+        "histogram": buckets,
+        "top_errors": [
+            {
+                "message": message_key,
+                "count": int(total or 0),
+                "sample": sample,
+                "last_seen": last_seen.isoformat() if last_seen else None
+            }
+            for message_key, total, sample, last_seen in errors
+        ]
+    }
+
+
+def install_log_stats():
+    """Lần đầu (bảng tổng hợp rỗng) thì backfill từ bảng logs"""
+    try:
+        db = SessionLocal()
+        try:
+            if db.query(LogStat.bucket_start).first() is None and db.query(Log.id).first() is not None:
+                rebuild_log_stats(db)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"[WARNING] Failed to initialize log stats: {e}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        session = SessionLocal()
+        try:
+            rebuild_log_stats(session)
+        finally:
+            session.close()
+    else:
+        print("Usage: python log_stats.py rebuild")
@@ -2,6 +2,7 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import os
 import logging
 
@@ -17,6 +18,18 @@ from routes.log import router as logs_router
 from routes.cicd import router as cicd_router
 from routes.email import router as email_router
 from database import test_connection, create_tables
+from webhook_queue import recover_pending_events, shutdown_queue
+from log_sink import shutdown_log_sink
+from log_partitions import install_log_partitions, stop_log_partition_maintenance
+from log_stats import install_log_stats
+from log_search import install_log_search
+from email_outbox import start_email_dispatcher, shutdown_email_dispatcher
+from email_templates import load_email_templates
+from notification_stream import start_notification_listener, stop_notification_listener
+from jenkins_client import close_async_jenkins_client
+from github_client import close_async_github_client
+from robot_inventory import invalidate_repository
+from stats_rollup import install_dashboard_stats
 
 app = FastAPI(
     title="TestOps API",
@@ -189,6 +202,14 @@ def login_page():
 async def github_webhook(request: Request):
     payload = await request.json()
     logging.warning(f"[GitHub Webhook] Nhận payload: {payload}")
+    # Push làm đổi commit của ref - bỏ cache commit để lần quét robot files sau hỏi lại GitHub
+    repository = payload.get("repository") or {}
+    owner = (repository.get("owner") or {}).get("login") or (repository.get("owner") or {}).get("name")
+    if request.headers.get("X-GitHub-Event", "push") == "push" and owner and repository.get("name"):
+        try:
+            await run_in_threadpool(invalidate_repository, owner, repository["name"])
+        except Exception as e:
+            logging.warning(f"[GitHub Webhook] Không invalidate được inventory cache: {e}")
     return {"status": "ok"}
 
 @app.get("/db-test")
@@ -205,14 +226,40 @@ async def startup_event():
     """Initialize database on startup"""
     print("🚀 Starting TestOps API...")
     
+    # Biên dịch template email (inline CSS) một lần, không cần database
+    load_email_templates()
+    
     # Test database connection
     if test_connection():
         # Create tables if they don't exist
         create_tables()
         print("✅ Database tables created/verified")
+        install_dashboard_stats()
+        # logs phân vùng theo thời gian + retention bằng DROP partition
+        install_log_partitions()
+        install_log_stats()
+        install_log_search()
+        # Xử lý tiếp các webhook Jenkins còn dang dở từ lần chạy trước
+        recover_pending_events()
+        # Gửi email từ bảng email_outbox ở luồng nền
+        start_email_dispatcher()
+        # LISTEN sự kiện thông báo từ mọi worker để đẩy qua SSE
+        start_notification_listener()
     else:
         print("⚠️ Database connection failed - some features may not work")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers on shutdown"""
+    shutdown_queue(wait=False)
+    shutdown_email_dispatcher(wait=False)
+    stop_notification_listener(wait=False)
+    # Ghi nốt các dòng log còn trong hàng đợi
+    shutdown_log_sink()
+    stop_log_partition_maintenance()
+    await close_async_jenkins_client()
+    await close_async_github_client()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True) 
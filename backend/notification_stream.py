@@ -0,0 +1,197 @@
+"""
+Luồng thông báo đẩy từ server (Server-Sent Events) thay cho việc trình duyệt poll
+/api/reports/notifications/list mỗi 30 giây.
+
+- Trong process: NotificationBroker giữ một asyncio.Queue cho mỗi kết nối SSE.
+  publish_notification_event gọi được từ mọi luồng (webhook worker, threadpool của route sync) -
+  sự kiện được đưa vào event loop của từng kết nối bằng call_soon_threadsafe.
+- Nhiều worker uvicorn: sự kiện đi qua PostgreSQL NOTIFY trên kênh NOTIFICATION_CHANNEL; mỗi worker
+  có một luồng LISTEN (một kết nối rảnh, không chạy query) và phát lại cho các kết nối SSE của nó.
+  Khi LISTEN không hoạt động, sự kiện chỉ được phát trong process hiện tại.
+- Sự kiện là delta: created (kèm notification), read (ids), read_all, cleared, mỗi sự kiện mang
+  unread_count mới. Kết nối mới (hoặc kết nối lại) nhận một snapshot; khi có thể đã lỡ sự kiện
+  (queue đầy, LISTEN kết nối lại) client nhận resync và tự tải lại danh sách.
+Dashboard mở mà không có thông báo mới không tạo query nào tới database.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+
+from sqlalchemy import text
+
+from database import DATABASE_URL, engine
+
+NOTIFICATION_CHANNEL = "notification_events"
+NOTIFICATION_STREAM_QUEUE_SIZE = int(os.getenv("NOTIFICATION_STREAM_QUEUE_SIZE", "100"))
+NOTIFICATION_STREAM_KEEPALIVE = float(os.getenv("NOTIFICATION_STREAM_KEEPALIVE", "25"))
+# Giới hạn payload của NOTIFY là 8000 byte
+NOTIFY_MAX_PAYLOAD = 7900
+
+
+class _Subscription:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=NOTIFICATION_STREAM_QUEUE_SIZE)
+
+    def offer(self, event):
+        """Chạy trong event loop của kết nối: queue đầy thì bỏ hết và yêu cầu client resync"""
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {"type": "resync"}
+        self.queue.put_nowait(event)
+
+
+class NotificationBroker:
+    """Pub/sub trong process cho các kết nối SSE"""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = _Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def dispatch(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Event loop đã đóng (server đang tắt)
+                self.unsubscribe(subscription)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+broker = NotificationBroker()
+
+_listening = threading.Event()
+_stopping = threading.Event()
+_listener = None
+
+
+def publish_notification_event(event):
+    """
+    Phát một sự kiện thông báo tới mọi kết nối SSE (mọi worker qua NOTIFY nếu LISTEN đang chạy).
+    Gọi sau khi đã commit thay đổi của bảng notifications.
+    """
+    if _listening.is_set():
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        if len(payload.encode("utf-8")) > NOTIFY_MAX_PAYLOAD:
+            payload = json.dumps({"type": "resync", "unread_count": event.get("unread_count")})
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                   {"channel": NOTIFICATION_CHANNEL, "payload": payload})
+            return
+        except Exception as e:
+            print(f"[WARNING] NOTIFY failed, publishing notification event locally: {e}")
+    broker.dispatch(event)
+
+
+def _listen_loop():
+    import psycopg2
+
+    backoff = 1
+    while not _stopping.is_set():
+        connection = None
+        try:
+            connection = psycopg2.connect(DATABASE_URL)
+            connection.set_session(autocommit=True)
+            connection.cursor().execute(f"LISTEN {NOTIFICATION_CHANNEL}")
+            if backoff > 1:
+                # Có thể đã lỡ sự kiện trong lúc mất kết nối
+                broker.dispatch({"type": "resync"})
+            _listening.set()
+            backoff = 1
+            while not _stopping.is_set():
+                if not select.select([connection], [], [], 5)[0]:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        broker.dispatch(json.loads(notify.payload))
+                    except ValueError:
+                        print(f"[WARNING] Invalid notification event payload: {notify.payload[:200]}")
+        except Exception as e:
+            _listening.clear()
+            print(f"[WARNING] Notification listener error: {e} - reconnecting in {backoff}s")
+            _stopping.wait(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            _listening.clear()
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+def start_notification_listener():
+    global _listener
+    if _listener is not None:
+        return
+    _stopping.clear()
+    _listener = threading.Thread(target=_listen_loop, name="notification-listener", daemon=True)
+    _listener.start()
+
+
+def stop_notification_listener(wait=True):
+    """Dừng luồng LISTEN; luồng tự thoát sau tối đa 5 giây (timeout của select)"""
+    global _listener
+    _stopping.set()
+    if _listener is not None:
+        _listener.join(6 if wait else 1)
+        _listener = None
+
+
+def format_sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def notification_event_stream(request, load_snapshot):
+    """
+    Generator SSE cho một kết nối: snapshot (load_snapshot chạy trong threadpool) rồi các delta,
+    comment keep-alive mỗi NOTIFICATION_STREAM_KEEPALIVE giây để proxy không cắt kết nối.
+    """
+    from fastapi.concurrency import run_in_threadpool
+
+    # Đăng ký trước khi đọc snapshot để không lỡ sự kiện xảy ra trong lúc đọc
+    subscription = broker.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        yield format_sse("snapshot", await run_in_threadpool(load_snapshot))
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=NOTIFICATION_STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse("notification", event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def get_notification_stream_stats():
+    return {
+        "subscribers": broker.subscriber_count,
+        "listening": _listening.is_set(),
+        "channel": NOTIFICATION_CHANNEL,
+    }
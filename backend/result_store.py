@@ -0,0 +1,80 @@
+"""
+Lưu kết quả từng test case (bảng test_results) bằng COPY của PostgreSQL.
+
+TestResultCollector được truyền làm on_test cho robot_output.parse_output_xml,
+sau khi report được tạo thì save_test_results ghi toàn bộ các dòng trong một lệnh COPY.
+"""
+import csv
+import hashlib
+import io
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import TestMessage
+
+COPY_NULL = r'\N'
+MAX_NAME_LENGTH = 500
+
+
+class TestResultCollector:
+    """Gom kết quả test case trong lúc parse output.xml"""
+
+    def __init__(self):
+        self.rows = []
+        self.messages = {}
+
+    def __call__(self, suite, name, status, duration_ms, message):
+        message_hash = None
+        if message:
+            message_hash = hashlib.md5(message.encode('utf-8')).hexdigest()
+            self.messages.setdefault(message_hash, message)
+        self.rows.append((suite, name, status, duration_ms, message_hash))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _copy_value(value):
+    return COPY_NULL if value is None else value
+
+
+def save_test_results(report_id, collector, db):
+    """
+    Bulk insert kết quả test case của một report bằng COPY ... FROM STDIN.
+    Chạy trong transaction hiện tại của session; trả về số dòng đã ghi.
+    """
+    if not collector.rows:
+        return 0
+
+    if collector.messages:
+        stmt = insert(TestMessage).values(
+            [{"message_hash": h, "message": m} for h, m in collector.messages.items()]
+        ).on_conflict_do_nothing(index_elements=["message_hash"])
+        db.execute(stmt)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for suite, name, status, duration_ms, message_hash in collector.rows:
+        writer.writerow([
+            report_id,
+            _copy_value(suite[:MAX_NAME_LENGTH] if suite is not None else None),
+            name[:MAX_NAME_LENGTH],
+            status[:10],
+            _copy_value(duration_ms),
+            _copy_value(message_hash)
+        ])
+    buffer.seek(0)
+
+    # Dùng connection DBAPI (psycopg2) của chính session để COPY nằm trong cùng transaction
+    raw_connection = db.connection().connection
+    cursor = raw_connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY test_results (report_id, suite, name, status, duration_ms, message_hash) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+    finally:
+        cursor.close()
+    db.commit()
+    return len(collector.rows)
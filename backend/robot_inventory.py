@@ -0,0 +1,372 @@
+"""
+Tìm file .robot trong repository GitHub bằng Git Trees API.
+
+Một request /git/trees/{sha}?recursive=1 trả về toàn bộ cây thư mục thay vì gọi
+contents API cho từng thư mục. Nếu GitHub cắt bớt cây (truncated, repo rất lớn) thì
+duyệt từng thư mục bằng tree API không đệ quy, song song tối đa GITHUB_TREE_CONCURRENCY request.
+
+Kết quả được cache trong database theo (owner, repo, commit sha):
+- repository_heads giữ commit mới nhất của ref cùng ETag; lần sau hỏi GitHub bằng
+  If-None-Match, 304 không tính vào rate limit và dùng lại commit đã biết.
+- repository_inventories giữ danh sách file .robot của từng commit. Mỗi repo giữ tối đa
+  INVENTORY_KEEP_PER_REPO commit gần nhất, bản không dùng quá INVENTORY_MAX_AGE_DAYS ngày bị xoá.
+- invalidate_repository() được gọi từ GitHub push webhook (main.py).
+
+Test case trong từng file được parse bởi robot_source và cache theo blob SHA (robot_blobs):
+lần đồng bộ sau chỉ tải và parse lại những file có nội dung thay đổi.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal, RepositoryHead, RepositoryInventory, RobotBlob
+from github_client import get_async_github_client
+from robot_source import RobotSourceParser
+
+GITHUB_TREE_CONCURRENCY = int(os.getenv("GITHUB_TREE_CONCURRENCY", "8"))
+GITHUB_FETCH_CONCURRENCY = int(os.getenv("GITHUB_FETCH_CONCURRENCY", "8"))
+INVENTORY_KEEP_PER_REPO = int(os.getenv("INVENTORY_KEEP_PER_REPO", "3"))
+INVENTORY_MAX_AGE_DAYS = int(os.getenv("INVENTORY_MAX_AGE_DAYS", "30"))
+ROBOT_EXTENSION = ".robot"
+
+
+class GitHubUnavailableError(Exception):
+    """GitHub lỗi tạm thời (rate limit 403/429, 5xx, lỗi mạng) - khác với repo không tồn tại"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def _github_get(url, **kwargs):
+    """
+    GET tới GitHub API. Lỗi mạng, 403/429 (rate limit) và 5xx raise GitHubUnavailableError
+    để route trả 503 thay vì báo repository không tồn tại; các mã khác trả về cho caller.
+    """
+    client = get_async_github_client()
+    try:
+        response = await client.get(url, **kwargs)
+    except httpx.HTTPError as e:
+        raise GitHubUnavailableError(f"Không kết nối được GitHub: {e}")
+    if response.status_code in (403, 429) or response.status_code >= 500:
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        print(f"[WARNING] GitHub {url}: {response.status_code} (rate limit còn lại: {remaining})")
+        raise GitHubUnavailableError(f"GitHub trả về {response.status_code}", response.status_code)
+    return response
+
+
+def _repo_key(owner, repo):
+    # Tên owner/repo trên GitHub không phân biệt hoa thường
+    return owner.lower(), repo.lower()
+
+
+def load_head(owner, repo, ref="HEAD"):
+    owner, repo = _repo_key(owner, repo)
+    db = SessionLocal()
+    try:
+        head = db.query(RepositoryHead).filter(
+            RepositoryHead.owner == owner, RepositoryHead.repo == repo, RepositoryHead.ref == ref
+        ).first()
+        return (head.commit_sha, head.etag) if head else (None, None)
+    finally:
+        db.close()
+
+
+def save_head(owner, repo, ref, commit_sha, etag):
+    owner, repo = _repo_key(owner, repo)
+    db = SessionLocal()
+    try:
+        db.merge(RepositoryHead(
+            owner=owner, repo=repo, ref=ref,
+            commit_sha=commit_sha, etag=etag, checked_at=datetime.utcnow()
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Không lưu được repository head {owner}/{repo}: {e}")
+    finally:
+        db.close()
+
+
+def load_inventory(owner, repo, commit_sha):
+    """Danh sách file đã cache của commit, None nếu chưa có (hoặc bản cũ không chắc đầy đủ)"""
+    owner, repo = _repo_key(owner, repo)
+    db = SessionLocal()
+    try:
+        inventory = db.query(RepositoryInventory).filter(
+            RepositoryInventory.owner == owner,
+            RepositoryInventory.repo == repo,
+            RepositoryInventory.commit_sha == commit_sha,
+            RepositoryInventory.complete.is_(True)
+        ).first()
+        if not inventory:
+            return None
+        inventory.last_used_at = datetime.utcnow()
+        db.commit()
+        return inventory.files
+    finally:
+        db.close()
+
+
+def save_inventory(owner, repo, commit_sha, files):
+    """Chỉ gọi với inventory dựng từ cây đầy đủ - commit không đổi nên bản thiếu sẽ bị dùng mãi"""
+    owner, repo = _repo_key(owner, repo)
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        db.merge(RepositoryInventory(
+            owner=owner, repo=repo, commit_sha=commit_sha,
+            files=files, complete=True, created_at=now, last_used_at=now
+        ))
+        db.flush()
+        evict_inventories(db, owner, repo)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Không lưu được inventory {owner}/{repo}@{commit_sha}: {e}")
+    finally:
+        db.close()
+
+
+def evict_inventories(db, owner, repo):
+    """Giữ INVENTORY_KEEP_PER_REPO commit dùng gần nhất của repo, xoá các bản quá hạn"""
+    keep = db.query(RepositoryInventory.commit_sha).filter(
+        RepositoryInventory.owner == owner, RepositoryInventory.repo == repo
+    ).order_by(RepositoryInventory.last_used_at.desc()).limit(INVENTORY_KEEP_PER_REPO).subquery()
+    db.query(RepositoryInventory).filter(
+        RepositoryInventory.owner == owner,
+        RepositoryInventory.repo == repo,
+        RepositoryInventory.commit_sha.notin_(db.query(keep.c.commit_sha))
+    ).delete(synchronize_session=False)
+
+    cutoff = datetime.utcnow() - timedelta(days=INVENTORY_MAX_AGE_DAYS)
+    db.query(RepositoryInventory).filter(
+        RepositoryInventory.last_used_at < cutoff
+    ).delete(synchronize_session=False)
+
+
+def invalidate_repository(owner, repo):
+    """
+    Hook cho GitHub push webhook: quên commit mới nhất của repo để lần gọi sau hỏi lại GitHub.
+    Inventory theo commit cũ vẫn đúng nên được giữ lại cho tới khi bị evict.
+    """
+    owner, repo = _repo_key(owner, repo)
+    db = SessionLocal()
+    try:
+        deleted = db.query(RepositoryHead).filter(
+            RepositoryHead.owner == owner, RepositoryHead.repo == repo
+        ).delete(synchronize_session=False)
+        db.commit()
+        print(f"[DEBUG] Invalidate inventory cache {owner}/{repo}: {deleted} ref")
+        return deleted
+    finally:
+        db.close()
+
+
+async def resolve_commit_sha(owner, repo, ref="HEAD"):
+    """
+    SHA commit của ref (mặc định nhánh mặc định), None nếu repo không tồn tại/không truy cập được.
+    Gửi If-None-Match với ETag đã lưu; 304 nghĩa là ref chưa đổi.
+    GitHub bị rate limit hoặc lỗi thì raise GitHubUnavailableError.
+    """
+    cached_sha, etag = await run_in_threadpool(load_head, owner, repo, ref)
+    headers = {"Accept": "application/vnd.github.sha"}
+    if cached_sha and etag:
+        headers["If-None-Match"] = etag
+
+    response = await _github_get(f"/repos/{owner}/{repo}/commits/{ref}", headers=headers)
+    if response.status_code == 304 and cached_sha:
+        return cached_sha
+    if response.status_code != 200:
+        print(f"[DEBUG] GitHub commits/{ref} {owner}/{repo}: {response.status_code}")
+        return None
+
+    commit_sha = response.text.strip()
+    await run_in_threadpool(save_head, owner, repo, ref, commit_sha, response.headers.get("ETag"))
+    return commit_sha
+
+
+async def _get_tree(owner, repo, tree_sha, recursive=False):
+    params = {"recursive": "1"} if recursive else None
+    response = await _github_get(f"/repos/{owner}/{repo}/git/trees/{tree_sha}", params=params)
+    if response.status_code != 200:
+        print(f"[DEBUG] GitHub tree {owner}/{repo}@{tree_sha}: {response.status_code}")
+        return None
+    return response.json()
+
+
+async def _walk_tree(owner, repo, root_sha):
+    """
+    Duyệt cây theo từng tầng, các thư mục cùng tầng được lấy song song (có giới hạn).
+    Trả về None ngay khi một thư mục con không lấy được - không trả về cây thiếu.
+    """
+    semaphore = asyncio.Semaphore(GITHUB_TREE_CONCURRENCY)
+
+    async def fetch(prefix, tree_sha):
+        async with semaphore:
+            return prefix, await _get_tree(owner, repo, tree_sha)
+
+    entries = []
+    pending = [("", root_sha)]
+    while pending:
+        results = await asyncio.gather(*[fetch(prefix, sha) for prefix, sha in pending])
+        pending = []
+        for prefix, tree in results:
+            if tree is None:
+                print(f"[DEBUG] Không lấy được thư mục '{prefix or '/'}' của {owner}/{repo}, bỏ kết quả duyệt")
+                return None
+            for item in tree.get("tree", []):
+                path = f"{prefix}{item['path']}"
+                if item.get("type") == "tree":
+                    pending.append((f"{path}/", item["sha"]))
+                elif item.get("type") == "blob":
+                    entries.append({**item, "path": path})
+    return entries
+
+
+async def list_repository_files(owner, repo, commit_sha):
+    """Toàn bộ blob trong repo tại commit_sha; None nếu không đọc được đầy đủ cây"""
+    tree = await _get_tree(owner, repo, commit_sha, recursive=True)
+    if tree is None:
+        return None
+    if not tree.get("truncated"):
+        return [item for item in tree.get("tree", []) if item.get("type") == "blob"]
+
+    print(f"[DEBUG] Tree {owner}/{repo}@{commit_sha} bị cắt bớt, duyệt song song từng thư mục")
+    return await _walk_tree(owner, repo, tree["sha"])
+
+
+async def discover_robot_files(owner, repo, ref="HEAD"):
+    """
+    Danh sách file .robot của repo: [{name, path, size, sha, download_url}], sắp theo path.
+    Trả về None nếu repository không tồn tại hoặc không truy cập được;
+    raise GitHubUnavailableError nếu GitHub bị rate limit/lỗi tạm thời.
+    """
+    commit_sha = await resolve_commit_sha(owner, repo, ref)
+    if not commit_sha:
+        return None
+
+    cached = await run_in_threadpool(load_inventory, owner, repo, commit_sha)
+    if cached is not None:
+        print(f"[DEBUG] {owner}/{repo}@{commit_sha[:7]}: dùng inventory đã cache ({len(cached)} file .robot)")
+        return cached
+
+    # list_repository_files trả None khi cây không đầy đủ (thư mục con lỗi) - không cache bản thiếu
+    files = await list_repository_files(owner, repo, commit_sha)
+    if files is None:
+        return None
+
+    robot_files = []
+    for item in files:
+        path = item["path"]
+        if not path.endswith(ROBOT_EXTENSION):
+            continue
+        robot_files.append({
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "size": item.get("size", 0),
+            "sha": item["sha"],
+            "download_url": f"https://raw.githubusercontent.com/{owner}/{repo}/{commit_sha}/{path}"
+        })
+    robot_files.sort(key=lambda f: f["path"])
+    print(f"[DEBUG] {owner}/{repo}@{commit_sha[:7]}: {len(robot_files)} file .robot / {len(files)} file")
+    await run_in_threadpool(save_inventory, owner, repo, commit_sha, robot_files)
+    return robot_files
+
+
+def load_parsed_blobs(blob_shas):
+    """{blob_sha: test_cases} cho các blob đã parse, đồng thời đánh dấu đã dùng"""
+    if not blob_shas:
+        return {}
+    db = SessionLocal()
+    try:
+        rows = db.query(RobotBlob.blob_sha, RobotBlob.test_cases).filter(RobotBlob.blob_sha.in_(blob_shas)).all()
+        if rows:
+            db.query(RobotBlob).filter(RobotBlob.blob_sha.in_([row[0] for row in rows])).update(
+                {RobotBlob.last_used_at: datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+        return {blob_sha: test_cases for blob_sha, test_cases in rows}
+    finally:
+        db.close()
+
+
+def save_parsed_blobs(parsed):
+    if not parsed:
+        return
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        stmt = insert(RobotBlob).values([
+            {"blob_sha": blob_sha, "test_cases": test_cases, "parsed_at": now, "last_used_at": now}
+            for blob_sha, test_cases in parsed.items()
+        ]).on_conflict_do_nothing(index_elements=["blob_sha"])
+        db.execute(stmt)
+        # Blob không còn file nào dùng tới trong INVENTORY_MAX_AGE_DAYS ngày
+        cutoff = now - timedelta(days=INVENTORY_MAX_AGE_DAYS)
+        db.query(RobotBlob).filter(RobotBlob.last_used_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Không lưu được cache robot_blobs: {e}")
+    finally:
+        db.close()
+
+
+async def fetch_test_cases(download_url):
+    """Tải file .robot dạng stream và parse từng dòng; None nếu tải lỗi"""
+    client = get_async_github_client()
+    parser = RobotSourceParser()
+    test_cases = []
+    try:
+        async with client.stream("GET", download_url) as response:
+            if response.status_code != 200:
+                print(f"[DEBUG] Không tải được {download_url}: {response.status_code}")
+                return None
+            async for line in response.aiter_lines():
+                test = parser.feed(line)
+                if test:
+                    test_cases.append(test)
+    except Exception as e:
+        print(f"[DEBUG] Lỗi tải {download_url}: {e}")
+        return None
+    test = parser.close()
+    if test:
+        test_cases.append(test)
+    return test_cases
+
+
+async def collect_test_cases(robot_files):
+    """
+    {blob_sha: [{name, tags, line}]} cho các file của discover_robot_files.
+    Blob đã có trong cache không tải lại; blob mới được tải song song
+    (tối đa GITHUB_FETCH_CONCURRENCY). Blob tải lỗi không có trong kết quả.
+    """
+    files_by_sha = {}
+    for robot_file in robot_files:
+        files_by_sha.setdefault(robot_file["sha"], robot_file)
+
+    result = await run_in_threadpool(load_parsed_blobs, list(files_by_sha))
+    missing = [sha for sha in files_by_sha if sha not in result]
+    if not missing:
+        return result
+
+    semaphore = asyncio.Semaphore(GITHUB_FETCH_CONCURRENCY)
+
+    async def bounded_fetch(sha):
+        async with semaphore:
+            return sha, await fetch_test_cases(files_by_sha[sha]["download_url"])
+
+    parsed = {
+        sha: test_cases
+        for sha, test_cases in await asyncio.gather(*[bounded_fetch(sha) for sha in missing])
+        if test_cases is not None
+    }
+    print(f"[DEBUG] Parse .robot: {len(parsed)}/{len(missing)} blob mới, {len(result)} blob từ cache")
+    await run_in_threadpool(save_parsed_blobs, parsed)
+    result.update(parsed)
+    return result
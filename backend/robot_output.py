@@ -0,0 +1,160 @@
+"""
+Parser output.xml của Robot Framework theo kiểu streaming (iterparse).
+
+Thay cho ET.fromstring(response.text): đọc trực tiếp từ HTTP response, giải phóng
+từng element ngay sau khi xử lý nên bộ nhớ không phụ thuộc kích thước file
+(output.xml của bộ regression có thể lên tới hàng trăm MB).
+"""
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+ROBOT_TIME_FORMAT = '%Y%m%d %H:%M:%S.%f'
+
+
+def _parse_robot_time(value):
+    """Parse thời gian trong output.xml (RF <= 6: '20240101 12:00:00.123', RF 7: ISO 8601)"""
+    if not value or value == 'N/A':
+        return None
+    try:
+        return datetime.strptime(value, ROBOT_TIME_FORMAT)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def _empty_summary():
+    return {
+        "total_tests": 0,
+        "passed_tests": 0,
+        "failed_tests": 0,
+        "skipped_tests": 0,
+        "start_time": None,
+        "end_time": None,
+        "duration_seconds": 0
+    }
+
+
+def _status_duration_ms(status_elem):
+    """Thời gian chạy (ms) từ <status> (RF <= 6: starttime/endtime, RF 7: elapsed)"""
+    elapsed = status_elem.get('elapsed')
+    if elapsed:
+        try:
+            return int(float(elapsed) * 1000)
+        except ValueError:
+            return None
+    start = _parse_robot_time(status_elem.get('starttime'))
+    end = _parse_robot_time(status_elem.get('endtime'))
+    if start and end:
+        return int((end - start).total_seconds() * 1000)
+    return None
+
+
+def parse_output_xml(source, on_test=None):
+    """
+    Parse output.xml từ file-like object (bytes) hoặc đường dẫn file.
+
+    Lấy thống kê từ <statistics>/<total>/<stat> đầu tiên và thời gian bắt đầu/kết thúc
+    của suite gốc. Trả về dict gồm total_tests, passed_tests, failed_tests, skipped_tests,
+    start_time, end_time, duration_seconds. Ném ET.ParseError nếu XML không hợp lệ.
+
+    Nếu truyền on_test, hàm này được gọi cho từng test case với
+    (suite, name, status, duration_ms, message) - suite là tên đầy đủ dạng "Root.Child".
+    """
+    summary = _empty_summary()
+    stack = []
+    top_suite_depth = None
+    suite_start = None
+    suite_end = None
+    suite_elapsed = None
+    stat_found = False
+    # Tên đầy đủ của các suite đang mở và trạng thái của test hiện tại
+    suite_names = []
+    test_status = None
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if elem.tag == "suite":
+                if top_suite_depth is None:
+                    top_suite_depth = len(stack)
+                    # Một số phiên bản ghi thời gian trực tiếp trên <suite>
+                    suite_start = elem.get('starttime')
+                    suite_end = elem.get('endtime')
+                name = elem.get('name', '')
+                suite_names.append(f"{suite_names[-1]}.{name}" if suite_names else name)
+            elif elem.tag == "test":
+                test_status = None
+            continue
+
+        depth = len(stack)
+        tag = elem.tag
+        parent_tag = stack[-2].tag if depth >= 2 else None
+
+        if tag == "status" and parent_tag == "test":
+            test_status = (elem.get('status'), _status_duration_ms(elem), (elem.text or '').strip() or None)
+        elif tag == "test":
+            if on_test is not None and parent_tag == "suite":
+                status, duration_ms, message = test_status or (None, None, None)
+                on_test(suite_names[-1] if suite_names else '', elem.get('name', ''), status or 'NOT RUN', duration_ms, message)
+            test_status = None
+        elif tag == "suite":
+            if suite_names:
+                suite_names.pop()
+        elif tag == "status" and top_suite_depth is not None and depth == top_suite_depth + 1 \
+                and parent_tag == "suite":
+            # <status> trực tiếp của suite gốc
+            suite_start = suite_start or elem.get('starttime') or elem.get('start')
+            suite_end = suite_end or elem.get('endtime')
+            suite_elapsed = elem.get('elapsed')
+        elif tag == "stat" and not stat_found and depth >= 3 \
+                and stack[-2].tag == "total" and stack[-3].tag == "statistics":
+            summary["passed_tests"] = int(elem.get('pass', 0))
+            summary["failed_tests"] = int(elem.get('fail', 0))
+            summary["skipped_tests"] = int(elem.get('skip', 0))
+            summary["total_tests"] = summary["passed_tests"] + summary["failed_tests"] + summary["skipped_tests"]
+            stat_found = True
+
+        stack.pop()
+        # Giải phóng element đã xử lý: xoá nội dung và gỡ khỏi parent (luôn là con cuối cùng)
+        elem.clear()
+        if stack:
+            del stack[-1][-1]
+
+        if stat_found and tag == "statistics":
+            # Phần còn lại (<errors>) không cần thiết
+            break
+
+    start_time = _parse_robot_time(suite_start)
+    end_time = _parse_robot_time(suite_end)
+    if start_time and not end_time and suite_elapsed:
+        try:
+            end_time = start_time + timedelta(seconds=float(suite_elapsed))
+        except ValueError:
+            pass
+    if start_time and end_time:
+        summary["start_time"] = start_time
+        summary["end_time"] = end_time
+        summary["duration_seconds"] = int((end_time - start_time).total_seconds())
+
+    return summary
+
+
+def fetch_output_xml_summary(session, url, timeout=None, on_test=None):
+    """
+    Tải output.xml từ Jenkins dạng stream và parse ngay trên response.
+    timeout=None: JenkinsClient tự chọn timeout cho artifact.
+    Trả về None nếu Jenkins không trả về 200. Có thể ném requests.RequestException
+    hoặc ET.ParseError.
+    """
+    response = session.get(url, timeout=timeout, stream=True)
+    try:
+        if response.status_code != 200:
+            return None
+        # Giải nén gzip/deflate nếu Jenkins trả về nội dung nén
+        response.raw.decode_content = True
+        return parse_output_xml(response.raw, on_test=on_test)
+    finally:
+        response.close()
@@ -0,0 +1,153 @@
+"""
+Parser file nguồn Robot Framework (.robot) - chỉ đọc phần *** Test Cases ***.
+
+Đọc từng dòng (không cần nạp cả file), trả về từng test case với tên, tags và số dòng.
+Hỗ trợ định dạng phân tách bằng khoảng trắng/tab và định dạng pipe (| ... |),
+[Tags] nhiều dòng (...), Test Tags / Force Tags / Default Tags trong *** Settings ***.
+Tags từ Settings được áp dụng theo những gì đã đọc trước test case (Settings thường nằm đầu file).
+"""
+import re
+
+_SPACE_SEPARATOR = re.compile(r"\s{2,}|\t")
+_PIPE_SEPARATOR = re.compile(r"\s+\|\s+")
+
+TEST_CASES_SECTION = "testcases"
+SETTINGS_SECTION = "settings"
+
+
+def split_cells(line):
+    """Tách một dòng thành các ô; ô đầu rỗng nghĩa là dòng thụt đầu dòng"""
+    line = line.rstrip("\r\n")
+    if line.startswith("|"):
+        body = line[1:].rstrip()
+        if body.endswith(" |"):
+            body = body[:-2]
+        cells = [cell.strip() for cell in _PIPE_SEPARATOR.split(" " + body + " ")]
+    else:
+        cells = [cell.strip() for cell in _SPACE_SEPARATOR.split(line.rstrip())]
+        if line[:1] in (" ", "\t"):
+            cells.insert(0, "")
+            if len(cells) > 1 and cells[1] == "":
+                del cells[1]
+
+    # Bỏ phần comment: từ ô bắt đầu bằng # tới hết dòng
+    for index, cell in enumerate(cells):
+        if cell.startswith("#"):
+            return cells[:index]
+    return cells
+
+
+def section_name(cells):
+    """Tên section đã chuẩn hoá nếu dòng là header (*** Test Cases ***), ngược lại None"""
+    if not cells or not cells[0].startswith("*"):
+        return None
+    name = cells[0].strip("* ").replace(" ", "").lower()
+    if name in ("testcases", "testcase"):
+        return TEST_CASES_SECTION
+    if name in ("settings", "setting"):
+        return SETTINGS_SECTION
+    return name
+
+
+class RobotSourceParser:
+    """Parser theo dòng: feed(line) trả về test case vừa hoàn tất (nếu có), close() trả về test cuối"""
+
+    def __init__(self):
+        self.line_number = 0
+        self.section = None
+        self.force_tags = []
+        self.default_tags = []
+        self._current = None
+        self._continuing = None  # Setting đang được nối bởi dòng "..."
+
+    def _finish_current(self):
+        test = self._current
+        self._current = None
+        if test is None:
+            return None
+        tags = test["tags"] if test["tags"] is not None else list(self.default_tags)
+        test["tags"] = sorted(set(self.force_tags + tags), key=str.lower)
+        return test
+
+    def feed(self, line):
+        self.line_number += 1
+        cells = split_cells(line)
+        if not cells or all(cell == "" for cell in cells):
+            return None
+
+        section = section_name(cells)
+        if section is not None:
+            finished = self._finish_current()
+            self.section = section
+            self._continuing = None
+            return finished
+
+        if self.section == SETTINGS_SECTION:
+            self._feed_setting(cells)
+            return None
+        if self.section != TEST_CASES_SECTION:
+            return None
+
+        if cells[0] != "":
+            # Dòng không thụt đầu dòng: bắt đầu test case mới
+            finished = self._finish_current()
+            self._current = {"name": cells[0], "tags": None, "line": self.line_number}
+            self._continuing = None
+            self._feed_test_setting(cells[1:])
+            return finished
+
+        self._feed_test_setting(cells[1:])
+        return None
+
+    def _feed_test_setting(self, cells):
+        if self._current is None or not cells:
+            return
+        head = cells[0]
+        if head == "...":
+            if self._continuing == "tags":
+                self._current["tags"].extend(c for c in cells[1:] if c)
+            return
+        if head.replace(" ", "").lower() == "[tags]":
+            self._current["tags"] = [c for c in cells[1:] if c]
+            self._continuing = "tags"
+        else:
+            self._continuing = None
+
+    def _feed_setting(self, cells):
+        head = cells[0]
+        values = [c for c in cells[1:] if c]
+        if head == "...":
+            if self._continuing == "force":
+                self.force_tags.extend(values)
+            elif self._continuing == "default":
+                self.default_tags.extend(values)
+            return
+        key = head.replace(" ", "").lower()
+        if key in ("testtags", "forcetags"):
+            self.force_tags.extend(values)
+            self._continuing = "force"
+        elif key == "defaulttags":
+            self.default_tags.extend(values)
+            self._continuing = "default"
+        else:
+            self._continuing = None
+
+    def close(self):
+        return self._finish_current()
+
+
+def iter_test_cases(lines):
+    """Generator: {name, tags, line} cho từng test case trong các dòng của file .robot"""
+    parser = RobotSourceParser()
+    for line in lines:
+        test = parser.feed(line)
+        if test:
+            yield test
+    test = parser.close()
+    if test:
+        yield test
+
+
+def parse_robot_source(text):
+    """Danh sách test case của nội dung file .robot"""
+    return list(iter_test_cases(text.splitlines()))
@@ -7,6 +7,8 @@ from fastapi import Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import func, text
 import logging
+from jenkins_client import get_jenkins_client
+from email_digest import normalize_digest_mode
 
 router = APIRouter()
 
@@ -16,18 +18,8 @@ def get_jenkins_jobs():
     try:
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         api_url = f"{JENKINS_URL}/api/json"
-        session = requests.Session()
-        # Lấy CSRF crumb nếu cần (nếu Jenkins bật bảo mật)
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-        headers = {}
-        try:
-            crumb_response = session.get(crumb_url, timeout=10)
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-        except Exception:
-            pass  # Nếu không lấy được crumb thì bỏ qua (Jenkins không bật CSRF)
-        response = session.get(api_url, headers=headers, timeout=15)
+        session = get_jenkins_client()
+        response = session.get(api_url)
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code, detail=f"Jenkins API error: {response.text}")
         data = response.json()
@@ -67,6 +59,10 @@ def create_cicd(data: dict, db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == data["project_id"]).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        email_digest = normalize_digest_mode(data.get("email_digest"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Tìm ID nhỏ nhất có sẵn
     next_id = get_next_available_cicd_id(db)
@@ -81,6 +77,7 @@ def create_cicd(data: dict, db: Session = Depends(get_db)):
         jenkins_job=data["jenkins_job"].strip(),
         project_id=data["project_id"],
         email_recipients=data.get("email_recipients", "").strip() if data.get("email_recipients") else None,
+        email_digest=email_digest,
         status="initialized"
     )
     db.add(new_cicd)
@@ -99,6 +96,7 @@ def create_cicd(data: dict, db: Session = Depends(get_db)):
             "project_id": new_cicd.project_id,
             "status": new_cicd.status,
             "email_recipients": new_cicd.email_recipients,
+            "email_digest": new_cicd.email_digest,
             "created_at": new_cicd.created_at.isoformat() if new_cicd.created_at else None
         }
     }
@@ -122,6 +120,7 @@ def list_cicd(project_id: int = None, db: Session = Depends(get_db)):
             "project_name": c.project_name,
             "status": c.Cicd.status,
             "email_recipients": c.Cicd.email_recipients,
+            "email_digest": c.Cicd.email_digest,
             "created_at": c.Cicd.created_at.isoformat() if c.Cicd.created_at else None
         } for c in results
     ]}
@@ -149,6 +148,7 @@ def get_cicd(cicd_id: int, db: Session = Depends(get_db)):
                 "project_name": project.name if project else None,
                 "status": cicd_task.status,
                 "email_recipients": cicd_task.email_recipients,
+                "email_digest": cicd_task.email_digest,
                 "created_at": cicd_task.created_at.isoformat() if cicd_task.created_at else None
             }
         }
@@ -181,6 +181,11 @@ def update_cicd(cicd_id: int, data: dict, db: Session = Depends(get_db)):
         cicd_task.description = data.get("description", "").strip()
         cicd_task.jenkins_job = data["jenkins_job"].strip()
         cicd_task.email_recipients = data.get("email_recipients", "").strip() if data.get("email_recipients") else None
+        if "email_digest" in data:
+            try:
+                cicd_task.email_digest = normalize_digest_mode(data["email_digest"])
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
         # Nếu thay đổi Jenkins job, reset status về initialized
         if old_jenkins_job != cicd_task.jenkins_job:
@@ -200,7 +205,8 @@ def update_cicd(cicd_id: int, data: dict, db: Session = Depends(get_db)):
                 "jenkins_job": cicd_task.jenkins_job,
                 "project_id": cicd_task.project_id,
                 "status": cicd_task.status,
-                "email_recipients": cicd_task.email_recipients
+                "email_recipients": cicd_task.email_recipients,
+                "email_digest": cicd_task.email_digest
             }
         }
         
@@ -369,21 +375,14 @@ def stop_cicd_task(cicd_id: int, db: Session = Depends(get_db)):
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         
         try:
-            session = requests.Session()
-            
-            # Lấy CSRF crumb từ Jenkins
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            crumb_response = session.get(crumb_url, timeout=30)
+            session = get_jenkins_client()
             
+            # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
             headers = {}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                print(f"Got crumb: {crumb_data['crumb']}")
             
             # Kiểm tra xem job có đang chạy không
             last_build_url = f"{JENKINS_URL}/job/{cicd_task.jenkins_job}/lastBuild/api/json"
-            build_response = session.get(last_build_url, timeout=30)
+            build_response = session.get(last_build_url)
             job_was_running = False
             build_number = None
             
@@ -396,7 +395,7 @@ def stop_cicd_task(cicd_id: int, db: Session = Depends(get_db)):
                     # Dừng job đang chạy
                     print(f"[DEBUG] Job {cicd_task.jenkins_job} đang chạy (build #{build_number}), dừng job...")
                     stop_url = f"{JENKINS_URL}/job/{cicd_task.jenkins_job}/{build_number}/stop"
-                    stop_response = session.post(stop_url, headers=headers, timeout=30)
+                    stop_response = session.post(stop_url, headers=headers)
                     job_was_running = True
                     print(f"[DEBUG] Job stop response: {stop_response.status_code}")
             
@@ -471,19 +470,9 @@ def get_cicd_results(cicd_id: int, build_number: int = None, db: Session = Depen
         project_name = project.name if project else "Unknown"
         # Nếu không truyền build_number, tự động lấy build_number của report gần nhất thành công/thất bại
         if build_number is None:
-            reports = db.query(Report).filter(Report.task_id == cicd_task.cicd_id).order_by(Report.created_at.desc()).all()
-            report = None
-            if reports:
-                if reports[0].status in ["cancelled", "aborted"]:
-                    for r in reports:
-                        if r.status in ["success", "failed", "failure"]:
-                            report = r
-                            break
-                    if not report:
-                        report = reports[0]
-                else:
-                    report = reports[0]
-                build_number = report.build_number if report else None
+            from utils import get_latest_report
+            report = get_latest_report(db, cicd_task.cicd_id)
+            build_number = report.build_number if report else None
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         if build_number:
             build_url = f"{JENKINS_URL}/job/{cicd_task.jenkins_job}/{build_number}/api/json"
@@ -494,12 +483,12 @@ def get_cicd_results(cicd_id: int, build_number: int = None, db: Session = Depen
             ws_prefix = f"{JENKINS_URL}/job/{cicd_task.jenkins_job}/lastBuild/ws"
             console_url = f"{JENKINS_URL}/job/{cicd_task.jenkins_job}/lastBuild/consoleText"
         try:
-            session = requests.Session()
-            response = session.get(build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(build_url)
             if response.status_code == 200:
                 build_info = response.json()
                 artifacts = build_info.get('artifacts', [])
-                console_response = session.get(console_url, timeout=30)
+                console_response = session.get(console_url)
                 console_log = console_response.text if console_response.status_code == 200 else ""
                 workspace_files = [
                     {"name": "log.html", "url": f"{ws_prefix}/log.html", "type": "file"},
@@ -551,30 +540,16 @@ def disable_jenkins_webhook_trigger(job_name: str):
     """Disable GitHub hook trigger for GITScm polling"""
     try:
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-        JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-        JENKINS_TOKEN = os.getenv("JENKINS_TOKEN", "")
         
         # Lấy cấu hình hiện tại của job
         config_url = f"{JENKINS_URL}/job/{job_name}/config.xml"
-        session = requests.Session()
+        session = get_jenkins_client()
         
-        # Chỉ dùng auth nếu có token
-        if JENKINS_TOKEN:
-            session.auth = (JENKINS_USER, JENKINS_TOKEN)
-        
-        # Lấy CSRF crumb
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
+        # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
         headers = {}
-        try:
-            crumb_response = session.get(crumb_url, timeout=10)
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-        except Exception:
-            pass
         
         # Lấy config XML hiện tại
-        response = session.get(config_url, headers=headers, timeout=15)
+        response = session.get(config_url, headers=headers)
         if response.status_code != 200:
             raise Exception(f"Không thể lấy cấu hình job: {response.status_code}")
         
@@ -616,8 +591,7 @@ def disable_jenkins_webhook_trigger(job_name: str):
         update_response = session.post(
             config_url,
             data=updated_config,
-            headers={**headers, 'Content-Type': 'application/xml'},
-            timeout=15
+            headers={**headers, 'Content-Type': 'application/xml'}
         )
         
         if update_response.status_code != 200:
@@ -635,30 +609,16 @@ def configure_jenkins_webhook_trigger(job_name: str, task_id: str = None):
     """Cấu hình Jenkins Pipeline job để bật GitHub hook trigger for GITScm polling và cập nhật TASK_ID"""
     try:
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-        JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-        JENKINS_TOKEN = os.getenv("JENKINS_TOKEN", "")
         
         # Lấy cấu hình hiện tại của job
         config_url = f"{JENKINS_URL}/job/{job_name}/config.xml"
-        session = requests.Session()
+        session = get_jenkins_client()
         
-        # Chỉ dùng auth nếu có token
-        if JENKINS_TOKEN:
-            session.auth = (JENKINS_USER, JENKINS_TOKEN)
-        
-        # Lấy CSRF crumb
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
+        # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
         headers = {}
-        try:
-            crumb_response = session.get(crumb_url, timeout=10)
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-        except Exception:
-            pass
         
         # Lấy config XML hiện tại
-        response = session.get(config_url, headers=headers, timeout=15)
+        response = session.get(config_url, headers=headers)
         if response.status_code != 200:
             raise Exception(f"Không thể lấy cấu hình job: {response.status_code}")
         
@@ -722,8 +682,7 @@ def configure_jenkins_webhook_trigger(job_name: str, task_id: str = None):
         update_response = session.post(
             config_url,
             data=updated_config,
-            headers={**headers, 'Content-Type': 'application/xml'},
-            timeout=15
+            headers={**headers, 'Content-Type': 'application/xml'}
         )
         
         if update_response.status_code != 200:
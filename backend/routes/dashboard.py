@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from database import SessionLocal, Project, Execution, TestCase, Report, Plan, Cicd
+from database import SessionLocal, Report
+from stats_rollup import get_stats, today_key
 
 router = APIRouter()
  
@@ -11,42 +10,38 @@ def get_dashboard():
     try:
         db = SessionLocal()
         try:
+            # Đọc bộ đếm từ bảng dashboard_stats (cập nhật bởi trigger) thay vì COUNT/SUM toàn bảng
+            today = today_key()
+            stats = get_stats(db, [
+                "projects.total", "projects.status.active",
+                "reports.total_tests", "reports.passed_tests", "reports.failed_tests",
+                f"reports.created.{today}",
+                f"tasks.execution.created.{today}",
+                f"tasks.plan.created.{today}",
+                f"tasks.cicd.created.{today}"
+            ])
+            
             # Thống kê projects
-            total_projects = db.query(Project).count()
-            active_projects = db.query(Project).filter(Project.status == "active").count()
+            total_projects = stats["projects.total"]
+            active_projects = stats["projects.status.active"]
             
             # Thống kê test cases đã chạy (tổng hợp từ tất cả reports)
-            total_testcases = db.query(func.sum(Report.total_tests)).scalar() or 0
-            active_testcases = (db.query(func.sum(Report.passed_tests)).scalar() or 0) + (db.query(func.sum(Report.failed_tests)).scalar() or 0)
+            total_testcases = stats["reports.total_tests"]
+            active_testcases = stats["reports.passed_tests"] + stats["reports.failed_tests"]
             
             # Thống kê test runs completed hôm nay (dựa trên reports thực tế)
-            today = datetime.utcnow().date()
-            
-            # Đếm reports được tạo hôm nay (test runs thực tế)
-            reports_today = db.query(Report).filter(
-                func.date(Report.created_at) == today
-            ).count()
-            
-            # Đếm executions được tạo hôm nay (để tham khảo)
-            executions_today = db.query(Execution).filter(
-                func.date(Execution.created_at) == today
-            ).count()
-            
-            # Đếm plans được tạo hôm nay (để tham khảo)
-            plans_today = db.query(Plan).filter(
-                func.date(Plan.created_at) == today
-            ).count()
+            reports_today = stats[f"reports.created.{today}"]
             
-            # Đếm CI/CD tasks được tạo hôm nay (để tham khảo)
-            cicd_today = db.query(Cicd).filter(
-                func.date(Cicd.created_at) == today
-            ).count()
+            # Executions, plans, CI/CD tasks được tạo hôm nay (để tham khảo)
+            executions_today = stats[f"tasks.execution.created.{today}"]
+            plans_today = stats[f"tasks.plan.created.{today}"]
+            cicd_today = stats[f"tasks.cicd.created.{today}"]
             
             # Tổng test runs completed hôm nay
             total_tasks_today = reports_today
             
-            # Thống kê success rate từ report gần nhất
-            latest_report = db.query(Report).order_by(Report.created_at.desc()).first()
+            # Thống kê success rate từ report gần nhất (idx_reports_created_at_id)
+            latest_report = db.query(Report).order_by(Report.created_at.desc(), Report.id.desc()).first()
             
             if latest_report:
                 success_rate = round((latest_report.passed_tests / latest_report.total_tests * 100) if latest_report.total_tests > 0 else 0, 1)
@@ -8,6 +8,7 @@ from datetime import datetime
 from sqlalchemy import text
 from database import SessionLocal, get_db
 from database import Execution, Project
+from jenkins_client import get_jenkins_client
 from routes.log import log_backend_event
 
 router = APIRouter()
@@ -325,8 +326,8 @@ def run_jenkins_job(execution_id: int, db: SessionLocal = Depends(get_db)):
         last_build_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/api/json"
         
         try:
-            session = requests.Session()
-            build_check_response = session.get(last_build_url, timeout=30)
+            session = get_jenkins_client()
+            build_check_response = session.get(last_build_url)
             
             if build_check_response.status_code == 200:
                 build_info = build_check_response.json()
@@ -343,20 +344,11 @@ def run_jenkins_job(execution_id: int, db: SessionLocal = Depends(get_db)):
         jenkins_build_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/buildWithParameters"
         
         try:
-            # Sử dụng session để lấy crumb và trigger job
-            session = requests.Session()
-            
-            # Lấy CSRF crumb từ Jenkins (không cần xác thực vì Jenkins ở chế độ không bảo mật)
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            crumb_response = session.get(crumb_url, timeout=30)
+            # Trigger job qua Jenkins client dùng chung
+            session = get_jenkins_client()
             
+            # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
             headers = {}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                print(f"Got crumb: {crumb_data['crumb']}")
-            else:
-                print(f"Failed to get crumb: {crumb_response.status_code} - {crumb_response.text}")
             
             # Gọi Jenkins API để trigger job với TASK_ID parameter
             data = {
@@ -366,8 +358,7 @@ def run_jenkins_job(execution_id: int, db: SessionLocal = Depends(get_db)):
             response = session.post(
                 jenkins_build_url,
                 headers=headers,
-                data=data,
-                timeout=30
+                data=data
             )
             
             if response.status_code == 201:
@@ -457,8 +448,8 @@ def check_jenkins_status(execution_id: int, db: SessionLocal = Depends(get_db)):
             build_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/api/json"
         
         try:
-            session = requests.Session()
-            response = session.get(build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(build_url)
             
             if response.status_code == 200:
                 build_info = response.json()
@@ -546,8 +537,8 @@ def force_update_execution_status(execution_id: int, db: SessionLocal = Depends(
         last_build_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/api/json"
         
         try:
-            session = requests.Session()
-            response = session.get(last_build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(last_build_url)
             
             if response.status_code == 200:
                 build_info = response.json()
@@ -609,20 +600,9 @@ def get_jenkins_results(execution_id: int, build_number: int = None, db: Session
             raise HTTPException(status_code=400, detail="Task không có Jenkins job được cấu hình")
         # Nếu không truyền build_number, tự động lấy build_number của report gần nhất thành công/thất bại
         if build_number is None:
-            from database import Report
-            reports = db.query(Report).filter(Report.task_id == execution.task_id).order_by(Report.created_at.desc()).all()
-            report = None
-            if reports:
-                if reports[0].status in ["cancelled", "aborted"]:
-                    for r in reports:
-                        if r.status in ["success", "failed", "failure"]:
-                            report = r
-                            break
-                    if not report:
-                        report = reports[0]
-                else:
-                    report = reports[0]
-                build_number = report.build_number if report else None
+            from utils import get_latest_report
+            report = get_latest_report(db, execution.task_id)
+            build_number = report.build_number if report else None
         # Cấu hình Jenkins từ environment variables
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         # Nếu có build_number, lấy đúng build đó, không thì lấy lastBuild
@@ -635,12 +615,12 @@ def get_jenkins_results(execution_id: int, build_number: int = None, db: Session
             ws_prefix = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/ws"
             console_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/consoleText"
         try:
-            session = requests.Session()
-            response = session.get(build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(build_url)
             if response.status_code == 200:
                 build_info = response.json()
                 artifacts = build_info.get('artifacts', [])
-                console_response = session.get(console_url, timeout=30)
+                console_response = session.get(console_url)
                 console_log = console_response.text if console_response.status_code == 200 else ""
                 workspace_files = [
                     {"name": "log.html", "url": f"{ws_prefix}/log.html", "type": "file"},
@@ -716,17 +696,12 @@ def stop_jenkins_job(execution_id: int, db: SessionLocal = Depends(get_db)):
         # Cấu hình Jenkins
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         try:
-            session = requests.Session()
-            # Lấy CSRF crumb từ Jenkins
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            crumb_response = session.get(crumb_url, timeout=30)
+            session = get_jenkins_client()
+            # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
             headers = {}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
             # Kiểm tra xem job có đang chạy không
             last_build_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/api/json"
-            build_response = session.get(last_build_url, timeout=30)
+            build_response = session.get(last_build_url)
             if build_response.status_code == 200:
                 build_info = build_response.json()
                 building = build_info.get('building', False)
@@ -734,7 +709,7 @@ def stop_jenkins_job(execution_id: int, db: SessionLocal = Depends(get_db)):
                 if building:
                     # Dừng job đang chạy
                     stop_url = f"{JENKINS_URL}/job/{execution.jenkins_job}/lastBuild/stop" # Sửa URL để dừng lastBuild
-                    stop_response = session.post(stop_url, headers=headers, timeout=30)
+                    stop_response = session.post(stop_url, headers=headers)
             # Cập nhật status execution thành cancelled
             execution.status = 'cancelled'
             db.commit()
@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_
+from sqlalchemy import delete, desc, and_, func, literal_column, tuple_
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone
 import logging
 import os
 
 from database import get_db, Log
+from log_sink import enqueue_log, flush_log_sink, get_log_sink_stats
+from log_stats import get_log_stats_summary, rebuild_log_stats, clear_log_stats, forget_log_rows, hour_bucket
+from log_search import build_tsquery, highlight_html, substring_snippet, HEADLINE_OPTIONS
+from utils import encode_cursor, decode_cursor, estimate_count
 
 router = APIRouter()
 
@@ -21,17 +25,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def log_backend_event(level: str, message: str, db: Session):
-    """Log backend events to database"""
+def log_backend_event(level: str, message: str, db: Session = None):
+    """
+    Log backend events to database.
+    Dòng log được đưa vào log_sink và ghi theo lô ở luồng nền; db được giữ cho tương thích
+    với các chỗ gọi cũ và không còn bị commit ở đây.
+    """
     try:
-        log_entry = Log(
-            level=level.upper(),
-            message=message,
-            source="backend",
-            created_at=datetime.now(timezone.utc)
-        )
-        db.add(log_entry)
-        db.commit()
+        if not enqueue_log(level, message, source="backend"):
+            logger.warning(f"Log queue full, dropped log: {message[:200]}")
         
         # Also log to file
         if level.upper() == "ERROR":
@@ -46,17 +48,43 @@ def log_backend_event(level: str, message: str, db: Session):
     except Exception as e:
         logger.error(f"Failed to log to database: {e}")
 
+# Với count=estimated, dưới ngưỡng này vẫn đếm chính xác (rẻ)
+LOG_EXACT_COUNT_THRESHOLD = int(os.getenv("LOG_EXACT_COUNT_THRESHOLD", "10000"))
+# OFFSET tốn O(offset): trang sâu hơn phải đi bằng cursor
+LOG_MAX_OFFSET = int(os.getenv("LOG_MAX_OFFSET", "1000"))
+
 @router.get("/")
 def get_logs(
     db: Session = Depends(get_db),
     source: Optional[str] = Query(None, description="Filter by source: 'backend' or 'jenkins'"),
     level: Optional[str] = Query(None, description="Filter by level: 'INFO', 'WARNING', 'ERROR', 'DEBUG'"),
     limit: int = Query(100, description="Number of logs to return"),
-    offset: int = Query(0, description="Number of logs to skip")
+    offset: int = Query(0, description="Number of logs to skip (at most LOG_MAX_OFFSET, use cursor to page deeper)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    count: str = Query("estimated", description="exact | estimated (planner estimate on large tables) | none")
 ):
-    """Get logs with optional filtering"""
+    """
+    Get logs with optional filtering.
+    Phân trang keyset trên (created_at, id) qua cursor/next_cursor; total mặc định là số ước lượng
+    của planner khi bảng lớn (total_is_estimate), count=none để bỏ qua khi chuyển trang.
+    """
+    limit = max(1, min(limit, 1000))
+    offset = max(0, offset)
+    if offset > LOG_MAX_OFFSET and not cursor:
+        raise HTTPException(
+            status_code=400,
+            detail=f"offset must be at most {LOG_MAX_OFFSET}; use next_cursor to page deeper"
+        )
+    if count not in ("exact", "estimated", "none"):
+        raise HTTPException(status_code=400, detail=f"Invalid count mode: {count}")
     try:
-        query = db.query(Log)
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        # Dòng created_at NULL (bảng logs cũ chưa phân vùng) không phân trang keyset được
+        query = db.query(Log).filter(Log.created_at.isnot(None))
         
         # Apply filters
         if source:
@@ -64,12 +92,28 @@ def get_logs(
         if level:
             query = query.filter(Log.level == level.upper())
         
+        total = None
+        total_is_estimate = False
+        if count == "estimated":
+            total = estimate_count(db, query)
+            if total is None or total < LOG_EXACT_COUNT_THRESHOLD:
+                total = query.count()
+            else:
+                total_is_estimate = True
+        elif count == "exact":
+            total = query.count()
+        
         # Order by most recent first
-        query = query.order_by(desc(Log.created_at))
+        query = query.order_by(desc(Log.created_at), desc(Log.id))
         
         # Apply pagination
-        total = query.count()
-        logs = query.offset(offset).limit(limit).all()
+        if cursor_key:
+            query = query.filter(tuple_(Log.created_at, Log.id) < cursor_key)
+        else:
+            query = query.offset(offset)
+        logs = query.limit(limit + 1).all()
+        has_more = len(logs) > limit
+        logs = logs[:limit]
         
         # Convert to dict format
         log_list = []
@@ -79,6 +123,8 @@ def get_logs(
                 "level": log.level,
                 "message": log.message,
                 "source": log.source,
+                "job_name": log.job_name,
+                "build_number": log.build_number,
                 "created_at": log.created_at.isoformat() if log.created_at else None,
                 "created_at_local": log.created_at.astimezone(timezone(timedelta(hours=7))).isoformat() if log.created_at else None
             })
@@ -86,14 +132,109 @@ def get_logs(
         return {
             "logs": log_list,
             "total": total,
+            "total_is_estimate": total_is_estimate,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": encode_cursor(logs[-1].created_at, logs[-1].id) if has_more and logs else None,
+            "has_more": has_more
         }
         
     except Exception as e:
         log_backend_event("ERROR", f"Failed to get logs: {str(e)}", db)
         raise HTTPException(status_code=500, detail=f"Failed to get logs: {str(e)}")
 
+@router.get("/search")
+def search_logs(
+    db: Session = Depends(get_db),
+    q: str = Query(..., description='Search text: words, "phrase", prefix*, -exclude, OR'),
+    mode: str = Query("text", description="'text' (full-text) or 'substring' (any fragment, trigram index)"),
+    source: Optional[str] = Query(None, description="Filter by source: 'backend' or 'jenkins'"),
+    level: Optional[str] = Query(None, description="Filter by level: 'INFO', 'WARNING', 'ERROR', 'DEBUG'"),
+    job_name: Optional[str] = Query(None, description="Filter by Jenkins job name"),
+    build_number: Optional[int] = Query(None, description="Filter by Jenkins build number"),
+    date_from: Optional[datetime] = Query(None, description="Logs created at or after (UTC)"),
+    date_to: Optional[datetime] = Query(None, description="Logs created at or before (UTC)"),
+    limit: int = Query(50, description="Number of logs to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """Search logs (newest first) with highlighted snippets"""
+    limit = max(1, min(limit, 500))
+    if mode not in ("text", "substring"):
+        raise HTTPException(status_code=400, detail=f"Invalid search mode: {mode}")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if mode == "text":
+        query_expr = build_tsquery(q)
+        if query_expr is None:
+            raise HTTPException(status_code=400, detail="Search query has no searchable words")
+        match = func.to_tsvector(literal_column("'simple'"), Log.message).bool_op("@@")(query_expr)
+        snippet = func.ts_headline(literal_column("'simple'"), Log.message, query_expr, HEADLINE_OPTIONS)
+    else:
+        needle = q.strip()
+        if len(needle) < 3:
+            raise HTTPException(status_code=400, detail="Substring search needs at least 3 characters")
+        escaped = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        match = Log.message.ilike(f"%{escaped}%", escape="\\")
+        snippet = None
+    
+    try:
+        columns = [Log] if snippet is None else [Log, snippet]
+        query = db.query(*columns).filter(match, Log.created_at.isnot(None))
+        if source:
+            query = query.filter(Log.source == source)
+        if level:
+            query = query.filter(Log.level == level.upper())
+        if job_name:
+            query = query.filter(Log.job_name == job_name)
+        if build_number is not None:
+            query = query.filter(Log.build_number == build_number)
+        if date_from:
+            query = query.filter(Log.created_at >= date_from)
+        if date_to:
+            query = query.filter(Log.created_at <= date_to)
+        if cursor_key:
+            query = query.filter(tuple_(Log.created_at, Log.id) < cursor_key)
+        
+        rows = query.order_by(desc(Log.created_at), desc(Log.id)).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        results = []
+        for row in rows:
+            log, headline = (row, None) if snippet is None else row
+            results.append({
+                "id": log.id,
+                "level": log.level,
+                "message": log.message,
+                "highlight": highlight_html(headline) if snippet is not None else substring_snippet(log.message, needle),
+                "source": log.source,
+                "job_name": log.job_name,
+                "build_number": log.build_number,
+                "created_at": log.created_at.isoformat() if log.created_at else None,
+                "created_at_local": log.created_at.astimezone(timezone(timedelta(hours=7))).isoformat() if log.created_at else None
+            })
+        
+        next_cursor = None
+        if has_more and results:
+            last_log = rows[-1] if snippet is None else rows[-1][0]
+            next_cursor = encode_cursor(last_log.created_at, last_log.id)
+        
+        return {
+            "logs": results,
+            "count": len(results),
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "query": q,
+            "mode": mode
+        }
+        
+    except Exception as e:
+        logger.error(f"Failed to search logs: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to search logs: {str(e)}")
+
 @router.post("/backend")
 def add_backend_log(
     level: str = Form(...),
@@ -133,14 +274,8 @@ def add_jenkins_log(
         if build_number:
             enhanced_message = f"[{job_name}#{build_number}] {message}"
         
-        log_entry = Log(
-            level=level.upper(),
-            message=enhanced_message,
-            source="jenkins",
-            created_at=datetime.now(timezone.utc)
-        )
-        db.add(log_entry)
-        db.commit()
+        if not enqueue_log(level, enhanced_message, source="jenkins", job_name=job_name, build_number=build_number):
+            return {"message": "Log queue is full, Jenkins log dropped"}
         
         return {"message": "Jenkins log added successfully"}
         
@@ -149,42 +284,45 @@ def add_jenkins_log(
         raise HTTPException(status_code=500, detail=f"Failed to add Jenkins log: {str(e)}")
 
 @router.get("/stats")
-def get_log_stats(db: Session = Depends(get_db)):
-    """Get log statistics"""
+def get_log_stats(
+    db: Session = Depends(get_db),
+    hours: int = Query(24, description="Window (hours) for histogram, recent count and top errors"),
+    top: int = Query(10, description="Number of top error messages"),
+    source: Optional[str] = Query(None, description="Filter by source: 'backend' or 'jenkins'")
+):
+    """Get log statistics from the hourly rollup tables"""
     try:
-        # Total logs by source
-        backend_count = db.query(Log).filter(Log.source == "backend").count()
-        jenkins_count = db.query(Log).filter(Log.source == "jenkins").count()
-        
-        # Logs by level
-        info_count = db.query(Log).filter(Log.level == "INFO").count()
-        warning_count = db.query(Log).filter(Log.level == "WARNING").count()
-        error_count = db.query(Log).filter(Log.level == "ERROR").count()
-        debug_count = db.query(Log).filter(Log.level == "DEBUG").count()
-        
-        # Recent logs (last 24 hours)
-        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-        recent_count = db.query(Log).filter(Log.created_at >= yesterday).count()
-        
-        return {
-            "total_logs": backend_count + jenkins_count,
-            "by_source": {
-                "backend": backend_count,
-                "jenkins": jenkins_count
-            },
-            "by_level": {
-                "info": info_count,
-                "warning": warning_count,
-                "error": error_count,
-                "debug": debug_count
-            },
-            "recent_24h": recent_count
-        }
+        hours = max(1, min(hours, 24 * 31))
+        top = max(1, min(top, 100))
+        stats = get_log_stats_summary(db, hours=hours, top_errors=top, source=source)
+        # Giữ các key cũ cho client hiện có
+        for key in ("backend", "jenkins"):
+            stats["by_source"].setdefault(key, 0)
+        for key in ("info", "warning", "error", "debug"):
+            stats["by_level"].setdefault(key, 0)
+        stats["recent_24h"] = stats["window_total"] if hours == 24 else sum(
+            bucket["total"] for bucket in stats["histogram"][-24:]
+        )
+        # Trạng thái hàng đợi ghi log (dòng chờ ghi, đã ghi, bị bỏ)
+        stats["sink"] = get_log_sink_stats()
+        return stats
         
     except Exception as e:
         log_backend_event("ERROR", f"Failed to get log stats: {str(e)}", db)
         raise HTTPException(status_code=500, detail=f"Failed to get log stats: {str(e)}")
 
+@router.post("/stats/rebuild")
+def rebuild_stats(db: Session = Depends(get_db)):
+    """Rebuild the log statistics rollup from the logs table (full scan - admin use only)"""
+    try:
+        buckets = rebuild_log_stats(db)
+        log_backend_event("INFO", f"Rebuilt log stats ({buckets} buckets)", db)
+        return {"message": "Log stats rebuilt", "buckets": buckets}
+    except Exception as e:
+        db.rollback()
+        log_backend_event("ERROR", f"Failed to rebuild log stats: {str(e)}", db)
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild log stats: {str(e)}")
+
 @router.delete("/")
 def clear_logs(
     source: Optional[str] = Query(None, description="Clear logs by source"),
@@ -198,17 +336,40 @@ def clear_logs(
         if source:
             query = query.filter(Log.source == source)
         
+        dropped_partitions = []
         if older_than_days:
             cutoff_date = datetime.utcnow() - timedelta(days=older_than_days)
-            query = query.filter(Log.created_at < cutoff_date)
-        
-        deleted_count = query.count()
-        query.delete()
+            # Log trước đầu giờ chứa cutoff bị xoá cùng các bucket tổng hợp của chúng; giờ chứa
+            # cutoff chỉ bị xoá một phần nên các dòng đó được trừ khỏi bảng tổng hợp
+            hour_start = hour_bucket(cutoff_date)
+            if not source:
+                # Các partition nằm trọn trước đầu giờ được DROP nguyên khối, phần còn lại mới DELETE
+                from log_partitions import drop_partitions_before, is_partitioned
+                connection = db.connection()
+                if is_partitioned(connection):
+                    dropped_partitions = drop_partitions_before(connection, hour_start)
+            deleted_count = query.filter(Log.created_at < hour_start).delete(synchronize_session=False)
+            clear_log_stats(db, source=source or None, before=hour_start)
+            
+            partial_hour = delete(Log).where(Log.created_at >= hour_start, Log.created_at < cutoff_date)
+            if source:
+                partial_hour = partial_hour.where(Log.source == source)
+            deleted_rows = db.execute(
+                partial_hour.returning(Log.level, Log.message, Log.source, Log.created_at)
+            ).mappings().all()
+            forget_log_rows(db, deleted_rows)
+            deleted_count += len(deleted_rows)
+        else:
+            deleted_count = query.delete(synchronize_session=False)
+            clear_log_stats(db, source=source or None)
         db.commit()
         
-        log_backend_event("INFO", f"Cleared {deleted_count} logs", db)
+        log_backend_event("INFO", f"Cleared {deleted_count} logs, dropped {len(dropped_partitions)} partitions", db)
         
-        return {"message": f"Cleared {deleted_count} logs"}
+        return {
+            "message": f"Cleared {deleted_count} logs",
+            "dropped_partitions": dropped_partitions
+        }
         
     except Exception as e:
         log_backend_event("ERROR", f"Failed to clear logs: {str(e)}", db)
@@ -228,13 +389,14 @@ def initialize_sample_logs(db: Session = Depends(get_db)):
             {"level": "ERROR", "message": "Failed to connect to external service", "source": "backend"},
         ]
         
+        # Cùng đường ghi với mọi log khác (log_sink: INSERT theo lô + bảng thống kê theo giờ)
+        dropped = 0
         for log_data in sample_logs:
-            log_entry = Log(**log_data, created_at=datetime.utcnow())
-            db.add(log_entry)
-        
-        db.commit()
+            if not enqueue_log(log_data["level"], log_data["message"], source=log_data["source"]):
+                dropped += 1
+        flush_log_sink()
         
-        return {"message": "Sample logs initialized"}
+        return {"message": "Sample logs initialized", "dropped": dropped}
         
     except Exception as e:
         logger.error(f"Failed to initialize sample logs: {e}")
@@ -3,6 +3,8 @@ import os
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 from database import get_db, Plan, Project
+from jenkins_client import get_jenkins_client
+from email_digest import normalize_digest_mode
 from typing import List, Optional
 from datetime import datetime
 import json
@@ -28,6 +30,7 @@ def get_plans(db: Session = Depends(get_db)):
                     "schedule_time": plan.schedule_time,
                     "status": plan.status,
                     "email_recipients": plan.email_recipients,
+                    "email_digest": plan.email_digest,
                     "created_at": plan.created_at.isoformat() if plan.created_at else None
                 }
                 for plan in plans
@@ -72,6 +75,7 @@ def get_plans_by_project(project_id: int, db: Session = Depends(get_db)):
                     "schedule_time": plan.schedule_time,
                     "status": plan.status,
                     "email_recipients": plan.email_recipients,
+                    "email_digest": plan.email_digest,
                     "created_at": plan.created_at.isoformat() if plan.created_at else None
                 }
                 for plan in plans
@@ -111,6 +115,11 @@ def create_plan(plan_data: dict, db: Session = Depends(get_db)):
         if not cron_schedule or len(cron_schedule.split()) != 5:
             raise HTTPException(status_code=400, detail="Invalid cron schedule format. Expected: 'minute hour day month weekday'")
         
+        try:
+            email_digest = normalize_digest_mode(plan_data.get("email_digest"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         # Find the smallest available ID
         existing_ids = [plan.id for plan in db.query(Plan.id).all()]
         if existing_ids:
@@ -135,6 +144,7 @@ def create_plan(plan_data: dict, db: Session = Depends(get_db)):
             jenkins_job=plan_data["jenkins_job"].strip(),
             schedule_time=cron_schedule,
             email_recipients=plan_data.get("email_recipients", "").strip() if plan_data.get("email_recipients") else None,
+            email_digest=email_digest,
             status="initialized"
         )
         
@@ -157,6 +167,7 @@ def create_plan(plan_data: dict, db: Session = Depends(get_db)):
             "schedule_time": new_plan.schedule_time,
             "status": new_plan.status,
             "email_recipients": new_plan.email_recipients,
+            "email_digest": new_plan.email_digest,
             "created_at": new_plan.created_at.isoformat() if new_plan.created_at else None
         }
     except HTTPException:
@@ -207,6 +218,11 @@ def update_plan(plan_id: int, plan_data: dict, db: Session = Depends(get_db)):
             plan.schedule_time = cron_schedule
         if "email_recipients" in plan_data:
             plan.email_recipients = plan_data["email_recipients"].strip() if plan_data["email_recipients"] else None
+        if "email_digest" in plan_data:
+            try:
+                plan.email_digest = normalize_digest_mode(plan_data["email_digest"])
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
         db.commit()
         db.refresh(plan)
@@ -226,6 +242,7 @@ def update_plan(plan_id: int, plan_data: dict, db: Session = Depends(get_db)):
             "schedule_time": plan.schedule_time,
             "status": plan.status,
             "email_recipients": plan.email_recipients,
+            "email_digest": plan.email_digest,
             "created_at": plan.created_at.isoformat() if plan.created_at else None
         }
     except HTTPException:
@@ -253,26 +270,19 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db)):
                 # Jenkins configuration
                 JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
                 
-                session = requests.Session()
-                
-                # Lấy CSRF crumb từ Jenkins
-                crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-                crumb_response = session.get(crumb_url, timeout=30)
+                session = get_jenkins_client()
                 
+                # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
                 headers = {}
-                if crumb_response.status_code == 200:
-                    crumb_data = crumb_response.json()
-                    headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                    print(f"Got crumb: {crumb_data['crumb']}")
                 
                 # Kiểm tra xem job có tồn tại không
                 job_url = f"{JENKINS_URL}/job/{jenkins_job}/api/json"
-                job_response = session.get(job_url, headers=headers, timeout=30)
+                job_response = session.get(job_url, headers=headers)
                 
                 if job_response.status_code == 200:
                     # Job tồn tại, xóa cron schedule
                     config_url = f"{JENKINS_URL}/job/{jenkins_job}/config.xml"
-                    config_response = session.get(config_url, headers=headers, timeout=30)
+                    config_response = session.get(config_url, headers=headers)
                     
                     if config_response.status_code == 200:
                         current_config = config_response.text
@@ -297,7 +307,7 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db)):
                                 print(f"[DEBUG] No cron schedule found in Freestyle job: {jenkins_job}")
                         
                         # Gửi config đã cập nhật về Jenkins
-                        update_response = session.post(config_url, headers=headers, data=updated_config, timeout=30)
+                        update_response = session.post(config_url, headers=headers, data=updated_config)
                         
                         if update_response.status_code == 200:
                             print(f"[DEBUG] Successfully removed cron schedule from Jenkins job: {jenkins_job}")
@@ -460,22 +470,11 @@ def update_plan_default_value(job_name: str, task_id: str, cron_schedule: str =
         # Lấy config hiện tại
         config_url = f"{JENKINS_URL}/job/{job_name}/config.xml"
         
-        # Sử dụng session để lấy CSRF crumb
-        session = requests.Session()
-        
-        # Get CSRF crumb from Jenkins
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-        crumb_response = session.get(crumb_url, timeout=30)
-        
+        # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
+        session = get_jenkins_client()
         headers = {'Content-Type': 'application/xml'}
-        if crumb_response.status_code == 200:
-            crumb_data = crumb_response.json()
-            headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-            print(f"[DEBUG] Got crumb: {crumb_data['crumb']}")
-        else:
-            print(f"[WARNING] Failed to get crumb: {crumb_response.status_code}")
         
-        response = session.get(config_url, headers=headers, timeout=30)
+        response = session.get(config_url)
         
         if response.status_code == 200:
             current_config = response.text
@@ -506,8 +505,7 @@ def update_plan_default_value(job_name: str, task_id: str, cron_schedule: str =
             update_response = session.post(
                 config_url,
                 data=updated_config,
-                headers=headers,
-                timeout=30
+                headers=headers
             )
             
             if update_response.status_code == 200:
@@ -547,22 +545,13 @@ def run_plan(plan_id: int, db: Session = Depends(get_db)):
         jenkins_config_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/config.xml"
         
         try:
-            session = requests.Session()
-            
-            # Get CSRF crumb from Jenkins
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            crumb_response = session.get(crumb_url, timeout=30)
+            session = get_jenkins_client()
             
+            # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
             headers = {}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                print(f"Got crumb: {crumb_data['crumb']}")
-            else:
-                print(f"Failed to get crumb: {crumb_response.status_code} - {crumb_response.text}")
             
             # Get current job configuration
-            config_response = session.get(jenkins_config_url, headers=headers, timeout=30)
+            config_response = session.get(jenkins_config_url, headers=headers)
             
             if config_response.status_code == 200:
                 current_config = config_response.text
@@ -632,8 +621,7 @@ def run_plan(plan_id: int, db: Session = Depends(get_db)):
                     update_response = session.post(
                         jenkins_config_url,
                         headers=headers,
-                        data=updated_config,
-                        timeout=30
+                        data=updated_config
                     )
                     
                     if update_response.status_code == 200:
@@ -686,8 +674,7 @@ def run_plan(plan_id: int, db: Session = Depends(get_db)):
                     update_response = session.post(
                         jenkins_config_url,
                         headers=headers,
-                        data=updated_config,
-                        timeout=30
+                        data=updated_config
                     )
                     
                     if update_response.status_code == 200:
@@ -776,8 +763,8 @@ def check_plan_status(plan_id: int, db: Session = Depends(get_db)):
         last_build_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/lastBuild/api/json"
         
         try:
-            session = requests.Session()
-            response = session.get(last_build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(last_build_url)
             
             if response.status_code == 200:
                 build_info = response.json()
@@ -884,21 +871,14 @@ def stop_plan(plan_id: int, db: Session = Depends(get_db)):
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         
         try:
-            session = requests.Session()
-            
-            # Lấy CSRF crumb từ Jenkins
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            crumb_response = session.get(crumb_url, timeout=30)
+            session = get_jenkins_client()
             
+            # CSRF crumb do Jenkins client tự thêm (cache theo TTL)
             headers = {}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                print(f"Got crumb: {crumb_data['crumb']}")
             
             # Kiểm tra xem job có tồn tại không
             job_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/api/json"
-            job_response = session.get(job_url, headers=headers, timeout=30)
+            job_response = session.get(job_url, headers=headers)
             
             if job_response.status_code == 404:
                 return {"message": f"Jenkins job '{plan.jenkins_job}' không tồn tại", "plan_id": plan.id, "plan_name": plan.plan_name, "jenkins_job": plan.jenkins_job, "action": "job_not_found", "status": plan.status, "error": "Job không tồn tại trong Jenkins"}
@@ -907,7 +887,7 @@ def stop_plan(plan_id: int, db: Session = Depends(get_db)):
             
             # Kiểm tra xem job có đang chạy không
             last_build_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/lastBuild/api/json"
-            build_response = session.get(last_build_url, timeout=30)
+            build_response = session.get(last_build_url)
             job_was_running = False
             build_number = None
             if build_response.status_code == 200:
@@ -918,11 +898,11 @@ def stop_plan(plan_id: int, db: Session = Depends(get_db)):
                     # Dừng job đang chạy
                     print(f"[DEBUG] Job {plan.jenkins_job} đang chạy (build #{build_number}), dừng job...")
                     stop_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/{build_number}/stop"
-                    stop_response = session.post(stop_url, headers=headers, timeout=30)
+                    stop_response = session.post(stop_url, headers=headers)
                     job_was_running = True
             # Luôn cập nhật cron schedule về rỗng
             config_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/config.xml"
-            config_response = session.get(config_url, headers=headers, timeout=30)
+            config_response = session.get(config_url, headers=headers)
             if config_response.status_code == 200:
                 current_config = config_response.text
                 if 'flow-definition' in current_config:
@@ -934,7 +914,7 @@ def stop_plan(plan_id: int, db: Session = Depends(get_db)):
                         updated_config = re.sub(spec_pattern, r'\1\2', current_config)
                     else:
                         updated_config = current_config
-                update_response = session.post(config_url, headers=headers, data=updated_config, timeout=30)
+                update_response = session.post(config_url, headers=headers, data=updated_config)
                 if update_response.status_code == 200:
                     plan.status = "cancelled"
                     db.commit()
@@ -963,20 +943,9 @@ def get_plan_results(plan_id: int, build_number: int = None, db: Session = Depen
             raise HTTPException(status_code=400, detail="Plan không có Jenkins job được cấu hình")
         # Nếu không truyền build_number, tự động lấy build_number của report gần nhất thành công/thất bại
         if build_number is None:
-            from database import Report
-            reports = db.query(Report).filter(Report.task_id == plan.plan_id).order_by(Report.created_at.desc()).all()
-            report = None
-            if reports:
-                if reports[0].status in ["cancelled", "aborted"]:
-                    for r in reports:
-                        if r.status in ["success", "failed", "failure"]:
-                            report = r
-                            break
-                    if not report:
-                        report = reports[0]
-                else:
-                    report = reports[0]
-                build_number = report.build_number if report else None
+            from utils import get_latest_report
+            report = get_latest_report(db, plan.plan_id)
+            build_number = report.build_number if report else None
         # Cấu hình Jenkins từ environment variables
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         # Nếu có build_number, lấy đúng build đó, không thì lấy lastBuild
@@ -989,12 +958,12 @@ def get_plan_results(plan_id: int, build_number: int = None, db: Session = Depen
             ws_prefix = f"{JENKINS_URL}/job/{plan.jenkins_job}/lastBuild/ws"
             console_url = f"{JENKINS_URL}/job/{plan.jenkins_job}/lastBuild/consoleText"
         try:
-            session = requests.Session()
-            response = session.get(build_url, timeout=30)
+            session = get_jenkins_client()
+            response = session.get(build_url)
             if response.status_code == 200:
                 build_info = response.json()
                 artifacts = build_info.get('artifacts', [])
-                console_response = session.get(console_url, timeout=30)
+                console_response = session.get(console_url)
                 console_log = console_response.text if console_response.status_code == 200 else ""
                 workspace_files = [
                     {"name": "log.html", "url": f"{ws_prefix}/log.html", "type": "file"},
@@ -6,7 +6,8 @@ import os
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db, Project as DBProject, TestCase, Execution, Report
+from database import get_db, Project as DBProject, TestCase, Execution
+from utils import get_project_metrics, get_single_project_metrics
 
 router = APIRouter()
 
@@ -87,20 +88,20 @@ def get_projects(db: Session = Depends(get_db)):
         db_projects = db.query(DBProject).all()
         projects = []
         
+        # Test case, execution and report counts for all projects in two grouped queries
+        all_metrics = get_project_metrics(db)
+        
         for db_project in db_projects:
             # Members is already an array
             members = db_project.members or []
             
-            # Count test cases for this project
-            test_cases_count = db.query(TestCase).filter(TestCase.project_id == db_project.id).count()
-            
-            # Count executions for this project
-            executions_count = db.query(Execution).filter(Execution.project_id == db_project.id).count()
+            metrics = all_metrics.get(db_project.id) or {}
+            test_cases_count = metrics.get("testcases", 0)
+            executions_count = sum(metrics.get("tasks", {}).get("execution", {}).values())
             
             # Calculate success rate from reports
-            reports = db.query(Report).filter(Report.project_id == db_project.id).all()
-            total_runs = len(reports)
-            successful_runs = len([r for r in reports if r.status == 'success'])
+            total_runs = metrics.get("reports_total", 0)
+            successful_runs = metrics.get("reports_success", 0)
             success_rate = (successful_runs / total_runs * 100) if total_runs > 0 else 0.0
             
             project = {
@@ -135,16 +136,13 @@ def get_project(project_id: int, db: Session = Depends(get_db)):
         # Members is already an array
         members = db_project.members or []
         
-        # Count test cases for this project
-        test_cases_count = db.query(TestCase).filter(TestCase.project_id == db_project.id).count()
-        
-        # Count executions for this project
-        executions_count = db.query(Execution).filter(Execution.project_id == db_project.id).count()
+        metrics = get_single_project_metrics(db, db_project.id)
+        test_cases_count = metrics["testcases"]
+        executions_count = sum(metrics["tasks"]["execution"].values())
         
         # Calculate success rate from reports
-        reports = db.query(Report).filter(Report.project_id == db_project.id).all()
-        total_runs = len(reports)
-        successful_runs = len([r for r in reports if r.status == 'success'])
+        total_runs = metrics["reports_total"]
+        successful_runs = metrics["reports_success"]
         success_rate = (successful_runs / total_runs * 100) if total_runs > 0 else 0.0
         
         return {
@@ -234,8 +232,14 @@ def update_project(project_id: int, project: ProjectUpdate, db: Session = Depend
         db.commit()
         db.refresh(db_project)
         
+        # Email report dùng PM/thành viên mới ngay lập tức
+        from email_templates import invalidate_project_team
+        invalidate_project_team(project_id)
+        
         # Count test cases and executions for updated project
-        test_cases_count = db.query(TestCase).filter(TestCase.project_id == db_project.id).count()
+        test_cases_count = db.query(TestCase).filter(
+            TestCase.project_id == db_project.id, TestCase.deleted_at.is_(None)
+        ).count()
         executions_count = db.query(Execution).filter(Execution.project_id == db_project.id).count()
         
         return {
@@ -270,6 +274,9 @@ def delete_project(project_id: int, db: Session = Depends(get_db)):
         db.delete(db_project)
         db.commit()
         
+        from email_templates import invalidate_project_team
+        invalidate_project_team(project_id)
+        
         return {"message": f"Project '{project_name}' deleted successfully"}
     except HTTPException:
         raise
@@ -1,29 +1,73 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
 import requests
 import os
 import xml.etree.ElementTree as ET
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, Integer, text
+from sqlalchemy import func, and_, Integer, text, tuple_
 from sqlalchemy.orm import Session
 from database import get_db, Project, Execution, TestCase, Report, Notification
 from routes.log import log_backend_event
+from jenkins_client import get_jenkins_client
+from robot_output import fetch_output_xml_summary
+from result_store import TestResultCollector, save_test_results
+from utils import (
+    get_latest_reports, get_project_metrics, encode_cursor, decode_cursor,
+    resolve_task_names, resolve_tasks, estimate_count, TASK_ID_PREFIXES
+)
 
 # Helper functions for webhook processing
-def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
-    """Xử lý webhook cho plan task"""
-    print(f"[DEBUG] Processing webhook for plan: {plan.plan_name}")
-    
-    # Cập nhật lại defaultValue cho TASK_ID và schedule sau khi job chạy xong
+def save_build_report(report, test_results, db):
+    """
+    Lưu report của một build, idempotent theo (task_id, build_number): khi webhook event được
+    xử lý lại (worker dừng hoặc lỗi sau khi đã commit report) thì dùng lại report đã có và chỉ
+    ghi kết quả test case nếu report đó chưa có.
+    """
+    from database import TestResult
+
+    existing = db.query(Report).filter(
+        Report.task_id == report.task_id,
+        Report.build_number == report.build_number
+    ).order_by(Report.id).first()
+    if existing:
+        print(f"[DEBUG] Report {existing.id} already saved for {report.task_id} build #{report.build_number}")
+        report = existing
+        if db.query(TestResult.id).filter(TestResult.report_id == report.id).first():
+            return report
+    else:
+        db.add(report)
+        db.commit()
+        db.refresh(report)
+
+    # Lưu kết quả từng test case
+    try:
+        saved = save_test_results(report.id, test_results, db)
+        print(f"[DEBUG] Saved {saved} test results for report {report.id}")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Failed to save test results for report {report.id}: {e}")
+    return report
+
+def refresh_plan_jenkins_config(plan, job_name):
+    """
+    Cập nhật lại defaultValue cho TASK_ID và schedule của job sau khi job chạy xong (POST config Jenkins).
+    Gọi từ webhook_queue một lần cho mỗi build; trả về True nếu thành công.
+    """
     try:
         from routes.plans import update_plan_default_value
         plan_task_id = f"PLAN-{plan.id:03d}"
         # Gọi hàm update_plan_default_value để cập nhật defaultValue và schedule
         update_plan_default_value(job_name, plan_task_id, plan.schedule_time)
         print(f"[DEBUG] Đã cập nhật defaultValue và schedule cho {job_name}: {plan_task_id}")
+        return True
     except Exception as e:
         print(f"[WARNING] Không thể cập nhật defaultValue và schedule: {e}")
+        return False
+
+def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
+    """Xử lý webhook cho plan task (cấu hình Jenkins được cập nhật riêng qua refresh_plan_jenkins_config)"""
+    print(f"[DEBUG] Processing webhook for plan: {plan.plan_name}")
     
     # Lấy thông tin project
     project = db.query(Project).filter(Project.id == plan.project_id).first()
@@ -34,11 +78,7 @@ def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
     JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
     
     try:
-        session = requests.Session()
-        
-        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
-        output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
-        xml_response = session.get(output_xml_url, timeout=30) if build_result != "ABORTED" else None
+        session = get_jenkins_client()
         
         # Parse thông tin từ output.xml
         total_tests = 0
@@ -56,42 +96,35 @@ def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
             duration_seconds = body['build']['duration'] // 1000
             end_time = start_time + timedelta(seconds=duration_seconds) if start_time else None
         
-        if xml_response and xml_response.status_code == 200:
+        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
+        # Parse dạng stream trên HTTP response, không nạp cả file vào bộ nhớ
+        test_results = TestResultCollector()
+        if build_result != "ABORTED":
+            output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
             try:
-                root = ET.fromstring(xml_response.text)
-                
-                # Lấy thông tin từ robot output.xml - sử dụng thống kê từ XML
-                stats = root.find('.//statistics')
-                if stats is not None:
-                    total = stats.find('.//total')
-                    if total is not None:
-                        total_stat = total.find('.//stat')
-                        if total_stat is not None:
-                            passed_tests = int(total_stat.get('pass', 0))
-                            failed_tests = int(total_stat.get('fail', 0))
-                            skipped_tests = int(total_stat.get('skip', 0))
-                            total_tests = passed_tests + failed_tests + skipped_tests
-                
-                # Lấy thông tin thời gian từ XML
-                suite = root.find('.//suite')
-                if suite is not None:
-                    start_time_str = suite.get('starttime')
-                    end_time_str = suite.get('endtime')
-                    if start_time_str and end_time_str:
-                        try:
-                            start_time = datetime.strptime(start_time_str, '%Y%m%d %H:%M:%S.%f')
-                            end_time = datetime.strptime(end_time_str, '%Y%m%d %H:%M:%S.%f')
-                            duration_seconds = int((end_time - start_time).total_seconds())
-                        except ValueError:
-                            pass
+                summary = fetch_output_xml_summary(session, output_xml_url, on_test=test_results)
             except ET.ParseError as e:
                 print(f"[WARNING] Failed to parse output.xml: {e}")
+                summary = None
+            
+            if summary:
+                total_tests = summary['total_tests']
+                passed_tests = summary['passed_tests']
+                failed_tests = summary['failed_tests']
+                skipped_tests = summary['skipped_tests']
+                if summary['start_time'] and summary['end_time']:
+                    start_time = summary['start_time']
+                    end_time = summary['end_time']
+                    duration_seconds = summary['duration_seconds']
         
         # Luôn tạo report mới cho mỗi lần chạy
         report = Report(
             task_id=plan.plan_id,
             execution_id=plan.id,
+            task_type='plan',
             project_id=project.id,
+            project_name=project.name,
+            jenkins_job=job_name,
             build_number=build_number,
             total_tests=total_tests,
             passed_tests=passed_tests,
@@ -102,9 +135,8 @@ def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
             end_time=end_time,
             status=build_result.lower() if build_result else 'completed'
         )
-        db.add(report)
-        db.commit()
-        db.refresh(report)
+        # Webhook được xử lý lại: dùng lại report đã lưu của build này
+        report = save_build_report(report, test_results, db)
         
         # Cập nhật status của plan theo kết quả thực tế
         if build_result == "ABORTED":
@@ -128,10 +160,12 @@ def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
                 recipients = [email.strip() for email in plan.email_recipients.split(',') if email.strip()]
                 
                 if recipients:
-                    # Gửi email report
+                    # Ghi email report vào outbox (lỗi database được ném ra để webhook event retry)
                     email_service = EmailService()
-                    email_result = email_service.send_task_report_email({
+                    email_result = email_service.queue_task_report_email({
                         'task_id': plan.plan_id,
+                        'report_id': report.id,
+                        'email_digest': plan.email_digest,
                         'task_name': plan.plan_name,
                         'project_name': project.name,
                         'project_id': plan.project_id,
@@ -147,30 +181,32 @@ def process_plan_webhook(plan, job_name, build_number, build_result, body, db):
                     })
                     
                     if email_result.get('success'):
-                        print(f"✅ Email sent successfully to {len(recipients)} recipients for task {plan.plan_id}")
-                        log_backend_event("INFO", f"Email sent successfully for task {plan.plan_id} to {len(recipients)} recipients", db)
+                        print(f"✅ Email queued for {len(recipients)} recipients for task {plan.plan_id}")
+                        log_backend_event("INFO", f"Email queued for task {plan.plan_id} to {len(recipients)} recipients", db)
                     else:
-                        print(f"❌ Failed to send email for task {plan.plan_id}: {email_result.get('error')}")
-                        log_backend_event("ERROR", f"Failed to send email for task {plan.plan_id}: {email_result.get('error')}", db)
+                        print(f"❌ Failed to queue email for task {plan.plan_id}: {email_result.get('error')}")
+                        log_backend_event("ERROR", f"Failed to queue email for task {plan.plan_id}: {email_result.get('error')}", db)
                         
             except Exception as e:
                 print(f"❌ Error sending email for task {plan.plan_id}: {e}")
                 log_backend_event("ERROR", f"Error sending email for task {plan.plan_id}: {e}", db)
+                # Outbox idempotent theo task#build - webhook event được retry và ghi lại email
+                raise
         else:
             print(f"ℹ️ No email recipients configured for task {plan.plan_id}")
         
-        # Tạo thông báo cho plan
-        try:
-            create_notification(
-                task_id=plan.plan_id,
-                task_name=plan.plan_name,
-                task_type='plan',
-                status=build_result.lower() if build_result else 'completed',
-                project_name=project.name,
-                db=db
-            )
-        except Exception as e:
-            print(f"[WARNING] Failed to create notification for plan: {e}")
+        # Tạo thông báo cho plan (một thông báo cho mỗi build, kể cả khi webhook được xử lý lại)
+        notification = create_notification(
+            task_id=plan.plan_id,
+            task_name=plan.plan_name,
+            task_type='plan',
+            status=build_result.lower() if build_result else 'completed',
+            project_name=project.name,
+            idempotency_key=f"{plan.plan_id}#{build_number}",
+            db=db
+        )
+        if notification is None:
+            raise RuntimeError(f"Failed to create notification for {plan.plan_id} build #{build_number}")
         
         return {
             "message": f"Đã lưu report cho plan '{plan.plan_name}' thành công",
@@ -207,11 +243,7 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
     JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
     
     try:
-        session = requests.Session()
-        
-        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
-        output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
-        xml_response = session.get(output_xml_url, timeout=30) if build_result != "ABORTED" else None
+        session = get_jenkins_client()
         
         # Parse thông tin từ output.xml
         total_tests = 0
@@ -229,36 +261,26 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
             duration_seconds = body['build']['duration'] // 1000
             end_time = start_time + timedelta(seconds=duration_seconds) if start_time else None
         
-        if xml_response and xml_response.status_code == 200:
+        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
+        # Parse dạng stream trên HTTP response, không nạp cả file vào bộ nhớ
+        test_results = TestResultCollector()
+        if build_result != "ABORTED":
+            output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
             try:
-                root = ET.fromstring(xml_response.text)
-                
-                # Lấy thông tin từ robot output.xml - sử dụng thống kê từ XML
-                stats = root.find('.//statistics')
-                if stats is not None:
-                    total = stats.find('.//total')
-                    if total is not None:
-                        total_stat = total.find('.//stat')
-                        if total_stat is not None:
-                            passed_tests = int(total_stat.get('pass', 0))
-                            failed_tests = int(total_stat.get('fail', 0))
-                            skipped_tests = int(total_stat.get('skip', 0))
-                            total_tests = passed_tests + failed_tests + skipped_tests
-                
-                # Lấy thông tin thời gian từ XML
-                suite = root.find('.//suite')
-                if suite is not None:
-                    start_time_str = suite.get('starttime')
-                    end_time_str = suite.get('endtime')
-                    if start_time_str and end_time_str:
-                        try:
-                            start_time = datetime.strptime(start_time_str, '%Y%m%d %H:%M:%S.%f')
-                            end_time = datetime.strptime(end_time_str, '%Y%m%d %H:%M:%S.%f')
-                            duration_seconds = int((end_time - start_time).total_seconds())
-                        except ValueError:
-                            pass
+                summary = fetch_output_xml_summary(session, output_xml_url, on_test=test_results)
             except ET.ParseError as e:
                 print(f"[WARNING] Failed to parse output.xml: {e}")
+                summary = None
+            
+            if summary:
+                total_tests = summary['total_tests']
+                passed_tests = summary['passed_tests']
+                failed_tests = summary['failed_tests']
+                skipped_tests = summary['skipped_tests']
+                if summary['start_time'] and summary['end_time']:
+                    start_time = summary['start_time']
+                    end_time = summary['end_time']
+                    duration_seconds = summary['duration_seconds']
         
         # Luôn tạo report mới cho mỗi lần chạy execution
         report = Report(
@@ -277,9 +299,8 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
             end_time=end_time,
             status=build_result.lower() if build_result else 'completed'
         )
-        db.add(report)
-        db.commit()
-        db.refresh(report)
+        # Webhook được xử lý lại: dùng lại report đã lưu của build này
+        report = save_build_report(report, test_results, db)
         
         # Cập nhật status của execution theo kết quả thực tế
         if build_result == "ABORTED":
@@ -303,9 +324,9 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
                 recipients = [email.strip() for email in execution.email_recipients.split(',') if email.strip()]
                 
                 if recipients:
-                    # Gửi email report
+                    # Ghi email report vào outbox (lỗi database được ném ra để webhook event retry)
                     email_service = EmailService()
-                    email_result = email_service.send_task_report_email({
+                    email_result = email_service.queue_task_report_email({
                         'task_id': execution.task_id,
                         'task_name': execution.task_name,
                         'project_name': project.name,
@@ -322,30 +343,32 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
                     })
                     
                     if email_result.get('success'):
-                        print(f"✅ Email sent successfully to {len(recipients)} recipients for task {execution.task_id}")
-                        log_backend_event("INFO", f"Email sent successfully for task {execution.task_id} to {len(recipients)} recipients", db)
+                        print(f"✅ Email queued for {len(recipients)} recipients for task {execution.task_id}")
+                        log_backend_event("INFO", f"Email queued for task {execution.task_id} to {len(recipients)} recipients", db)
                     else:
-                        print(f"❌ Failed to send email for task {execution.task_id}: {email_result.get('error')}")
-                        log_backend_event("ERROR", f"Failed to send email for task {execution.task_id}: {email_result.get('error')}", db)
+                        print(f"❌ Failed to queue email for task {execution.task_id}: {email_result.get('error')}")
+                        log_backend_event("ERROR", f"Failed to queue email for task {execution.task_id}: {email_result.get('error')}", db)
                         
             except Exception as e:
                 print(f"❌ Error sending email for task {execution.task_id}: {e}")
                 log_backend_event("ERROR", f"Error sending email for task {execution.task_id}: {e}", db)
+                # Outbox idempotent theo task#build - webhook event được retry và ghi lại email
+                raise
         else:
             print(f"ℹ️ No email recipients configured for task {execution.task_id}")
         
-        # Tạo thông báo cho execution
-        try:
-            create_notification(
-                task_id=execution.task_id,
-                task_name=execution.task_name,
-                task_type='execution',
-                status=build_result.lower() if build_result else 'completed',
-                project_name=project.name,
-                db=db
-            )
-        except Exception as e:
-            print(f"[WARNING] Failed to create notification for execution: {e}")
+        # Tạo thông báo cho execution (một thông báo cho mỗi build, kể cả khi webhook được xử lý lại)
+        notification = create_notification(
+            task_id=execution.task_id,
+            task_name=execution.task_name,
+            task_type='execution',
+            status=build_result.lower() if build_result else 'completed',
+            project_name=project.name,
+            idempotency_key=f"{execution.task_id}#{build_number}",
+            db=db
+        )
+        if notification is None:
+            raise RuntimeError(f"Failed to create notification for {execution.task_id} build #{build_number}")
         
         return {
             "message": f"Đã lưu report cho execution '{execution.task_name}' thành công",
@@ -369,18 +392,24 @@ def process_execution_webhook(execution, job_name, build_number, build_result, b
             detail=f"Lỗi kết nối Jenkins: {str(e)}"
         )
 
-def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
-    """Xử lý webhook cho CI/CD task"""
-    print(f"[DEBUG] Processing webhook for CI/CD task: {cicd.cicd_name}")
-    
-    # Cập nhật lại defaultValue cho TASK_ID sau khi job chạy xong
+def refresh_cicd_jenkins_config(cicd, job_name):
+    """
+    Cập nhật lại defaultValue cho TASK_ID của job sau khi job chạy xong (POST config Jenkins).
+    Gọi từ webhook_queue một lần cho mỗi build; trả về True nếu thành công.
+    """
     try:
         from routes.cicd import configure_jenkins_webhook_trigger
         cicd_task_id = f"CICD-{cicd.id:03d}"
         configure_jenkins_webhook_trigger(job_name, cicd_task_id)
         print(f"[DEBUG] Đã cập nhật defaultValue cho {job_name}: {cicd_task_id}")
+        return True
     except Exception as e:
         print(f"[WARNING] Không thể cập nhật defaultValue: {e}")
+        return False
+
+def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
+    """Xử lý webhook cho CI/CD task (cấu hình Jenkins được cập nhật riêng qua refresh_cicd_jenkins_config)"""
+    print(f"[DEBUG] Processing webhook for CI/CD task: {cicd.cicd_name}")
     
     # Lấy thông tin project
     project = db.query(Project).filter(Project.id == cicd.project_id).first()
@@ -391,11 +420,7 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
     JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
     
     try:
-        session = requests.Session()
-        
-        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
-        output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
-        xml_response = session.get(output_xml_url, timeout=30) if build_result != "ABORTED" else None
+        session = get_jenkins_client()
         
         # Parse thông tin từ output.xml
         total_tests = 0
@@ -413,36 +438,26 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
             duration_seconds = body['build']['duration'] // 1000
             end_time = start_time + timedelta(seconds=duration_seconds) if start_time else None
         
-        if xml_response and xml_response.status_code == 200:
+        # Lấy file output.xml để parse thông tin test (chỉ khi không phải ABORTED)
+        # Parse dạng stream trên HTTP response, không nạp cả file vào bộ nhớ
+        test_results = TestResultCollector()
+        if build_result != "ABORTED":
+            output_xml_url = f"{JENKINS_URL}/job/{job_name}/{build_number}/robot/report/output.xml"
             try:
-                root = ET.fromstring(xml_response.text)
-                
-                # Lấy thông tin từ robot output.xml - sử dụng thống kê từ XML
-                stats = root.find('.//statistics')
-                if stats is not None:
-                    total = stats.find('.//total')
-                    if total is not None:
-                        total_stat = total.find('.//stat')
-                        if total_stat is not None:
-                            passed_tests = int(total_stat.get('pass', 0))
-                            failed_tests = int(total_stat.get('fail', 0))
-                            skipped_tests = int(total_stat.get('skip', 0))
-                            total_tests = passed_tests + failed_tests + skipped_tests
-                
-                # Lấy thông tin thời gian từ XML
-                suite = root.find('.//suite')
-                if suite is not None:
-                    start_time_str = suite.get('starttime')
-                    end_time_str = suite.get('endtime')
-                    if start_time_str and end_time_str:
-                        try:
-                            start_time = datetime.strptime(start_time_str, '%Y%m%d %H:%M:%S.%f')
-                            end_time = datetime.strptime(end_time_str, '%Y%m%d %H:%M:%S.%f')
-                            duration_seconds = int((end_time - start_time).total_seconds())
-                        except ValueError:
-                            pass
+                summary = fetch_output_xml_summary(session, output_xml_url, on_test=test_results)
             except ET.ParseError as e:
                 print(f"[WARNING] Failed to parse output.xml: {e}")
+                summary = None
+            
+            if summary:
+                total_tests = summary['total_tests']
+                passed_tests = summary['passed_tests']
+                failed_tests = summary['failed_tests']
+                skipped_tests = summary['skipped_tests']
+                if summary['start_time'] and summary['end_time']:
+                    start_time = summary['start_time']
+                    end_time = summary['end_time']
+                    duration_seconds = summary['duration_seconds']
         
         # Luôn tạo report mới cho mỗi lần chạy cicd
         report = Report(
@@ -461,9 +476,8 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
             end_time=end_time,
             status=build_result.lower() if build_result else 'completed'
         )
-        db.add(report)
-        db.commit()
-        db.refresh(report)
+        # Webhook được xử lý lại: dùng lại report đã lưu của build này
+        report = save_build_report(report, test_results, db)
         
         # Cập nhật status của CI/CD task theo kết quả thực tế
         if build_result == "ABORTED":
@@ -487,10 +501,12 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
                 recipients = [email.strip() for email in cicd.email_recipients.split(',') if email.strip()]
                 
                 if recipients:
-                    # Gửi email report
+                    # Ghi email report vào outbox (lỗi database được ném ra để webhook event retry)
                     email_service = EmailService()
-                    email_result = email_service.send_task_report_email({
+                    email_result = email_service.queue_task_report_email({
                         'task_id': cicd.cicd_id,
+                        'report_id': report.id,
+                        'email_digest': cicd.email_digest,
                         'task_name': cicd.cicd_name,
                         'project_name': project.name,
                         'project_id': cicd.project_id,
@@ -506,30 +522,32 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
                     })
                     
                     if email_result.get('success'):
-                        print(f"✅ Email sent successfully to {len(recipients)} recipients for task {cicd.cicd_id}")
-                        log_backend_event("INFO", f"Email sent successfully for task {cicd.cicd_id} to {len(recipients)} recipients", db)
+                        print(f"✅ Email queued for {len(recipients)} recipients for task {cicd.cicd_id}")
+                        log_backend_event("INFO", f"Email queued for task {cicd.cicd_id} to {len(recipients)} recipients", db)
                     else:
-                        print(f"❌ Failed to send email for task {cicd.cicd_id}: {email_result.get('error')}")
-                        log_backend_event("ERROR", f"Failed to send email for task {cicd.cicd_id}: {email_result.get('error')}", db)
+                        print(f"❌ Failed to queue email for task {cicd.cicd_id}: {email_result.get('error')}")
+                        log_backend_event("ERROR", f"Failed to queue email for task {cicd.cicd_id}: {email_result.get('error')}", db)
                         
             except Exception as e:
                 print(f"❌ Error sending email for task {cicd.cicd_id}: {e}")
                 log_backend_event("ERROR", f"Error sending email for task {cicd.cicd_id}: {e}", db)
+                # Outbox idempotent theo task#build - webhook event được retry và ghi lại email
+                raise
         else:
             print(f"ℹ️ No email recipients configured for task {cicd.cicd_id}")
         
-        # Tạo thông báo cho CI/CD
-        try:
-            create_notification(
-                task_id=cicd.cicd_id,
-                task_name=cicd.cicd_name,
-                task_type='cicd',
-                status=build_result.lower() if build_result else 'completed',
-                project_name=project.name,
-                db=db
-            )
-        except Exception as e:
-            print(f"[WARNING] Failed to create notification for CI/CD: {e}")
+        # Tạo thông báo cho CI/CD (một thông báo cho mỗi build, kể cả khi webhook được xử lý lại)
+        notification = create_notification(
+            task_id=cicd.cicd_id,
+            task_name=cicd.cicd_name,
+            task_type='cicd',
+            status=build_result.lower() if build_result else 'completed',
+            project_name=project.name,
+            idempotency_key=f"{cicd.cicd_id}#{build_number}",
+            db=db
+        )
+        if notification is None:
+            raise RuntimeError(f"Failed to create notification for {cicd.cicd_id} build #{build_number}")
         
         return {
             "message": f"Đã lưu report cho CI/CD '{cicd.cicd_name}' thành công",
@@ -553,16 +571,6 @@ def process_cicd_webhook(cicd, job_name, build_number, build_result, body, db):
             detail=f"Lỗi kết nối Jenkins: {str(e)}"
         )
 
-def log_backend_event(level, message, db):
-    """Log event to database"""
-    try:
-        from database import Log
-        log_entry = Log(level=level, message=message, source="backend")
-        db.add(log_entry)
-        db.commit()
-    except Exception as e:
-        print(f"[WARNING] Failed to log event: {e}")
-
 router = APIRouter()
  
 @router.get("/", response_class=HTMLResponse)
@@ -584,34 +592,44 @@ def get_dashboard_stats():
         from database import SessionLocal
         db = SessionLocal()
         try:
-            from database import Plan, Cicd, TestCase
-            from sqlalchemy import func
-            from datetime import datetime, timedelta
+            from stats_rollup import get_stats, today_key
+
+            # Đọc bộ đếm từ bảng dashboard_stats (cập nhật bởi trigger) thay vì COUNT(*) từng bảng
+            task_types = ["execution", "plan", "cicd"]
+            task_statuses = ["running", "success", "failed", "cancelled"]
+            today = today_key()
+            keys = ["projects.total", "projects.status.active",
+                    "reports.total_tests", "reports.passed_tests", "reports.failed_tests"]
+            for task_type in task_types:
+                keys.append(f"tasks.{task_type}.total")
+                keys.append(f"tasks.{task_type}.created.{today}")
+                keys += [f"tasks.{task_type}.status.{s}" for s in task_statuses]
+            stats = get_stats(db, keys)
 
             # Thống kê projects
-            total_projects = db.query(Project).count()
-            active_projects = db.query(Project).filter(Project.status == "active").count()
+            total_projects = stats["projects.total"]
+            active_projects = stats["projects.status.active"]
 
             # Thống kê executions
-            total_executions = db.query(Execution).count()
-            running_executions = db.query(Execution).filter(Execution.status == "running").count()
-            success_executions = db.query(Execution).filter(Execution.status == "success").count()
-            failed_executions = db.query(Execution).filter(Execution.status == "failed").count()
-            cancelled_executions = db.query(Execution).filter(Execution.status == "cancelled").count()
+            total_executions = stats["tasks.execution.total"]
+            running_executions = stats["tasks.execution.status.running"]
+            success_executions = stats["tasks.execution.status.success"]
+            failed_executions = stats["tasks.execution.status.failed"]
+            cancelled_executions = stats["tasks.execution.status.cancelled"]
 
             # Thống kê plans
-            total_plans = db.query(Plan).count()
-            running_plans = db.query(Plan).filter(Plan.status == "running").count()
-            success_plans = db.query(Plan).filter(Plan.status == "success").count()
-            failed_plans = db.query(Plan).filter(Plan.status == "failed").count()
-            cancelled_plans = db.query(Plan).filter(Plan.status == "cancelled").count()
+            total_plans = stats["tasks.plan.total"]
+            running_plans = stats["tasks.plan.status.running"]
+            success_plans = stats["tasks.plan.status.success"]
+            failed_plans = stats["tasks.plan.status.failed"]
+            cancelled_plans = stats["tasks.plan.status.cancelled"]
 
             # Thống kê CI/CD tasks
-            total_cicd = db.query(Cicd).count()
-            running_cicd = db.query(Cicd).filter(Cicd.status == "running").count()
-            success_cicd = db.query(Cicd).filter(Cicd.status == "success").count()
-            failed_cicd = db.query(Cicd).filter(Cicd.status == "failed").count()
-            cancelled_cicd = db.query(Cicd).filter(Cicd.status == "cancelled").count()
+            total_cicd = stats["tasks.cicd.total"]
+            running_cicd = stats["tasks.cicd.status.running"]
+            success_cicd = stats["tasks.cicd.status.success"]
+            failed_cicd = stats["tasks.cicd.status.failed"]
+            cancelled_cicd = stats["tasks.cicd.status.cancelled"]
 
             # Tổng hợp
             total_tasks = total_executions + total_plans + total_cicd
@@ -621,15 +639,11 @@ def get_dashboard_stats():
             cancelled_tasks = cancelled_executions + cancelled_plans + cancelled_cicd
 
             # Thống kê test cases đã chạy (tổng hợp từ tất cả reports)
-            total_testcases = db.query(func.sum(Report.total_tests)).scalar() or 0
-            active_testcases = (db.query(func.sum(Report.passed_tests)).scalar() or 0) + (db.query(func.sum(Report.failed_tests)).scalar() or 0)
+            total_testcases = stats["reports.total_tests"]
+            active_testcases = stats["reports.passed_tests"] + stats["reports.failed_tests"]
 
             # Thống kê tasks today (theo ngày hiện tại)
-            today = datetime.utcnow().date()
-            executions_today = db.query(Execution).filter(func.date(Execution.created_at) == today).count()
-            plans_today = db.query(Plan).filter(func.date(Plan.created_at) == today).count()
-            cicd_today = db.query(Cicd).filter(func.date(Cicd.created_at) == today).count()
-            tasks_today = executions_today + plans_today + cicd_today
+            tasks_today = sum(stats[f"tasks.{task_type}.created.{today}"] for task_type in task_types)
 
             # Success rate
             completed_tasks = total_tasks - running_tasks
@@ -666,83 +680,100 @@ def get_dashboard_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+@router.post("/dashboard-stats/rebuild")
+def rebuild_dashboard_stats_endpoint(db: Session = Depends(get_db)):
+    """Tính lại bảng dashboard_stats từ dữ liệu gốc (dùng khi backfill hoặc sửa dữ liệu trực tiếp trong DB)"""
+    try:
+        from stats_rollup import rebuild_dashboard_stats
+        keys = rebuild_dashboard_stats(db)
+        log_backend_event("INFO", f"Rebuilt dashboard stats ({keys} keys)", db)
+        return {"message": "Đã tính lại thống kê dashboard", "keys": keys}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
 @router.get("/execution-trends")
-def get_execution_trends(days: int = 30):
-    """Lấy xu hướng tasks dựa trên số lần thực sự chạy Jenkins job (bao gồm executions, plans, CI/CD)"""
+def get_execution_trends(
+    days: int = 30,
+    granularity: str = "day",
+    project_id: Optional[int] = None,
+    task_type: Optional[str] = None
+):
+    """
+    Lấy xu hướng tasks dựa trên số lần thực sự chạy Jenkins job (bao gồm executions, plans, CI/CD).
+    Đọc từ bảng report_trends đã tổng hợp sẵn theo giờ/ngày; hỗ trợ lọc theo project và loại task.
+    """
     try:
-        from database import SessionLocal
+        from database import SessionLocal, ReportTrend
+        
+        if granularity not in ("day", "hour"):
+            raise HTTPException(status_code=400, detail="granularity phải là 'day' hoặc 'hour'")
+        if days < 1 or days > 3650:
+            raise HTTPException(status_code=400, detail="days phải nằm trong khoảng 1-3650")
+        if granularity == "hour" and days > 31:
+            raise HTTPException(status_code=400, detail="granularity 'hour' chỉ hỗ trợ tối đa 31 ngày")
+        
         db = SessionLocal()
         try:
-            from database import Plan, Cicd
-            
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
             
-            # Lấy reports theo ngày (dựa trên thời gian thực sự chạy Jenkins job)
-            # Bao gồm tất cả loại tasks: executions, plans, CI/CD
-            daily_reports = db.query(
-                func.date(Report.created_at).label('date'),
-                func.count(Report.id).label('count'),
-                func.sum(func.cast(1, Integer)).filter(Report.status == "success").label('success'),
-                func.sum(func.cast(1, Integer)).filter(Report.status == "failure").label('failed'),
-                func.sum(func.cast(1, Integer)).filter(Report.status == "aborted").label('cancelled')
+            if granularity == "hour":
+                step = timedelta(hours=1)
+                first_bucket = start_date.replace(minute=0, second=0, microsecond=0)
+                label_format = '%Y-%m-%d %H:00'
+            else:
+                step = timedelta(days=1)
+                first_bucket = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+                label_format = '%Y-%m-%d'
+            
+            # Lấy các bucket đã tổng hợp (dựa trên thời gian thực sự chạy Jenkins job)
+            query = db.query(
+                ReportTrend.bucket_start,
+                func.sum(ReportTrend.total).label('total'),
+                func.sum(ReportTrend.success).label('success'),
+                func.sum(ReportTrend.failed).label('failed'),
+                func.sum(ReportTrend.cancelled).label('cancelled')
             ).filter(
-                Report.created_at >= start_date,
-                Report.id.isnot(None)  # Chỉ đếm những job có build number
-            ).group_by(
-                func.date(Report.created_at)
-            ).all()
+                ReportTrend.granularity == granularity,
+                ReportTrend.bucket_start >= first_bucket,
+                ReportTrend.bucket_start <= end_date
+            )
+            if project_id is not None:
+                query = query.filter(ReportTrend.project_id == project_id)
+            if task_type:
+                query = query.filter(ReportTrend.task_type == task_type)
             
-            # Tạo dictionary để tổng hợp dữ liệu
-            daily_data = {}
+            buckets = {
+                row.bucket_start: row
+                for row in query.group_by(ReportTrend.bucket_start).all()
+            }
             
-            # Thêm reports (số lần thực sự chạy Jenkins job)
-            for day in daily_reports:
-                date_str = str(day.date)
-                if date_str not in daily_data:
-                    daily_data[date_str] = {
-                        'total': 0, 'success': 0, 'failed': 0, 'cancelled': 0
-                    }
-                daily_data[date_str]['total'] += day.count or 0
-                daily_data[date_str]['success'] += day.success or 0
-                daily_data[date_str]['failed'] += day.failed or 0
-                daily_data[date_str]['cancelled'] += day.cancelled or 0
-            
-            # Tạo danh sách đầy đủ 30 ngày
-            all_dates = []
-            current_date = start_date
-            while current_date <= end_date:
-                all_dates.append(current_date.strftime('%Y-%m-%d'))
-                current_date += timedelta(days=1)
-            
-            # Tạo response với đầy đủ 30 ngày
+            # Tạo danh sách đầy đủ các bucket trong khoảng thời gian (bucket trống = 0)
             result_data = []
-            for date_str in all_dates:
-                if date_str in daily_data:
-                    # Có dữ liệu cho ngày này
-                    result_data.append({
-                        "date": date_str,
-                        "total": daily_data[date_str]['total'],
-                        "success": daily_data[date_str]['success'],
-                        "failed": daily_data[date_str]['failed'],
-                        "cancelled": daily_data[date_str]['cancelled']
-                    })
-                else:
-                    # Không có dữ liệu cho ngày này
-                    result_data.append({
-                        "date": date_str,
-                        "total": 0,
-                        "success": 0,
-                        "failed": 0,
-                        "cancelled": 0
-                    })
+            current = first_bucket
+            while current <= end_date:
+                row = buckets.get(current)
+                result_data.append({
+                    "date": current.strftime(label_format),
+                    "total": int(row.total or 0) if row else 0,
+                    "success": int(row.success or 0) if row else 0,
+                    "failed": int(row.failed or 0) if row else 0,
+                    "cancelled": int(row.cancelled or 0) if row else 0
+                })
+                current += step
             
             return {
                 "period": f"Last {days} days",
+                "granularity": granularity,
+                "project_id": project_id,
+                "task_type": task_type,
                 "data": result_data
             }
         finally:
             db.close()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
@@ -753,57 +784,28 @@ def get_project_performance():
         from database import SessionLocal
         db = SessionLocal()
         try:
-            from database import Plan, Cicd
-            
-            # Lấy tất cả projects
-            projects = db.query(Project).all()
+            # Lấy tất cả projects và số liệu của chúng trong 2 query tổng hợp
+            projects = db.query(Project.id, Project.name).all()
+            metrics = get_project_metrics(db)
             result = []
             
             for project in projects:
-                # Thống kê executions cho project này
-                execution_stats = db.query(
-                    func.count(Execution.id).label('total_executions'),
-                    func.sum(func.cast(1, Integer)).filter(Execution.status == "success").label('execution_success'),
-                    func.sum(func.cast(1, Integer)).filter(Execution.status == "failed").label('execution_failed'),
-                    func.sum(func.cast(1, Integer)).filter(Execution.status == "cancelled").label('execution_cancelled'),
-                    func.sum(func.cast(1, Integer)).filter(Execution.status == "running").label('execution_running')
-                ).filter(
-                    Execution.project_id == project.id
-                ).first()
-                
-                # Thống kê plans cho project này
-                plan_stats = db.query(
-                    func.count(Plan.id).label('total_plans'),
-                    func.sum(func.cast(1, Integer)).filter(Plan.status == "success").label('plan_success'),
-                    func.sum(func.cast(1, Integer)).filter(Plan.status == "failed").label('plan_failed'),
-                    func.sum(func.cast(1, Integer)).filter(Plan.status == "cancelled").label('plan_cancelled'),
-                    func.sum(func.cast(1, Integer)).filter(Plan.status == "running").label('plan_running')
-                ).filter(
-                    Plan.project_id == project.id
-                ).first()
-                
-                # Thống kê CI/CD tasks cho project này
-                cicd_stats = db.query(
-                    func.count(Cicd.id).label('total_cicd'),
-                    func.sum(func.cast(1, Integer)).filter(Cicd.status == "success").label('cicd_success'),
-                    func.sum(func.cast(1, Integer)).filter(Cicd.status == "failed").label('cicd_failed'),
-                    func.sum(func.cast(1, Integer)).filter(Cicd.status == "cancelled").label('cicd_cancelled'),
-                    func.sum(func.cast(1, Integer)).filter(Cicd.status == "running").label('cicd_running')
-                ).filter(
-                    Cicd.project_id == project.id
-                ).first()
+                tasks = (metrics.get(project.id) or {}).get("tasks", {})
+                execution_stats = tasks.get("execution", {})
+                plan_stats = tasks.get("plan", {})
+                cicd_stats = tasks.get("cicd", {})
                 
                 # Tổng hợp thống kê
-                total_executions = execution_stats.total_executions or 0
-                total_plans = plan_stats.total_plans or 0
-                total_cicd = cicd_stats.total_cicd or 0
+                total_executions = sum(execution_stats.values())
+                total_plans = sum(plan_stats.values())
+                total_cicd = sum(cicd_stats.values())
                 total_tasks = total_executions + total_plans + total_cicd
                 
                 # Tổng hợp status
-                total_success = (execution_stats.execution_success or 0) + (plan_stats.plan_success or 0) + (cicd_stats.cicd_success or 0)
-                total_failed = (execution_stats.execution_failed or 0) + (plan_stats.plan_failed or 0) + (cicd_stats.cicd_failed or 0)
-                total_cancelled = (execution_stats.execution_cancelled or 0) + (plan_stats.plan_cancelled or 0) + (cicd_stats.cicd_cancelled or 0)
-                total_running = (execution_stats.execution_running or 0) + (plan_stats.plan_running or 0) + (cicd_stats.cicd_running or 0)
+                total_success = sum(stats.get("success", 0) for stats in (execution_stats, plan_stats, cicd_stats))
+                total_failed = sum(stats.get("failed", 0) for stats in (execution_stats, plan_stats, cicd_stats))
+                total_cancelled = sum(stats.get("cancelled", 0) for stats in (execution_stats, plan_stats, cicd_stats))
+                total_running = sum(stats.get("running", 0) for stats in (execution_stats, plan_stats, cicd_stats))
                 
                 # Tính success rate: success / (total - running) * 100
                 # Loại trừ running vì chưa hoàn thành
@@ -851,21 +853,36 @@ def get_task_reports(project_id: Optional[int] = None, status: Optional[str] = N
             
             executions = query.join(Project, Execution.project_id == Project.id).all()
             
+            # Lấy plans
+            plan_query = db.query(Plan, Project.name.label('project_name'))
+            
+            if project_id:
+                plan_query = plan_query.filter(Plan.project_id == project_id)
+            if status:
+                plan_query = plan_query.filter(Plan.status == status)
+            
+            plans = plan_query.join(Project, Plan.project_id == Project.id).all()
+            
+            # Lấy CI/CD tasks
+            cicd_query = db.query(Cicd, Project.name.label('project_name'))
+            
+            if project_id:
+                cicd_query = cicd_query.filter(Cicd.project_id == project_id)
+            if status:
+                cicd_query = cicd_query.filter(Cicd.status == status)
+            
+            cicd_tasks = cicd_query.join(Project, Cicd.project_id == Project.id).all()
+            
+            # Report mới nhất KHÔNG PHẢI cancelled/aborted của tất cả task - một query duy nhất
+            latest_reports = get_latest_reports(
+                db,
+                [exe.task_id for exe, _ in executions]
+                + [plan.plan_id for plan, _ in plans]
+                + [cicd.cicd_id for cicd, _ in cicd_tasks]
+            )
+            
             for exe, project_name in executions:
-                # Lấy report gần nhất KHÔNG PHẢI cancelled/aborted
-                from database import Report
-                reports = db.query(Report).filter(Report.task_id == exe.task_id).order_by(Report.created_at.desc()).all()
-                report = None
-                if reports:
-                    if reports[0].status in ["cancelled", "aborted"]:
-                        for r in reports:
-                            if r.status not in ["cancelled", "aborted"]:
-                                report = r
-                                break
-                        if not report:
-                            report = reports[0]
-                    else:
-                        report = reports[0]
+                report = latest_reports.get(exe.task_id)
                 # Tạo report data cho execution
                 report_data = {
                     "id": exe.id,
@@ -888,30 +905,8 @@ def get_task_reports(project_id: Optional[int] = None, status: Optional[str] = N
                 }
                 result.append(report_data)
             
-            # Lấy plans
-            plan_query = db.query(Plan, Project.name.label('project_name'))
-            
-            if project_id:
-                plan_query = plan_query.filter(Plan.project_id == project_id)
-            if status:
-                plan_query = plan_query.filter(Plan.status == status)
-            
-            plans = plan_query.join(Project, Plan.project_id == Project.id).all()
-            
             for plan, project_name in plans:
-                from database import Report
-                reports = db.query(Report).filter(Report.task_id == plan.plan_id).order_by(Report.created_at.desc()).all()
-                report = None
-                if reports:
-                    if reports[0].status in ["cancelled", "aborted"]:
-                        for r in reports:
-                            if r.status not in ["cancelled", "aborted"]:
-                                report = r
-                                break
-                        if not report:
-                            report = reports[0]
-                    else:
-                        report = reports[0]
+                report = latest_reports.get(plan.plan_id)
                 report_data = {
                     "id": plan.id,
                     "task_id": plan.plan_id,
@@ -934,30 +929,8 @@ def get_task_reports(project_id: Optional[int] = None, status: Optional[str] = N
                 }
                 result.append(report_data)
             
-            # Lấy CI/CD tasks
-            cicd_query = db.query(Cicd, Project.name.label('project_name'))
-            
-            if project_id:
-                cicd_query = cicd_query.filter(Cicd.project_id == project_id)
-            if status:
-                cicd_query = cicd_query.filter(Cicd.status == status)
-            
-            cicd_tasks = cicd_query.join(Project, Cicd.project_id == Project.id).all()
-            
             for cicd, project_name in cicd_tasks:
-                from database import Report
-                reports = db.query(Report).filter(Report.task_id == cicd.cicd_id).order_by(Report.created_at.desc()).all()
-                report = None
-                if reports:
-                    if reports[0].status in ["cancelled", "aborted"]:
-                        for r in reports:
-                            if r.status not in ["cancelled", "aborted"]:
-                                report = r
-                                break
-                        if not report:
-                            report = reports[0]
-                    else:
-                        report = reports[0]
+                report = latest_reports.get(cicd.cicd_id)
                 report_data = {
                     "id": cicd.id,
                     "task_id": f"CICD-{cicd.id:03d}",
@@ -1000,7 +973,7 @@ def get_testcase_stats():
                 func.sum(func.cast(1, Integer)).filter(TestCase.status == "active").label('active'),
                 func.sum(func.cast(1, Integer)).filter(TestCase.priority == "high").label('high_priority')
             ).outerjoin(
-                TestCase, Project.id == TestCase.project_id
+                TestCase, and_(Project.id == TestCase.project_id, TestCase.deleted_at.is_(None))
             ).group_by(
                 Project.name
             ).all()
@@ -1036,7 +1009,7 @@ def test_parse_xml():
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         output_xml_url = f"{JENKINS_URL}/job/GW040-NS/lastBuild/robot/report/output.xml"
         
-        response = requests.get(output_xml_url, timeout=30)
+        response = get_jenkins_client().get(output_xml_url)
         if response.status_code == 200:
             root = ET.fromstring(response.text)
             
@@ -1071,44 +1044,67 @@ def test_parse_xml():
         return {"error": str(e)}
 
 @router.get("/list")
-def get_reports_list():
-    """Lấy danh sách tất cả reports từ database"""
+def get_reports_list(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    project_id: Optional[int] = None,
+    status: Optional[str] = None,
+    task_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    """
+    Lấy danh sách reports theo trang (mới nhất trước).
+
+    Phân trang keyset trên (created_at, id): truyền next_cursor của trang trước vào cursor.
+    Lọc theo project_id, status, task_type (execution/plan/cicd), date_from/date_to (created_at).
+    Tên task được lấy theo lô cho cả trang.
+
+    Response: {"reports", "count", "next_cursor", "has_more"}. Khác với trước đây, endpoint không
+    trả về toàn bộ reports: mặc định chỉ limit=100 report mới nhất, count là số report của trang này
+    (không phải tổng). Client cần đủ danh sách phải đi tiếp theo next_cursor cho tới khi has_more=false.
+    """
+    limit = max(1, min(limit, 1000))
+    if task_type is not None and task_type not in TASK_ID_PREFIXES:
+        raise HTTPException(status_code=400, detail=f"Invalid task_type: {task_type}")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         from database import SessionLocal
         db = SessionLocal()
         try:
-            from database import Report, Execution, Plan, Cicd, Project
-            
-            # Lấy tất cả reports với thông tin execution, plan, CI/CD và project
-            reports = db.query(Report).all()
+            # Dòng created_at NULL không có vị trí trong thứ tự keyset
+            query = db.query(Report).filter(Report.created_at.isnot(None))
+            if project_id is not None:
+                query = query.filter(Report.project_id == project_id)
+            if status:
+                query = query.filter(Report.status == status)
+            if task_type:
+                query = query.filter(Report.task_id.like(f"{TASK_ID_PREFIXES[task_type]}%"))
+            if date_from:
+                query = query.filter(Report.created_at >= date_from)
+            if date_to:
+                query = query.filter(Report.created_at <= date_to)
+            if cursor_key:
+                # Dùng index idx_reports_created_at_id (created_at DESC, id DESC)
+                query = query.filter(tuple_(Report.created_at, Report.id) < cursor_key)
+
+            reports = query.order_by(Report.created_at.desc(), Report.id.desc()).limit(limit + 1).all()
+            has_more = len(reports) > limit
+            reports = reports[:limit]
+            task_names = resolve_task_names(db, [report.task_id for report in reports])
+
             result = []
-            
             for report in reports:
-                # Lấy thông tin project
-                project = db.query(Project).filter(Project.id == report.project_id).first()
-                
-                # Lấy thông tin task dựa trên task_id
-                task_name = "N/A"
-                if report.task_id.startswith("CICD-"):
-                    # Lấy thông tin CI/CD task
-                    cicd_id = int(report.task_id.split("-")[1])
-                    cicd_task = db.query(Cicd).filter(Cicd.id == cicd_id).first()
-                    task_name = cicd_task.cicd_name if cicd_task else "N/A"
-                elif report.task_id.startswith("PLAN-"):
-                    # Lấy thông tin plan
-                    plan = db.query(Plan).filter(Plan.plan_id == report.task_id).first()
-                    task_name = plan.plan_name if plan else "N/A"
-                else:
-                    # Lấy thông tin execution (mặc định)
-                    execution = db.query(Execution).filter(Execution.task_id == report.task_id).first()
-                    task_name = execution.task_name if execution else "N/A"
-                
                 result.append({
                     "id": report.id,
                     "execution_id": report.execution_id,
                     "task_id": report.task_id,
                     "task_type": report.task_type,
-                    "task_name": task_name,
+                    "task_name": task_names.get(report.task_id, "N/A"),
                     "project_id": report.project_id,
                     "project_name": report.project_name,
                     "total_tests": report.total_tests,
@@ -1125,17 +1121,23 @@ def get_reports_list():
                     "status": report.status,
                     "created_at": report.created_at.isoformat() if report.created_at else None
                 })
-            
-            return {
-                "reports": result,
-                "count": len(result)
-            }
+
+            next_cursor = None
+            if has_more and reports:
+                next_cursor = encode_cursor(reports[-1].created_at, reports[-1].id)
         finally:
             db.close()
     except Exception as e:
         print(f"[DEBUG] Error getting reports list: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+    return {
+        "reports": result,
+        "count": len(result),
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
+
 @router.post("/jenkins/save-report/{task_id}")
 def save_jenkins_report(task_id: str):
     """Lưu kết quả report từ Jenkins vào database cho tất cả loại task (executions, plans, CI/CD)"""
@@ -1193,8 +1195,8 @@ def save_jenkins_report(task_id: str):
             print(f"[DEBUG] {task_type.title()} {task_id}: last_build_url={last_build_url}")
             
             try:
-                session = requests.Session()
-                response = session.get(last_build_url, timeout=30)
+                session = get_jenkins_client()
+                response = session.get(last_build_url)
                 
                 if response.status_code == 200:
                     build_info = response.json()
@@ -1209,9 +1211,8 @@ def save_jenkins_report(task_id: str):
                     if building:
                         raise HTTPException(status_code=400, detail="Jenkins job đang chạy, chưa có kết quả")
                     
-                    # Lấy file output.xml để parse thông tin test
+                    # Lấy file output.xml để parse thông tin test (stream, không nạp cả file vào bộ nhớ)
                     output_xml_url = f"{JENKINS_URL}/job/{task.jenkins_job}/lastBuild/robot/report/output.xml"
-                    xml_response = session.get(output_xml_url, timeout=30)
                     
                     # Parse thông tin từ output.xml
                     total_tests = 0
@@ -1222,46 +1223,24 @@ def save_jenkins_report(task_id: str):
                     end_time = None
                     duration_seconds = 0
                     
-                    if xml_response.status_code == 200:
-                        try:
-                            root = ET.fromstring(xml_response.text)
-                            
-                            # Lấy thông tin từ robot output.xml - sử dụng thống kê từ XML
-                            stats = root.find('.//statistics')
-                            if stats is not None:
-                                total = stats.find('.//total')
-                                if total is not None:
-                                    total_stat = total.find('.//stat')
-                                    if total_stat is not None:
-                                        passed_tests = int(total_stat.get('pass', 0))
-                                        failed_tests = int(total_stat.get('fail', 0))
-                                        skipped_tests = int(total_stat.get('skip', 0))
-                                        total_tests = passed_tests + failed_tests + skipped_tests
-                            
-                            # Lấy thông tin thời gian
-                            stats = root.find('.//statistics')
-                            if stats is not None:
-                                total = stats.find('.//total')
-                                if total is not None:
-                                    start_time_str = total.get('starttime')
-                                    end_time_str = total.get('endtime')
-                                    
-                                    if start_time_str:
-                                        start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-                                    if end_time_str:
-                                        end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
-                                    
-                                    if start_time and end_time:
-                                        duration_seconds = int((end_time - start_time).total_seconds())
-                            
-                        except ET.ParseError as e:
-                            print(f"Error parsing XML: {e}")
-                            # Fallback: sử dụng thông tin từ Jenkins build
-                            if build_info.get('timestamp'):
-                                start_time = datetime.fromtimestamp(build_info['timestamp'] / 1000)
-                            if build_info.get('duration'):
-                                duration_seconds = build_info['duration'] // 1000
-                                end_time = start_time + timedelta(seconds=duration_seconds) if start_time else None
+                    try:
+                        summary = fetch_output_xml_summary(session, output_xml_url)
+                        if summary:
+                            total_tests = summary['total_tests']
+                            passed_tests = summary['passed_tests']
+                            failed_tests = summary['failed_tests']
+                            skipped_tests = summary['skipped_tests']
+                            start_time = summary['start_time']
+                            end_time = summary['end_time']
+                            duration_seconds = summary['duration_seconds']
+                    except ET.ParseError as e:
+                        print(f"Error parsing XML: {e}")
+                        # Fallback: sử dụng thông tin từ Jenkins build
+                        if build_info.get('timestamp'):
+                            start_time = datetime.fromtimestamp(build_info['timestamp'] / 1000)
+                        if build_info.get('duration'):
+                            duration_seconds = build_info['duration'] // 1000
+                            end_time = start_time + timedelta(seconds=duration_seconds) if start_time else None
                     
                     # Fallback: nếu build_number là None, thử lấy từ body['build']['full_url'] hoặc từ job_name + lastBuild nếu cần.
                     if not build_number:
@@ -1277,8 +1256,8 @@ def save_jenkins_report(task_id: str):
                             try:
                                 JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
                                 last_build_url = f"{JENKINS_URL}/job/{task.jenkins_job}/lastBuild/api/json"
-                                session = requests.Session()
-                                response = session.get(last_build_url, timeout=10)
+                                session = get_jenkins_client()
+                                response = session.get(last_build_url)
                                 if response.status_code == 200:
                                     build_info = response.json()
                                     build_number = build_info.get('number')
@@ -1403,7 +1382,7 @@ def get_jenkins_file(job_name: str, file_name: str):
     try:
         jenkins_url = os.getenv("JENKINS_URL", "http://localhost:8080")
         url = f"{jenkins_url}/job/{job_name}/lastBuild/robot/report/{file_name}"
-        response = requests.get(url, timeout=30)
+        response = get_jenkins_client().get(url)
         if response.status_code == 200:
             return StreamingResponse(
                 iter([response.content]),
@@ -1434,7 +1413,7 @@ def view_jenkins_file(job_name: str, build_number: str, file_name: str):
     try:
         jenkins_url = os.getenv("JENKINS_URL", "http://localhost:8080")
         url = f"{jenkins_url}/job/{job_name}/{build_number}/robot/report/{file_name}"
-        response = requests.get(url, timeout=30)
+        response = get_jenkins_client().get(url)
         if response.status_code == 200:
             content_type = response.headers.get('content-type', 'text/plain')
             if 'html' in content_type:
@@ -1568,18 +1547,23 @@ async def jenkins_webhook(request: Request):
                             return {"message": f"Task {task_id} đang chạy"}
                         
                         # Xử lý khi job hoàn thành (SUCCESS, FAILURE, ABORTED)
+                        # Lưu webhook vào hàng đợi và trả về 202 - worker pool sẽ xử lý report/email/thông báo
                         elif (build_status == "FINISHED" or build_result in ["SUCCESS", "FAILURE", "ABORTED"]) and (build_result == "SUCCESS" or build_result == "FAILURE" or build_result == "ABORTED"):
                             try:
-                                if task_type == 'execution':
-                                    result = process_execution_webhook(task, job_name, build_number, build_result, body, db)
-                                elif task_type == 'plan':
-                                    result = process_plan_webhook(task, job_name, build_number, build_result, body, db)
-                                elif task_type == 'cicd':
-                                    result = process_cicd_webhook(task, job_name, build_number, build_result, body, db)
-                                
-                                return result
+                                from webhook_queue import enqueue_webhook
+                                event, created = enqueue_webhook(task_id, job_name, build_number, body, db)
+                                return JSONResponse(
+                                    status_code=202,
+                                    content={
+                                        "message": f"Webhook cho task {task_id} đã được đưa vào hàng đợi" if created else f"Webhook cho build #{build_number} đã được nhận trước đó",
+                                        "event_id": event.id,
+                                        "idempotency_key": event.idempotency_key,
+                                        "status": event.status,
+                                        "duplicate": not created
+                                    }
+                                )
                             except Exception as e:
-                                print(f"[ERROR] Failed to process task {task_id}: {e}")
+                                print(f"[ERROR] Failed to enqueue webhook for task {task_id}: {e}")
                                 raise HTTPException(status_code=500, detail=f"Failed to process task: {str(e)}")
                         else:
                             print(f"[DEBUG] Webhook: Job {job_name} chưa hoàn thành hoặc thất bại")
@@ -1600,6 +1584,165 @@ async def jenkins_webhook(request: Request):
         print(f"[DEBUG] Error processing Jenkins webhook: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}") 
 
+@router.get("/jenkins/webhook/queue")
+def get_webhook_queue_status(db: Session = Depends(get_db)):
+    """Trạng thái hàng đợi webhook Jenkins (số event theo trạng thái, các event lỗi gần nhất)"""
+    try:
+        from database import WebhookEvent
+        from webhook_queue import get_queue_status
+
+        status = get_queue_status(db)
+        failed_events = db.query(WebhookEvent).filter(
+            WebhookEvent.status == "failed"
+        ).order_by(WebhookEvent.updated_at.desc()).limit(10).all()
+        status["recent_failures"] = [
+            {
+                "id": e.id,
+                "idempotency_key": e.idempotency_key,
+                "task_id": e.task_id,
+                "attempts": e.attempts,
+                "last_error": e.last_error,
+                "updated_at": e.updated_at.isoformat() if e.updated_at else None
+            }
+            for e in failed_events
+        ]
+        return status
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+@router.get("/{report_id}/test-results")
+def get_report_test_results(
+    report_id: int,
+    status: Optional[str] = None,
+    suite: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """
+    Kết quả từng test case của một report, phân trang keyset theo id.
+    Truyền next_cursor của trang trước vào after_id để lấy trang tiếp theo.
+    """
+    try:
+        from database import TestResult, TestMessage
+
+        limit = max(1, min(limit, 1000))
+
+        report = db.query(Report.id, Report.task_id, Report.build_number, Report.jenkins_job).filter(
+            Report.id == report_id
+        ).first()
+        if not report:
+            raise HTTPException(status_code=404, detail="Report not found")
+
+        query = db.query(TestResult, TestMessage.message).outerjoin(
+            TestMessage, TestMessage.message_hash == TestResult.message_hash
+        ).filter(TestResult.report_id == report_id)
+
+        if status:
+            query = query.filter(TestResult.status == status.upper())
+        if suite:
+            query = query.filter(TestResult.suite.like(f"{suite}%"))
+        if after_id:
+            query = query.filter(TestResult.id > after_id)
+
+        rows = query.order_by(TestResult.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            "report_id": report.id,
+            "task_id": report.task_id,
+            "jenkins_job": report.jenkins_job,
+            "build_number": report.build_number,
+            "results": [
+                {
+                    "id": r.id,
+                    "suite": r.suite,
+                    "name": r.name,
+                    "status": r.status,
+                    "duration_ms": r.duration_ms,
+                    "message": message
+                }
+                for r, message in rows
+            ],
+            "next_cursor": rows[-1][0].id if has_more else None,
+            "has_more": has_more
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+@router.get("/test-results/history")
+def get_test_case_history(
+    name: str,
+    suite: Optional[str] = None,
+    before_report_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db)
+):
+    """
+    Lịch sử kết quả của một test case qua các build (mới nhất trước),
+    phân trang keyset theo (report_id, id): không lọc suite thì một report có thể có nhiều dòng
+    cùng tên (mỗi suite một dòng). Truyền next_cursor của trang trước vào before_report_id/before_id.
+    """
+    try:
+        from database import TestResult, TestMessage
+
+        limit = max(1, min(limit, 500))
+
+        query = db.query(
+            TestResult.id,
+            TestResult.report_id,
+            TestResult.suite,
+            TestResult.status,
+            TestResult.duration_ms,
+            TestMessage.message,
+            Report.task_id,
+            Report.jenkins_job,
+            Report.build_number,
+            Report.created_at
+        ).join(
+            Report, Report.id == TestResult.report_id
+        ).outerjoin(
+            TestMessage, TestMessage.message_hash == TestResult.message_hash
+        ).filter(TestResult.name == name)
+
+        if suite:
+            query = query.filter(TestResult.suite == suite)
+        if before_report_id and before_id:
+            query = query.filter(tuple_(TestResult.report_id, TestResult.id) < tuple_(before_report_id, before_id))
+        elif before_report_id:
+            query = query.filter(TestResult.report_id < before_report_id)
+
+        rows = query.order_by(TestResult.report_id.desc(), TestResult.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            "name": name,
+            "history": [
+                {
+                    "id": r.id,
+                    "report_id": r.report_id,
+                    "task_id": r.task_id,
+                    "jenkins_job": r.jenkins_job,
+                    "build_number": r.build_number,
+                    "suite": r.suite,
+                    "status": r.status,
+                    "duration_ms": r.duration_ms,
+                    "message": r.message,
+                    "created_at": r.created_at.isoformat() if r.created_at else None
+                }
+                for r in rows
+            ],
+            "next_cursor": {"before_report_id": rows[-1].report_id, "before_id": rows[-1].id} if has_more else None,
+            "has_more": has_more
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
 @router.get("/latest-test-results")
 def get_latest_test_results():
     """Lấy thống kê kết quả test theo report mới nhất của mỗi task (hiển thị đủ tất cả task, kể cả chưa có report)"""
@@ -1607,56 +1750,43 @@ def get_latest_test_results():
         from database import SessionLocal
         db = SessionLocal()
         try:
-            from database import Report, Execution, Plan, Cicd, Project
-            from sqlalchemy import func
-            # Lấy tất cả executions, plans, cicd
-            executions = db.query(Execution).all()
-            plans = db.query(Plan).all()
-            cicds = db.query(Cicd).all()
+            from database import Execution, Plan, Cicd, Project
+            # Lấy tất cả executions, plans, cicd kèm tên project (join thay vì query từng task)
+            executions = db.query(Execution, Project.name).outerjoin(Project, Project.id == Execution.project_id).all()
+            plans = db.query(Plan, Project.name).outerjoin(Project, Project.id == Plan.project_id).all()
+            cicds = db.query(Cicd, Project.name).outerjoin(Project, Project.id == Cicd.project_id).all()
             all_tasks = []
-            for exe in executions:
+            for exe, project_name in executions:
                 all_tasks.append({
                     "type": "execution",
                     "task_id": exe.task_id,
                     "task_name": exe.task_name,
-                    "project_name": db.query(Project).filter(Project.id == exe.project_id).first().name if exe.project_id else None
+                    "project_name": project_name
                 })
-            for plan in plans:
+            for plan, project_name in plans:
                 all_tasks.append({
                     "type": "plan",
                     "task_id": plan.plan_id,
                     "task_name": plan.plan_name,
-                    "project_name": db.query(Project).filter(Project.id == plan.project_id).first().name if plan.project_id else None
+                    "project_name": project_name
                 })
-            for cicd in cicds:
+            for cicd, project_name in cicds:
                 all_tasks.append({
                     "type": "cicd",
                     "task_id": cicd.cicd_id,
                     "task_name": cicd.cicd_name,
-                    "project_name": db.query(Project).filter(Project.id == cicd.project_id).first().name if cicd.project_id else None
+                    "project_name": project_name
                 })
             # Lấy report mới nhất cho từng task_id
             # Nếu report mới nhất bị cancelled/aborted thì lấy report gần nhất trước đó có status success/failed
+            latest_reports = get_latest_reports(db, [task["task_id"] for task in all_tasks])
             latest_reports_data = []
             total_tests = 0
             passed_tests = 0
             failed_tests = 0
             skipped_tests = 0
             for task in all_tasks:
-                # Lấy tất cả report của task, mới nhất trước
-                reports = db.query(Report).filter(Report.task_id == task["task_id"]).order_by(Report.created_at.desc()).all()
-                report = None
-                if reports:
-                    # Nếu report mới nhất bị cancelled/aborted thì tìm report gần nhất trước đó có status success/failed
-                    if reports[0].status in ["cancelled", "aborted"]:
-                        for r in reports:
-                            if r.status not in ["cancelled", "aborted"]:
-                                report = r
-                                break
-                        if not report:
-                            report = reports[0]  # Nếu không có report thành công nào thì vẫn lấy report mới nhất
-                    else:
-                        report = reports[0]
+                report = latest_reports.get(task["task_id"])
                 if report:
                     total_tests += report.total_tests
                     passed_tests += report.passed_tests
@@ -1889,6 +2019,19 @@ def cleanup_orphaned_reports():
         print(f"[DEBUG] Error cleaning up orphaned reports: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+# task_type của history-reports -> tiền tố task_id
+HISTORY_TASK_TYPES = {"executions": "execution", "plans": "plan", "cicd": "cicd"}
+# Với count=estimated, dưới ngưỡng này vẫn đếm chính xác (rẻ)
+HISTORY_EXACT_COUNT_THRESHOLD = int(os.getenv("HISTORY_EXACT_COUNT_THRESHOLD", "10000"))
+# OFFSET tốn O(offset): trang sâu hơn phải đi bằng cursor
+HISTORY_MAX_OFFSET = int(os.getenv("HISTORY_MAX_OFFSET", "1000"))
+
+def history_task_type(task_id: str) -> str:
+    for history_type, task_type in HISTORY_TASK_TYPES.items():
+        if task_id.startswith(TASK_ID_PREFIXES[task_type]):
+            return history_type
+    return "unknown"
+
 @router.get("/history-reports")
 def get_history_reports(
     project_id: Optional[int] = None,
@@ -1896,30 +2039,49 @@ def get_history_reports(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     limit: int = 10,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    count: str = "exact"
 ):
-    """Lấy lịch sử reports với filter theo project, task type, và date range"""
+    """
+    Lấy lịch sử reports với filter theo project, task type, và date range.
+
+    - cursor: next_cursor của trang trước, phân trang keyset trên (created_at, id) - trang sâu nhanh như trang đầu.
+      Giao diện chỉ điều hướng bằng cursor (trước/sau và các trang đã đi qua).
+    - offset: giữ cho client cũ, tối đa HISTORY_MAX_OFFSET (OFFSET tốn thời gian tỉ lệ với offset).
+    - count: exact | estimated (ước lượng theo planner khi bảng lớn) | none
+    """
+    limit = max(1, min(limit, 1000))
+    offset = max(0, offset)
+    if offset > HISTORY_MAX_OFFSET and not cursor:
+        raise HTTPException(
+            status_code=400,
+            detail=f"offset must be at most {HISTORY_MAX_OFFSET}; use next_cursor to page deeper"
+        )
+    if count not in ("exact", "estimated", "none"):
+        raise HTTPException(status_code=400, detail=f"Invalid count mode: {count}")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         from database import SessionLocal
         db = SessionLocal()
         try:
-            from database import Report, Project, Execution, Plan, Cicd
+            from database import Report, Project
             
-            # Base query
-            query = db.query(Report)
+            # Base query - bỏ dòng created_at NULL (không phân trang keyset được)
+            query = db.query(Report).filter(Report.created_at.isnot(None))
             
             # Filter theo project
             if project_id:
                 query = query.filter(Report.project_id == project_id)
             
-            # Filter theo task type
-            if task_type:
-                if task_type == "executions":
-                    query = query.filter(Report.task_id.like("EXEC-%"))
-                elif task_type == "plans":
-                    query = query.filter(Report.task_id.like("PLAN-%"))
-                elif task_type == "cicd":
-                    query = query.filter(Report.task_id.like("CICD-%"))
+            # Filter theo task type (execution dùng task_id TASK-xxx)
+            if task_type in HISTORY_TASK_TYPES:
+                prefix = TASK_ID_PREFIXES[HISTORY_TASK_TYPES[task_type]]
+                query = query.filter(Report.task_id.like(f"{prefix}%"))
             
             # Filter theo date range
             if start_date:
@@ -1937,64 +2099,51 @@ def get_history_reports(
                     pass
             
             # Đếm tổng số records cho pagination
-            total_count = query.count()
-            
-            # Sắp xếp theo thời gian mới nhất
-            query = query.order_by(Report.created_at.desc())
-            
-            # Phân trang
-            query = query.offset(offset).limit(limit)
-            
-            reports = query.all()
+            total_count = None
+            total_is_estimate = False
+            if count == "estimated":
+                total_count = estimate_count(db, query)
+                if total_count is None or total_count < HISTORY_EXACT_COUNT_THRESHOLD:
+                    total_count = query.count()
+                else:
+                    total_is_estimate = True
+            elif count == "exact":
+                total_count = query.count()
+            
+            # Lấy id của trang trên index (created_at DESC, id DESC), sau đó mới nạp cả dòng
+            page_query = query.with_entities(Report.id).order_by(Report.created_at.desc(), Report.id.desc())
+            if cursor_key:
+                page_query = page_query.filter(tuple_(Report.created_at, Report.id) < cursor_key)
+            else:
+                page_query = page_query.offset(offset)
+            page_ids = page_query.limit(limit + 1).subquery()
+            
+            rows = (
+                db.query(Report, Project.name)
+                .join(page_ids, page_ids.c.id == Report.id)
+                .outerjoin(Project, Project.id == Report.project_id)
+                .order_by(Report.created_at.desc(), Report.id.desc())
+                .all()
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            tasks = resolve_tasks(db, [report.task_id for report, _ in rows])
             
             # Format kết quả
             history_data = []
-            for report in reports:
-                # Lấy thông tin project
-                project = db.query(Project).filter(Project.id == report.project_id).first()
-                
-                # Xác định loại task và lấy thông tin task
-                task_info = None
-                task_name = "Unknown Task"
-                
-                if report.task_id.startswith("EXEC-"):
-                    task_info = db.query(Execution).filter(Execution.task_id == report.task_id).first()
-                    if task_info:
-                        task_name = task_info.task_name
-                elif report.task_id.startswith("PLAN-"):
-                    task_info = db.query(Plan).filter(Plan.plan_id == report.task_id).first()
-                    if task_info:
-                        task_name = task_info.plan_name
-                elif report.task_id.startswith("CICD-"):
-                    task_info = db.query(Cicd).filter(Cicd.cicd_id == report.task_id).first()
-                    if task_info:
-                        task_name = task_info.cicd_name
-                elif report.task_id.startswith("TASK-"):
-                    # TASK-001 là execution task
-                    task_info = db.query(Execution).filter(Execution.task_id == report.task_id).first()
-                    if task_info:
-                        task_name = task_info.task_name
+            for report, project_name in rows:
+                task = tasks.get(report.task_id)
                 
                 # Tính success rate
                 success_rate = (report.passed_tests / report.total_tests * 100) if report.total_tests > 0 else 0
                 
-                # Lấy Jenkins job name từ task info
-                jenkins_job = "Unknown"
-                if task_info:
-                    if report.task_id.startswith("EXEC-") or report.task_id.startswith("TASK-"):
-                        jenkins_job = task_info.jenkins_job or "Unknown"
-                    elif report.task_id.startswith("PLAN-"):
-                        jenkins_job = task_info.jenkins_job or "Unknown"
-                    elif report.task_id.startswith("CICD-"):
-                        jenkins_job = task_info.jenkins_job or "Unknown"
-                
                 history_data.append({
                     "report_id": report.id,
                     "task_id": report.task_id,
-                    "task_name": task_name,
-                    "project_name": project.name if project else "Unknown Project",
+                    "task_name": task["task_name"] if task else "Unknown Task",
+                    "project_name": project_name or "Unknown Project",
                     "project_id": report.project_id,
-                    "jenkins_job": jenkins_job,
+                    "jenkins_job": (task["jenkins_job"] if task else None) or "Unknown",
                     "build_number": report.build_number,
                     "created_at": report.created_at.isoformat() if report.created_at else None,
                     "start_time": report.start_time.isoformat() if report.start_time else None,
@@ -2006,16 +2155,22 @@ def get_history_reports(
                     "skipped_tests": report.skipped_tests,
                     "success_rate": round(success_rate, 2),
                     "status": report.status,
-                    "task_type": "executions" if report.task_id.startswith("EXEC-") or report.task_id.startswith("TASK-") else 
-                                "plans" if report.task_id.startswith("PLAN-") else 
-                                "cicd" if report.task_id.startswith("CICD-") else "unknown"
+                    "task_type": history_task_type(report.task_id)
                 })
             
+            next_cursor = None
+            if has_more and rows:
+                last_report = rows[-1][0]
+                next_cursor = encode_cursor(last_report.created_at, last_report.id)
+            
             return {
                 "history_reports": history_data,
                 "total": total_count,
+                "total_is_estimate": total_is_estimate,
                 "page": (offset // limit) + 1,
-                "total_pages": (total_count + limit - 1) // limit,
+                "total_pages": (total_count + limit - 1) // limit if total_count is not None else None,
+                "next_cursor": next_cursor,
+                "has_more": has_more,
                 "filters": {
                     "project_id": project_id,
                     "task_type": task_type,
@@ -2057,10 +2212,19 @@ def create_notification(
     task_type: str,
     status: str,
     project_name: str = None,
-    db: Session = None
+    db: Session = None,
+    idempotency_key: str = None
 ):
-    """Tạo thông báo mới khi có report được gửi về"""
+    """
+    Tạo thông báo mới khi có report được gửi về.
+    idempotency_key (task_id#build_number): thông báo đã có với key này thì trả về thông báo đó.
+    """
     try:
+        if idempotency_key:
+            existing = db.query(Notification).filter(Notification.idempotency_key == idempotency_key).first()
+            if existing:
+                return existing
+
         # Tạo message thông báo
         if status.lower() == "running":
             message = f"🔄 {task_id} đang được chạy"
@@ -2081,13 +2245,25 @@ def create_notification(
             status=status,
             project_name=project_name,
             message=message,
+            idempotency_key=idempotency_key,
             created_at=datetime.utcnow()
         )
         
         db.add(notification)
-        db.commit()
+        try:
+            db.commit()
+        except Exception:
+            # Cùng build được xử lý đồng thời - unique index trên idempotency_key
+            db.rollback()
+            existing = db.query(Notification).filter(
+                Notification.idempotency_key == idempotency_key
+            ).first() if idempotency_key else None
+            if existing:
+                return existing
+            raise
         db.refresh(notification)
         
+        publish_notification_change(db, {"type": "created", "notification": notification_to_dict(notification)})
         return notification
         
     except Exception as e:
@@ -2095,7 +2271,66 @@ def create_notification(
         print(f"Lỗi tạo thông báo: {str(e)}")
         return None
 
+def notification_to_dict(notification: Notification) -> Dict:
+    return {
+        "id": notification.id,
+        "task_id": notification.task_id,
+        "task_name": notification.task_name,
+        "task_type": notification.task_type,
+        "status": notification.status,
+        "project_name": notification.project_name,
+        "message": notification.message,
+        "created_at": notification.created_at.isoformat() if notification.created_at else None,
+        "is_read": notification.is_read,
+        "time_ago": get_time_ago(notification.created_at) if notification.created_at else "Unknown"
+    }
+
+def unread_notification_count(db: Session) -> int:
+    return db.query(func.count(Notification.id)).filter(Notification.is_read == False).scalar() or 0
+
+def publish_notification_change(db: Session, event: Dict):
+    """Đẩy delta (kèm unread_count mới) tới các trình duyệt đang mở luồng thông báo"""
+    try:
+        from notification_stream import publish_notification_event
+        event["unread_count"] = unread_notification_count(db)
+        publish_notification_event(event)
+    except Exception as e:
+        print(f"[WARNING] Failed to publish notification event: {e}")
+
 # Notification API endpoints
+@router.get("/notifications/stream")
+async def stream_notifications(request: Request, limit: int = 10):
+    """
+    Server-Sent Events: snapshot (limit thông báo mới nhất + unread_count) khi kết nối,
+    sau đó các delta created/read/read_all/cleared/resync. Thay cho poll /notifications/list.
+    """
+    from database import SessionLocal
+    from notification_stream import notification_event_stream
+    limit = max(1, min(limit, 100))
+    
+    def load_snapshot():
+        db = SessionLocal()
+        try:
+            notifications = db.query(Notification).order_by(Notification.created_at.desc()).limit(limit).all()
+            return {
+                "notifications": [notification_to_dict(notification) for notification in notifications],
+                "unread_count": unread_notification_count(db)
+            }
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        notification_event_stream(request, load_snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/notifications/stream/stats")
+def get_notification_stream_stats():
+    """Số kết nối SSE của worker này và trạng thái LISTEN"""
+    from notification_stream import get_notification_stream_stats as stream_stats
+    return stream_stats()
+
 @router.get("/notifications/list")
 def get_notifications(
     limit: int = 50,
@@ -2111,25 +2346,12 @@ def get_notifications(
         
         notifications = query.order_by(Notification.created_at.desc()).limit(limit).all()
         
-        result = []
-        for notification in notifications:
-            result.append({
-                "id": notification.id,
-                "task_id": notification.task_id,
-                "task_name": notification.task_name,
-                "task_type": notification.task_type,
-                "status": notification.status,
-                "project_name": notification.project_name,
-                "message": notification.message,
-                "created_at": notification.created_at.isoformat() if notification.created_at else None,
-                "is_read": notification.is_read,
-                "time_ago": get_time_ago(notification.created_at) if notification.created_at else "Unknown"
-            })
+        result = [notification_to_dict(notification) for notification in notifications]
         
         return {
             "notifications": result,
             "total": len(result),
-            "unread_count": db.query(Notification).filter(Notification.is_read == False).count()
+            "unread_count": unread_notification_count(db)
         }
         
     except Exception as e:
@@ -2146,6 +2368,7 @@ def mark_as_read(notification_id: int, db: Session = Depends(get_db)):
         notification.is_read = True
         notification.read_at = datetime.utcnow()
         db.commit()
+        publish_notification_change(db, {"type": "read", "ids": [notification_id]})
         
         return {
             "message": "Đã đánh dấu thông báo đã đọc",
@@ -2167,6 +2390,7 @@ def mark_all_as_read(db: Session = Depends(get_db)):
             "read_at": datetime.utcnow()
         })
         db.commit()
+        publish_notification_change(db, {"type": "read_all"})
         
         return {
             "message": "Đã đánh dấu tất cả thông báo đã đọc"
@@ -2183,6 +2407,7 @@ def clear_all_notifications(db: Session = Depends(get_db)):
         count = db.query(Notification).count()
         db.query(Notification).delete()
         db.commit()
+        publish_notification_change(db, {"type": "cleared"})
         
         return {
             "message": f"Đã xóa {count} thông báo thành công",
@@ -1,12 +1,16 @@
 from fastapi import APIRouter, HTTPException
-import requests
-from requests.auth import HTTPBasicAuth
+from fastapi.concurrency import run_in_threadpool
+import httpx
 import re
+import asyncio
+import time
 from urllib.parse import urlparse
 import os
 from datetime import datetime, timedelta
 import logging
 from sqlalchemy import text
+from jenkins_client import get_async_jenkins_client
+from robot_inventory import discover_robot_files, collect_test_cases, GitHubUnavailableError
 
 router = APIRouter()
 
@@ -51,46 +55,29 @@ def extract_github_info(repo_url):
     print(f"[DEBUG] Extracted owner: {owner}, repo: {repo}")
     return owner, repo
 
-def get_github_files(owner, repo, path=""):
-    try:
-        url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-        print(f"[DEBUG] Fetching GitHub API: {url}")
-        response = requests.get(url, timeout=10)
-        print(f"[DEBUG] GitHub API status: {response.status_code}")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"[DEBUG] GitHub API error: {response.text}")
-            return None
-    except Exception as e:
-        print(f"[DEBUG] Error fetching GitHub files: {e}")
-        return None
-
-def find_robot_files(contents, owner, repo, base_path=""):
+def build_robot_file_entries(files, test_cases_by_sha):
+    """
+    Chuyển kết quả discover_robot_files + collect_test_cases sang format trả về cho frontend.
+    File tải/parse lỗi có parsed=False (test_cases rỗng) - không được coi là file không có test.
+    """
     robot_files = []
-    if not isinstance(contents, list):
-        print(f"[DEBUG] Contents không phải list: {contents}")
-        return robot_files
-    for item in contents:
-        if item['type'] == 'file' and item['name'].endswith('.robot'):
-            test_count = count_test_cases_in_file(item['download_url'])
-            robot_files.append({
-                'name': item['name'],
-                'path': f"{base_path}/{item['name']}" if base_path else item['name'],
-                'size': format_file_size(item['size']),
-                'test_count': test_count,
-                'download_url': item['download_url']
-            })
-        elif item['type'] == 'dir':
-            sub_contents = get_github_files(owner, repo, f"{base_path}/{item['name']}" if base_path else item['name'])
-            if sub_contents:
-                robot_files.extend(find_robot_files(sub_contents, owner, repo, f"{base_path}/{item['name']}" if base_path else item['name']))
+    for f in files:
+        test_cases = test_cases_by_sha.get(f['sha'])
+        parsed = test_cases is not None
+        if not parsed:
+            print(f"[DEBUG] Không parse được {f['path']}, tạm tính 0 test case")
+            test_cases = []
+        robot_files.append({
+            'name': f['name'],
+            'path': f['path'],
+            'size': format_file_size(f['size']),
+            'test_count': len(test_cases),
+            'test_cases': test_cases,
+            'parsed': parsed,
+            'download_url': f['download_url']
+        })
     return robot_files
 
-def count_test_cases_in_file(download_url):
-    """Mỗi file .robot được tính là 1 test case"""
-    return 1
-
 def format_file_size(size_bytes):
     if size_bytes < 1024:
         return f"{size_bytes} B"
@@ -99,56 +86,64 @@ def format_file_size(size_bytes):
     else:
         return f"{size_bytes // (1024 * 1024)} MB"
 
+def load_project_repo(project_id):
+    """Đọc (project_name, repo_link) của project - hàm sync, gọi qua run_in_threadpool"""
+    from database import SessionLocal, Project
+    db = SessionLocal()
+    try:
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if not project:
+            print(f"[DEBUG] Không tìm thấy project id={project_id}")
+            raise HTTPException(status_code=404, detail="Project not found")
+        
+        print(f"[DEBUG] repo_url: {project.repo_link}")
+        print(f"[DEBUG] project_name: {project.name}")
+        
+        if not project.repo_link:
+            print(f"[DEBUG] Project không có repo_link")
+            raise HTTPException(status_code=400, detail="Project does not have repository link")
+        return project.name, project.repo_link
+    finally:
+        db.close()
+
+def update_project_testcase_number(project_id, total_testcases):
+    from database import SessionLocal, Project
+    db = SessionLocal()
+    try:
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if project:
+            project.testcase_number = total_testcases
+            db.commit()
+    finally:
+        db.close()
+
 @router.get("/{project_id}/robot-files")
 async def get_robot_files(project_id: int):
     try:
-        from database import SessionLocal
-        db = SessionLocal()
-        project = None
-        repo_url = None
-        project_name = None
-        
-        try:
-            from database import Project
-            project = db.query(Project).filter(Project.id == project_id).first()
-            if not project:
-                print(f"[DEBUG] Không tìm thấy project id={project_id}")
-                raise HTTPException(status_code=404, detail="Project not found")
-            
-            repo_url = project.repo_link
-            project_name = project.name
-            print(f"[DEBUG] repo_url: {repo_url}")
-            print(f"[DEBUG] project_name: {project_name}")
-            
-            if not repo_url:
-                print(f"[DEBUG] Project không có repo_link")
-                raise HTTPException(status_code=400, detail="Project does not have repository link")
-        finally:
-            db.close()
+        project_name, repo_url = await run_in_threadpool(load_project_repo, project_id)
             
         owner, repo = extract_github_info(repo_url)
         if not owner or not repo:
             print(f"[DEBUG] Không extract được owner/repo từ {repo_url}")
             raise HTTPException(status_code=400, detail="Invalid GitHub repository URL")
             
-        contents = get_github_files(owner, repo)
-        if not contents:
-            print(f"[DEBUG] Không lấy được contents từ GitHub repo {owner}/{repo}")
+        # Git Trees API: cả cây thư mục trong một request
+        files = await discover_robot_files(owner, repo)
+        if files is None:
+            print(f"[DEBUG] Không lấy được cây thư mục từ GitHub repo {owner}/{repo}")
             raise HTTPException(status_code=404, detail="Repository not found or not accessible")
             
-        robot_files = find_robot_files(contents, owner, repo)
+        # Parse *** Test Cases *** của từng file (cache theo blob SHA)
+        test_cases_by_sha = await collect_test_cases(files)
+        robot_files = build_robot_file_entries(files, test_cases_by_sha)
         total_testcases = sum(file['test_count'] for file in robot_files)
         print(f"[DEBUG] Tổng số file .robot: {len(robot_files)}, tổng testcase: {total_testcases}")
-        # Cập nhật testcase_number vào DB
-        db = SessionLocal()
-        try:
-            from database import Project
-            project = db.query(Project).filter(Project.id == project_id).first()
-            if project:
-                project.testcase_number = total_testcases
-                db.commit()
-        finally:
-            db.close()
+        # Cập nhật testcase_number vào DB - chỉ khi parse được mọi file, tránh ghi số đếm thiếu
+        unparsed = [f['path'] for f in robot_files if not f['parsed']]
+        if unparsed:
+            print(f"[WARNING] {len(unparsed)} file .robot không tải được, giữ nguyên testcase_number: {unparsed[:5]}")
+        else:
+            await run_in_threadpool(update_project_testcase_number, project_id, total_testcases)
         
         return {
             "project_id": project_id,
@@ -160,6 +155,9 @@ async def get_robot_files(project_id: int):
         }
     except HTTPException:
         raise
+    except GitHubUnavailableError as e:
+        print(f"[WARNING] GitHub không khả dụng khi lấy robot files project {project_id}: {e}")
+        raise HTTPException(status_code=503, detail="GitHub is unavailable or rate-limited, please retry later")
     except Exception as e:
         print(f"[DEBUG] Error processing robot files: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
@@ -167,7 +165,7 @@ async def get_robot_files(project_id: int):
 
 
 @router.get("/db/info")
-async def get_database_info():
+def get_database_info():
     """Lấy thông tin database - tương tự view_testcases.py"""
     try:
         from database import SessionLocal
@@ -189,7 +187,7 @@ async def get_database_info():
                 })
             
             # Lấy danh sách testcases
-            testcases = db.query(TestCase).all()
+            testcases = db.query(TestCase).filter(TestCase.deleted_at.is_(None)).all()
             testcases_data = []
             for tc in testcases:
                 project = db.query(Project).filter(Project.id == tc.project_id).first()
@@ -221,74 +219,147 @@ async def get_database_info():
         print(f"[DEBUG] Error getting database info: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+def sync_project_testcases(project_id, robot_files):
+    """
+    Đồng bộ incremental test cases của project với inventory vừa quét:
+    so sánh theo khoá (source_path, name), upsert hàng loạt các test mới/thay đổi
+    bằng INSERT ... ON CONFLICT, soft-delete test không còn trong repo.
+    File không parse được (parsed=False) bị bỏ qua hoàn toàn: test đã lưu của file đó
+    giữ nguyên, không tính vào removed/unchanged.
+    Trả về dict số lượng added/changed/removed/unchanged/skipped_files.
+    """
+    from database import SessionLocal, TestCase
+    from sqlalchemy.dialects.postgresql import insert
+    
+    # Inventory: {(path, name): {line, tags}} - bỏ tên trùng trong cùng file (giữ test đầu tiên)
+    scanned = {}
+    unparsed_paths = set()
+    for robot_file in robot_files:
+        path = robot_file['path'][:500]
+        if not robot_file.get('parsed', True):
+            unparsed_paths.add(path)
+            continue
+        for parsed in robot_file['test_cases']:
+            scanned.setdefault((path, parsed['name'][:200]), parsed)
+    
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            TestCase.id, TestCase.source_path, TestCase.name,
+            TestCase.line_number, TestCase.tags, TestCase.deleted_at
+        ).filter(TestCase.project_id == project_id).all()
+        existing = {(row.source_path, row.name): row for row in rows if row.source_path is not None}
+        
+        now = datetime.utcnow()
+        upserts = []
+        added = changed = unchanged = 0
+        for (path, name), parsed in scanned.items():
+            row = existing.get((path, name))
+            tags = parsed.get('tags') or []
+            if row is None or row.deleted_at is not None:
+                added += 1
+            elif row.line_number != parsed['line'] or (row.tags or []) != tags:
+                changed += 1
+            else:
+                unchanged += 1
+                continue
+            upserts.append({
+                "project_id": project_id,
+                "source_path": path,
+                "name": name,
+                "line_number": parsed['line'],
+                "tags": tags,
+                "description": f"Robot file: {path}:{parsed['line']}",
+                "status": "active",
+                "priority": "medium",
+                "deleted_at": None,
+                "created_at": now,
+                "updated_at": now
+            })
+        
+        # Test không còn trong repo (kể cả dòng cũ chưa có source_path) - soft delete
+        removed_ids = [
+            row.id for row in rows
+            if row.deleted_at is None
+            and row.source_path not in unparsed_paths
+            and (row.source_path, row.name) not in scanned
+        ]
+        
+        if upserts:
+            stmt = insert(TestCase).values(upserts)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["project_id", "source_path", "name"],
+                set_={
+                    "line_number": stmt.excluded.line_number,
+                    "tags": stmt.excluded.tags,
+                    "description": stmt.excluded.description,
+                    "status": "active",
+                    "deleted_at": None,
+                    "updated_at": now
+                }
+            )
+            db.execute(stmt)
+        if removed_ids:
+            db.query(TestCase).filter(TestCase.id.in_(removed_ids)).update(
+                {TestCase.status: "removed", TestCase.deleted_at: now, TestCase.updated_at: now},
+                synchronize_session=False
+            )
+        db.commit()
+        return {
+            "added": added,
+            "changed": changed,
+            "removed": len(removed_ids),
+            "unchanged": unchanged,
+            "total": len(scanned),
+            "skipped_files": len(unparsed_paths)
+        }
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        db.close()
+
 @router.post("/{project_id}/sync-testcases")
 async def sync_testcases_to_db(project_id: int):
     """Đồng bộ test cases từ robot files vào database"""
     try:
-        from database import SessionLocal, TestCase
-        db = SessionLocal()
-        
-        try:
-            from database import Project
-            project = db.query(Project).filter(Project.id == project_id).first()
-            if not project:
-                raise HTTPException(status_code=404, detail="Project not found")
-            
-            repo_url = project.repo_link
-            if not repo_url:
-                raise HTTPException(status_code=400, detail="Project does not have repository link")
-        finally:
-            db.close()
+        project_name, repo_url = await run_in_threadpool(load_project_repo, project_id)
             
         # Lấy robot files từ GitHub
         owner, repo = extract_github_info(repo_url)
         if not owner or not repo:
             raise HTTPException(status_code=400, detail="Invalid GitHub repository URL")
             
-        contents = get_github_files(owner, repo)
-        if not contents:
+        files = await discover_robot_files(owner, repo)
+        if files is None:
             raise HTTPException(status_code=404, detail="Repository not found or not accessible")
             
-        robot_files = find_robot_files(contents, owner, repo)
+        test_cases_by_sha = await collect_test_cases(files)
+        robot_files = build_robot_file_entries(files, test_cases_by_sha)
         
-        # Xóa test cases cũ của project
-        db = SessionLocal()
-        try:
-            db.query(TestCase).filter(TestCase.project_id == project_id).delete()
-            
-            # Thêm test cases mới
-            created_count = 0
-            for robot_file in robot_files:
-                test_case = TestCase(
-                    name=robot_file['name'],
-                    description=f"Robot file: {robot_file['path']}",
-                    project_id=project_id,
-                    status="active",
-                    priority="medium",
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow()
-                )
-                db.add(test_case)
-                created_count += 1
-            
-            db.commit()
-            
-            return {
-                "message": f"Đã đồng bộ {created_count} test cases cho project {project.name}",
-                "project_id": project_id,
-                "project_name": project.name,
-                "synced_testcases": created_count,
-                "robot_files_count": len(robot_files)
-            }
-            
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-        finally:
-            db.close()
+        counts = await run_in_threadpool(sync_project_testcases, project_id, robot_files)
+        
+        return {
+            "message": (
+                f"Đã đồng bộ {counts['total']} test cases cho project {project_name} "
+                f"(thêm {counts['added']}, cập nhật {counts['changed']}, xoá {counts['removed']})"
+            ),
+            "project_id": project_id,
+            "project_name": project_name,
+            "synced_testcases": counts['total'],
+            "added": counts['added'],
+            "changed": counts['changed'],
+            "removed": counts['removed'],
+            "unchanged": counts['unchanged'],
+            "skipped_files": counts['skipped_files'],
+            "robot_files_count": len(robot_files)
+        }
             
     except HTTPException:
         raise
+    except GitHubUnavailableError as e:
+        print(f"[WARNING] GitHub không khả dụng khi đồng bộ test cases project {project_id}: {e}")
+        raise HTTPException(status_code=503, detail="GitHub is unavailable or rate-limited, please retry later")
     except Exception as e:
         print(f"[DEBUG] Error syncing testcases: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
@@ -297,27 +368,45 @@ async def sync_testcases_to_db(project_id: int):
 async def health_check():
     return {"status": "healthy", "message": "Test router is working"}
 
-@router.post("/{project_id}/create-jenkins-job")
-async def create_jenkins_job(project_id: int, job_data: dict):
-    """Tạo Jenkins job cho project"""
+def save_jenkins_job(job_name, project_id, project_name, repo_link):
+    """Lưu Jenkins job vào database với ID tùy chỉnh - hàm sync, gọi qua run_in_threadpool"""
     try:
-        from database import SessionLocal, Project
+        from database import JenkinsJob, SessionLocal
         db = SessionLocal()
-        
         try:
-            project = db.query(Project).filter(Project.id == project_id).first()
-            if not project:
-                raise HTTPException(status_code=404, detail="Project not found")
-            
-            if not project.repo_link:
-                raise HTTPException(status_code=400, detail="Project does not have repository link")
+            # Tìm ID nhỏ nhất có sẵn
+            next_id = get_next_available_jenkins_job_id(db)
+            
+            jenkins_job = JenkinsJob(
+                id=next_id,  # Sử dụng ID tùy chỉnh
+                name=job_name,
+                project_id=project_id,
+                project_name=project_name,
+                repository=repo_link,
+                status="active",
+                created_at=datetime.utcnow(),
+                updated_at=datetime.utcnow()
+            )
+            db.add(jenkins_job)
+            db.commit()
+            print(f"[DEBUG] Đã lưu Jenkins job '{job_name}' vào database với ID {next_id}")
+        except Exception as e:
+            db.rollback()
+            print(f"[DEBUG] Lỗi lưu Jenkins job vào database: {e}")
         finally:
             db.close()
+    except Exception as e:
+        print(f"[DEBUG] Lỗi import JenkinsJob model: {e}")
+
+@router.post("/{project_id}/create-jenkins-job")
+async def create_jenkins_job(project_id: int, job_data: dict):
+    """Tạo Jenkins job cho project"""
+    try:
+        project_name, repo_link = await run_in_threadpool(load_project_repo, project_id)
         
         # Jenkins configuration
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-        JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-        JENKINS_PASS = os.getenv("JENKINS_PASS", "admin")
+        session = get_async_jenkins_client()
         
         job_name = job_data.get("job_name")
         if not job_name:
@@ -325,16 +414,16 @@ async def create_jenkins_job(project_id: int, job_data: dict):
         
         # Kiểm tra kết nối Jenkins
         try:
-            test_response = requests.get(f"{JENKINS_URL}/api/json", timeout=10)
+            test_response = await session.get(f"{JENKINS_URL}/api/json")
             if test_response.status_code != 200:
                 raise HTTPException(status_code=500, detail=f"Jenkins không khả dụng: {test_response.status_code}")
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Không thể kết nối đến Jenkins: {str(e)}")
         
         # Tạo Jenkins Pipeline job config XML
         config_xml = f"""<?xml version='1.1' encoding='UTF-8'?>
 <flow-definition plugin="workflow-job@1339.vd5a_957c2c31">
-    <description>Auto-generated pipeline job for {project.name}</description>
+    <description>Auto-generated pipeline job for {project_name}</description>
     <keepDependencies>false</keepDependencies>
     <properties>
         <hudson.model.ParametersDefinitionProperty>
@@ -353,7 +442,7 @@ async def create_jenkins_job(project_id: int, job_data: dict):
             <configVersion>2</configVersion>
             <userRemoteConfigs>
                 <hudson.plugins.git.UserRemoteConfig>
-                    <url>{project.repo_link}</url>
+                    <url>{repo_link}</url>
                 </hudson.plugins.git.UserRemoteConfig>
             </userRemoteConfigs>
             <branches>
@@ -372,93 +461,29 @@ async def create_jenkins_job(project_id: int, job_data: dict):
     <disabled>false</disabled>
 </flow-definition>"""
         
-        # Tạo Jenkins job
-        session = requests.Session()
-        
-        # Get CSRF crumb với authentication
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-        try:
-            crumb_response = session.get(
-                crumb_url, 
-                auth=HTTPBasicAuth(JENKINS_USER, JENKINS_PASS),
-                timeout=30
-            )
-            
-            headers = {'Content-Type': 'application/xml'}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-            elif crumb_response.status_code == 403:
-                # Jenkins không yêu cầu CSRF, tiếp tục không có crumb
-                headers = {'Content-Type': 'application/xml'}
-            else:
-                logging.warning(f"Không thể lấy CSRF crumb: {crumb_response.status_code}")
-                headers = {'Content-Type': 'application/xml'}
-        except Exception as e:
-            logging.warning(f"Lỗi khi lấy CSRF crumb: {e}")
-            headers = {'Content-Type': 'application/xml'}
-        
-        # Tạo job với authentication (nếu cần)
+        # Tạo Jenkins job (auth và CSRF crumb do Jenkins client xử lý)
+        headers = {'Content-Type': 'application/xml'}
         create_job_url = f"{JENKINS_URL}/createItem?name={job_name}"
         try:
-            # Thử với authentication trước
-            response = session.post(
+            response = await session.post(
                 create_job_url,
-                data=config_xml,
-                headers=headers,
-                auth=HTTPBasicAuth(JENKINS_USER, JENKINS_PASS),
-                timeout=30
+                content=config_xml,
+                headers=headers
             )
-            
-            # Nếu lỗi 401/403, thử không có authentication
-            if response.status_code in [401, 403]:
-                logging.info("Jenkins requires authentication, trying without auth...")
-                response = session.post(
-                    create_job_url,
-                    data=config_xml,
-                    headers=headers,
-                    timeout=30
-                )
-                
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Lỗi kết nối Jenkins: {str(e)}")
         
         if response.status_code == 200:
             # Lưu Jenkins job vào database với ID tùy chỉnh
-            try:
-                from database import JenkinsJob, SessionLocal
-                db = SessionLocal()
-                try:
-                    # Tìm ID nhỏ nhất có sẵn
-                    next_id = get_next_available_jenkins_job_id(db)
-                    
-                    jenkins_job = JenkinsJob(
-                        id=next_id,  # Sử dụng ID tùy chỉnh
-                        name=job_name,
-                        project_id=project_id,
-                        project_name=project.name,
-                        repository=project.repo_link,
-                        status="active",
-                        created_at=datetime.utcnow(),
-                        updated_at=datetime.utcnow()
-                    )
-                    db.add(jenkins_job)
-                    db.commit()
-                    print(f"[DEBUG] Đã lưu Jenkins job '{job_name}' vào database với ID {next_id}")
-                except Exception as e:
-                    db.rollback()
-                    print(f"[DEBUG] Lỗi lưu Jenkins job vào database: {e}")
-                finally:
-                    db.close()
-            except Exception as e:
-                print(f"[DEBUG] Lỗi import JenkinsJob model: {e}")
+            await run_in_threadpool(save_jenkins_job, job_name, project_id, project_name, repo_link)
+            invalidate_jenkins_status(job_name)
             
             return {
                 "message": f"Đã tạo Jenkins job '{job_name}' thành công",
                 "job_name": job_name,
                 "project_id": project_id,
-                "project_name": project.name,
-                "repo_url": project.repo_link
+                "project_name": project_name,
+                "repo_url": repo_link
             }
         elif response.status_code == 400:
             # Job name đã tồn tại
@@ -490,30 +515,18 @@ async def get_jenkins_jobs():
     """Lấy danh sách Jenkins jobs"""
     try:
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-        JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-        JENKINS_PASS = os.getenv("JENKINS_PASS", "admin")
         
         api_url = f"{JENKINS_URL}/api/json"
-        session = requests.Session()
+        session = get_async_jenkins_client()
         
         # Kiểm tra kết nối Jenkins
         try:
-            # Thử với authentication trước
-            response = session.get(
-                api_url, 
-                auth=HTTPBasicAuth(JENKINS_USER, JENKINS_PASS),
-                timeout=15
-            )
-            
-            # Nếu lỗi 401/403, thử không có authentication
-            if response.status_code in [401, 403]:
-                logging.info("Jenkins requires authentication, trying without auth...")
-                response = session.get(api_url, timeout=15)
+            response = await session.get(api_url)
             
             if response.status_code != 200:
                 raise HTTPException(status_code=response.status_code, detail=f"Jenkins API error: {response.text}")
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Không thể kết nối đến Jenkins: {str(e)}")
         
         data = response.json()
@@ -548,133 +561,191 @@ async def get_jenkins_jobs():
         logging.error(f"Error getting Jenkins jobs: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách Jenkins jobs: {e}")
 
+def load_jenkins_jobs():
+    """Đọc danh sách Jenkins jobs từ database (giờ UTC+7) - hàm sync, gọi qua run_in_threadpool"""
+    from database import SessionLocal, JenkinsJob
+    db = SessionLocal()
+    try:
+        jenkins_jobs = db.query(JenkinsJob).order_by(JenkinsJob.created_at.desc()).all()
+        
+        jobs_data = []
+        for job in jenkins_jobs:
+            # Chuyển đổi múi giờ từ UTC sang UTC+7 (Việt Nam)
+            created_at_vn = None
+            updated_at_vn = None
+            
+            if job.created_at:
+                # Thêm 7 giờ để chuyển từ UTC sang UTC+7
+                created_at_vn = job.created_at.replace(tzinfo=None) + timedelta(hours=7)
+            
+            if job.updated_at:
+                # Thêm 7 giờ để chuyển từ UTC sang UTC+7
+                updated_at_vn = job.updated_at.replace(tzinfo=None) + timedelta(hours=7)
+            
+            jobs_data.append({
+                "id": job.id,
+                "name": job.name,
+                "project_id": job.project_id,
+                "project_name": job.project_name,
+                "repository": job.repository,
+                "status": "unknown",
+                "created_at": created_at_vn.isoformat() if created_at_vn else None,
+                "updated_at": updated_at_vn.isoformat() if updated_at_vn else None
+            })
+        return jobs_data
+    finally:
+        db.close()
+
+# Cache trạng thái Jenkins job: {job_name: (status, expires_at)}
+JENKINS_STATUS_TTL = float(os.getenv("JENKINS_STATUS_TTL", "15"))
+JENKINS_STATUS_CONCURRENCY = int(os.getenv("JENKINS_STATUS_CONCURRENCY", "8"))
+JENKINS_JOBS_TREE = "jobs[name,color,lastBuild[number,result,building]]"
+_jenkins_status_cache = {}
+
+def jenkins_status_from_build(last_build):
+    """Đổi lastBuild (number/result/building) sang màu kiểu Jenkins: blue/red/yellow/grey/building/notbuilt"""
+    if not last_build or not last_build.get('number'):
+        return 'notbuilt'
+    build_result = last_build.get('result')
+    
+    # Kiểm tra nếu job đang chạy
+    if last_build.get('building', False):
+        return 'building'
+    elif build_result == 'SUCCESS':
+        return 'blue'
+    elif build_result == 'FAILURE':
+        return 'red'
+    elif build_result == 'UNSTABLE':
+        return 'yellow'
+    elif build_result == 'ABORTED':
+        return 'grey'
+    return 'notbuilt'
+
+async def fetch_jenkins_job_status(job_name):
+    """Lấy trạng thái một job (dùng khi tree query không khả dụng) - một request với tree=lastBuild[...]"""
+    try:
+        JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
+        jenkins_api_url = f"{JENKINS_URL}/job/{job_name}/api/json?tree=lastBuild[number,result,building]"
+        
+        response = await get_async_jenkins_client().get(jenkins_api_url)
+        if response.status_code != 200:
+            return 'disabled'
+        return jenkins_status_from_build(response.json().get('lastBuild'))
+    except Exception as e:
+        print(f"[DEBUG] Không thể lấy trạng thái Jenkins cho job {job_name}: {e}")
+        return 'unknown'
+
+async def fetch_jenkins_statuses(job_names):
+    """
+    Trạng thái của nhiều job trong một round trip: một tree query /api/json cho toàn bộ jobs,
+    fallback gọi từng job song song (tối đa JENKINS_STATUS_CONCURRENCY) nếu tree query lỗi.
+    Kết quả được cache JENKINS_STATUS_TTL giây.
+    """
+    now = time.monotonic()
+    statuses = {}
+    missing = []
+    for name in job_names:
+        cached = _jenkins_status_cache.get(name)
+        if cached and cached[1] > now:
+            statuses[name] = cached[0]
+        else:
+            missing.append(name)
+    if not missing:
+        return statuses
+    
+    fetched = None
+    try:
+        JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
+        response = await get_async_jenkins_client().get(f"{JENKINS_URL}/api/json", params={"tree": JENKINS_JOBS_TREE})
+        if response.status_code == 200:
+            jobs_by_name = {job.get('name'): job for job in response.json().get('jobs', [])}
+            # Job không có trên Jenkins được coi như không truy cập được (giống 404 khi gọi từng job)
+            fetched = {
+                name: jenkins_status_from_build(jobs_by_name[name].get('lastBuild')) if name in jobs_by_name else 'disabled'
+                for name in missing
+            }
+        else:
+            print(f"[DEBUG] Jenkins tree query trả về {response.status_code}, chuyển sang gọi từng job")
+    except Exception as e:
+        print(f"[DEBUG] Jenkins tree query lỗi: {e}, chuyển sang gọi từng job")
+    
+    if fetched is None:
+        semaphore = asyncio.Semaphore(JENKINS_STATUS_CONCURRENCY)
+        
+        async def bounded_status(name):
+            async with semaphore:
+                return await fetch_jenkins_job_status(name)
+        
+        results = await asyncio.gather(*[bounded_status(name) for name in missing])
+        fetched = dict(zip(missing, results))
+    
+    expires_at = time.monotonic() + JENKINS_STATUS_TTL
+    for name, status in fetched.items():
+        # Không cache 'unknown' (lỗi tạm thời) để lần sau thử lại
+        if status != 'unknown':
+            _jenkins_status_cache[name] = (status, expires_at)
+    statuses.update(fetched)
+    return statuses
+
+def invalidate_jenkins_status(job_name=None):
+    if job_name is None:
+        _jenkins_status_cache.clear()
+    else:
+        _jenkins_status_cache.pop(job_name, None)
+
 @router.get("/jenkins/jobs/db")
 async def get_jenkins_jobs_from_db():
     """Lấy danh sách Jenkins jobs từ database"""
+    try:
+        jobs_data = await run_in_threadpool(load_jenkins_jobs)
+        
+        # Trạng thái thực từ Jenkins: một tree query cho mọi job (có cache ngắn hạn)
+        statuses = await fetch_jenkins_statuses([job["name"] for job in jobs_data])
+        for job in jobs_data:
+            job["status"] = statuses.get(job["name"], "unknown")
+        
+        return {
+            "jobs": jobs_data,
+            "total": len(jobs_data)
+        }
+            
+    except Exception as e:
+        print(f"[DEBUG] Error getting Jenkins jobs from DB: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách Jenkins jobs từ database: {e}")
+
+def delete_jenkins_job_record(job_name):
+    """Xóa job khỏi database, trả về True nếu đã xóa - hàm sync, gọi qua run_in_threadpool"""
     try:
         from database import SessionLocal, JenkinsJob
         db = SessionLocal()
-        
         try:
-            jenkins_jobs = db.query(JenkinsJob).order_by(JenkinsJob.created_at.desc()).all()
-            
-            jobs_data = []
-            for job in jenkins_jobs:
-                # Chuyển đổi múi giờ từ UTC sang UTC+7 (Việt Nam)
-                created_at_vn = None
-                updated_at_vn = None
-                
-                if job.created_at:
-                    # Thêm 7 giờ để chuyển từ UTC sang UTC+7
-                    created_at_vn = job.created_at.replace(tzinfo=None) + timedelta(hours=7)
-                
-                if job.updated_at:
-                    # Thêm 7 giờ để chuyển từ UTC sang UTC+7
-                    updated_at_vn = job.updated_at.replace(tzinfo=None) + timedelta(hours=7)
-                
-                # Lấy trạng thái thực từ Jenkins
-                jenkins_status = "unknown"
-                try:
-                    JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-                    jenkins_api_url = f"{JENKINS_URL}/job/{job.name}/api/json"
-                    
-                    response = requests.get(jenkins_api_url, timeout=10)
-                    
-                    if response.status_code == 200:
-                        jenkins_data = response.json()
-                        
-                        # Lấy trạng thái từ lastBuild
-                        if jenkins_data.get('lastBuild'):
-                            last_build_number = jenkins_data['lastBuild'].get('number')
-                            
-                            if last_build_number:
-                                # Lấy result từ build cụ thể
-                                build_api_url = f"{JENKINS_URL}/job/{job.name}/{last_build_number}/api/json"
-                                
-                                build_response = requests.get(build_api_url, timeout=10)
-                                if build_response.status_code == 200:
-                                    build_data = build_response.json()
-                                    build_result = build_data.get('result')
-                                    building = build_data.get('building', False)
-                                    
-                                    # Kiểm tra nếu job đang chạy
-                                    if building:
-                                        jenkins_status = 'building'
-                                    elif build_result == 'SUCCESS':
-                                        jenkins_status = 'blue'
-                                    elif build_result == 'FAILURE':
-                                        jenkins_status = 'red'
-                                    elif build_result == 'UNSTABLE':
-                                        jenkins_status = 'yellow'
-                                    elif build_result == 'ABORTED':
-                                        jenkins_status = 'grey'
-                                    else:
-                                        jenkins_status = 'notbuilt'
-                                else:
-                                    jenkins_status = 'unknown'
-                            else:
-                                jenkins_status = 'notbuilt'
-                        else:
-                            jenkins_status = 'notbuilt'
-                    else:
-                        jenkins_status = 'disabled'
-                except Exception as e:
-                    print(f"[DEBUG] Không thể lấy trạng thái Jenkins cho job {job.name}: {e}")
-                    jenkins_status = 'unknown'
-                
-                jobs_data.append({
-                    "id": job.id,
-                    "name": job.name,
-                    "project_id": job.project_id,
-                    "project_name": job.project_name,
-                    "repository": job.repository,
-                    "status": jenkins_status,  # Sử dụng trạng thái từ Jenkins
-                    "created_at": created_at_vn.isoformat() if created_at_vn else None,
-                    "updated_at": updated_at_vn.isoformat() if updated_at_vn else None
-                })
-            
-            return {
-                "jobs": jobs_data,
-                "total": len(jobs_data)
-            }
-            
+            db_job = db.query(JenkinsJob).filter(JenkinsJob.name == job_name).first()
+            if db_job:
+                db.delete(db_job)
+                db.commit()
+                print(f"[DEBUG] Đã xóa Jenkins job '{job_name}' khỏi database")
+                return True
+            print(f"[DEBUG] Không tìm thấy job '{job_name}' trong database")
+        except Exception as e:
+            db.rollback()
+            print(f"[DEBUG] Lỗi xóa Jenkins job khỏi database: {e}")
         finally:
             db.close()
-            
     except Exception as e:
-        print(f"[DEBUG] Error getting Jenkins jobs from DB: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách Jenkins jobs từ database: {e}")
+        print(f"[DEBUG] Lỗi import JenkinsJob model: {e}")
+    return False
 
 @router.delete("/jenkins/jobs/{job_name}")
 async def delete_jenkins_job(job_name: str):
     """Xóa Jenkins job"""
     try:
         JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-        JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-        JENKINS_PASS = os.getenv("JENKINS_PASS", "admin")
         
         print(f"[DEBUG] Bắt đầu xóa Jenkins job: {job_name}")
         
-        # Sử dụng session để xóa job
-        session = requests.Session()
-        session.auth = HTTPBasicAuth(JENKINS_USER, JENKINS_PASS)
-        
-        # Lấy CSRF crumb với session
-        crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-        try:
-            crumb_response = session.get(crumb_url, timeout=30)
-            print(f"[DEBUG] CSRF crumb response status: {crumb_response.status_code}")
-            
-            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-            if crumb_response.status_code == 200:
-                crumb_data = crumb_response.json()
-                headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                print(f"[DEBUG] Đã lấy CSRF crumb thành công: {crumb_data['crumbRequestField']} = {crumb_data['crumb']}")
-            else:
-                print(f"[DEBUG] Không thể lấy CSRF crumb: {crumb_response.status_code}")
-        except Exception as e:
-            print(f"[DEBUG] Lỗi lấy CSRF crumb: {e}")
-            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        # Jenkins client dùng chung tự thêm auth và CSRF crumb
+        session = get_async_jenkins_client()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         
         # Xóa job từ Jenkins với session
         delete_url = f"{JENKINS_URL}/job/{job_name}/doDelete"
@@ -683,10 +754,9 @@ async def delete_jenkins_job(job_name: str):
         response = None
         try:
             # Thử với session và form data
-            response = session.post(
+            response = await session.post(
                 delete_url,
-                headers=headers,
-                timeout=30
+                headers=headers
             )
             print(f"[DEBUG] Jenkins delete response status: {response.status_code}")
             print(f"[DEBUG] Jenkins delete response text: {response.text[:200]}")
@@ -696,10 +766,7 @@ async def delete_jenkins_job(job_name: str):
                 print(f"[DEBUG] Thử với DELETE method...")
                 delete_rest_url = f"{JENKINS_URL}/job/{job_name}"
                 try:
-                    delete_response = session.delete(
-                        delete_rest_url,
-                        timeout=30
-                    )
+                    delete_response = await session.delete(delete_rest_url)
                     print(f"[DEBUG] Jenkins DELETE method response status: {delete_response.status_code}")
                     print(f"[DEBUG] Jenkins DELETE method response text: {delete_response.text[:200]}")
                     response = delete_response
@@ -712,26 +779,8 @@ async def delete_jenkins_job(job_name: str):
             response = None
         
         # Xóa job từ database
-        db_deleted = False
-        try:
-            from database import SessionLocal, JenkinsJob
-            db = SessionLocal()
-            try:
-                db_job = db.query(JenkinsJob).filter(JenkinsJob.name == job_name).first()
-                if db_job:
-                    db.delete(db_job)
-                    db.commit()
-                    db_deleted = True
-                    print(f"[DEBUG] Đã xóa Jenkins job '{job_name}' khỏi database")
-                else:
-                    print(f"[DEBUG] Không tìm thấy job '{job_name}' trong database")
-            except Exception as e:
-                db.rollback()
-                print(f"[DEBUG] Lỗi xóa Jenkins job khỏi database: {e}")
-            finally:
-                db.close()
-        except Exception as e:
-            print(f"[DEBUG] Lỗi import JenkinsJob model: {e}")
+        db_deleted = await run_in_threadpool(delete_jenkins_job_record, job_name)
+        invalidate_jenkins_status(job_name)
         
         # Trả về kết quả
         if response and response.status_code in [200, 302]:
@@ -751,7 +800,7 @@ async def delete_jenkins_job(job_name: str):
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/jenkins/jobs/by-project/{project_id}")
-async def get_jenkins_jobs_by_project(project_id: int):
+def get_jenkins_jobs_by_project(project_id: int):
     """Lấy danh sách Jenkins jobs theo project_id từ database"""
     try:
         from database import SessionLocal, JenkinsJob
@@ -798,7 +847,7 @@ async def get_jenkins_jobs_by_project(project_id: int):
         raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách Jenkins jobs theo project: {e}")
 
 @router.get("/jenkins/jobs/{job_name}/info")
-async def get_jenkins_job_info(job_name: str):
+def get_jenkins_job_info(job_name: str):
     """Lấy thông tin chi tiết của Jenkins job từ database"""
     try:
         from database import SessionLocal, JenkinsJob
@@ -841,73 +890,107 @@ async def get_jenkins_job_info(job_name: str):
         print(f"[DEBUG] Error getting Jenkins job info: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi lấy thông tin Jenkins job: {e}")
 
+def validate_jenkins_job_update(job_name, new_name, new_project_id):
+    """Kiểm tra job và project trước khi cập nhật, trả về (project_name, repo_link)"""
+    from database import SessionLocal, JenkinsJob, Project
+    db = SessionLocal()
+    try:
+        # Tìm job trong database
+        db_job = db.query(JenkinsJob).filter(JenkinsJob.name == job_name).first()
+        if not db_job:
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy job '{job_name}' trong database")
+        
+        # Kiểm tra project có tồn tại không
+        project = db.query(Project).filter(Project.id == new_project_id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy project với ID {new_project_id}")
+        
+        # Kiểm tra xem tên mới đã tồn tại chưa (nếu khác tên cũ)
+        if new_name != job_name:
+            existing_job = db.query(JenkinsJob).filter(JenkinsJob.name == new_name).first()
+            if existing_job:
+                raise HTTPException(status_code=400, detail=f"Job name '{new_name}' đã tồn tại")
+        return project.name, project.repo_link
+    finally:
+        db.close()
+
+def apply_jenkins_job_update(job_name, new_name, new_project_id, project_name, repo_link):
+    """Cập nhật job trong database sau khi Jenkins đã tạo job mới, trả về dữ liệu job"""
+    from database import SessionLocal, JenkinsJob
+    db = SessionLocal()
+    try:
+        db_job = db.query(JenkinsJob).filter(JenkinsJob.name == job_name).first()
+        if not db_job:
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy job '{job_name}' trong database")
+        
+        db_job.name = new_name
+        db_job.project_id = new_project_id
+        db_job.project_name = project_name
+        db_job.repository = repo_link
+        db_job.updated_at = datetime.utcnow()
+        
+        db.commit()
+        print(f"[DEBUG] Đã cập nhật job trong database")
+        
+        # Chuyển đổi múi giờ từ UTC sang UTC+7 (Việt Nam)
+        updated_at_vn = None
+        if db_job.updated_at:
+            # Thêm 7 giờ để chuyển từ UTC sang UTC+7
+            updated_at_vn = db_job.updated_at.replace(tzinfo=None) + timedelta(hours=7)
+        
+        return {
+            "id": db_job.id,
+            "name": db_job.name,
+            "project_id": db_job.project_id,
+            "project_name": db_job.project_name,
+            "repository": db_job.repository,
+            "status": db_job.status,
+            "updated_at": updated_at_vn.isoformat() if updated_at_vn else None
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        print(f"[DEBUG] Error updating Jenkins job: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi cập nhật Jenkins job: {e}")
+    finally:
+        db.close()
+
 @router.put("/jenkins/jobs/{job_name}")
 async def update_jenkins_job(job_name: str, job_data: dict):
     """Cập nhật thông tin Jenkins job - cả Jenkins và database"""
     try:
-        from database import SessionLocal, JenkinsJob, Project
-        db = SessionLocal()
+        # Lấy thông tin cập nhật
+        new_name = job_data.get("name")
+        new_project_id = job_data.get("project_id")
+        
+        if not new_name or not new_project_id:
+            raise HTTPException(status_code=400, detail="Tên job và project_id là bắt buộc")
+        
+        project_name, repo_link = await run_in_threadpool(validate_jenkins_job_update, job_name, new_name, new_project_id)
+        
+        # Jenkins configuration
+        JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
         
+        print(f"[DEBUG] Bắt đầu cập nhật Jenkins job: {job_name} -> {new_name}")
+        
+        # Bước 1: Xóa job cũ khỏi Jenkins (nếu tồn tại)
+        # Jenkins client dùng chung tự thêm auth và CSRF crumb
+        session = get_async_jenkins_client()
+        delete_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        
+        # Xóa job cũ
+        delete_url = f"{JENKINS_URL}/job/{job_name}/doDelete"
         try:
-            # Tìm job trong database
-            db_job = db.query(JenkinsJob).filter(JenkinsJob.name == job_name).first()
-            if not db_job:
-                raise HTTPException(status_code=404, detail=f"Không tìm thấy job '{job_name}' trong database")
-            
-            # Lấy thông tin cập nhật
-            new_name = job_data.get("name")
-            new_project_id = job_data.get("project_id")
-            
-            if not new_name or not new_project_id:
-                raise HTTPException(status_code=400, detail="Tên job và project_id là bắt buộc")
-            
-            # Kiểm tra project có tồn tại không
-            project = db.query(Project).filter(Project.id == new_project_id).first()
-            if not project:
-                raise HTTPException(status_code=404, detail=f"Không tìm thấy project với ID {new_project_id}")
-            
-            # Kiểm tra xem tên mới đã tồn tại chưa (nếu khác tên cũ)
-            if new_name != job_name:
-                existing_job = db.query(JenkinsJob).filter(JenkinsJob.name == new_name).first()
-                if existing_job:
-                    raise HTTPException(status_code=400, detail=f"Job name '{new_name}' đã tồn tại")
-            
-            # Jenkins configuration
-            JENKINS_URL = os.getenv("JENKINS_URL", "http://localhost:8080")
-            JENKINS_USER = os.getenv("JENKINS_USER", "admin")
-            JENKINS_PASS = os.getenv("JENKINS_PASS", "admin")
-            
-            print(f"[DEBUG] Bắt đầu cập nhật Jenkins job: {job_name} -> {new_name}")
-            
-            # Bước 1: Xóa job cũ khỏi Jenkins (nếu tồn tại)
-            session = requests.Session()
-            session.auth = HTTPBasicAuth(JENKINS_USER, JENKINS_PASS)
-            
-            # Lấy CSRF crumb cho xóa job
-            crumb_url = f"{JENKINS_URL}/crumbIssuer/api/json"
-            try:
-                crumb_response = session.get(crumb_url, timeout=30)
-                delete_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-                if crumb_response.status_code == 200:
-                    crumb_data = crumb_response.json()
-                    delete_headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                    print(f"[DEBUG] Đã lấy CSRF crumb cho xóa job thành công")
-            except Exception as e:
-                print(f"[DEBUG] Lỗi lấy CSRF crumb cho xóa job: {e}")
-                delete_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-            
-            # Xóa job cũ
-            delete_url = f"{JENKINS_URL}/job/{job_name}/doDelete"
-            try:
-                delete_response = session.post(delete_url, headers=delete_headers, timeout=30)
-                print(f"[DEBUG] Xóa job cũ status: {delete_response.status_code}")
-            except Exception as e:
-                print(f"[DEBUG] Lỗi xóa job cũ: {e}")
-            
-            # Bước 2: Tạo job mới với thông tin cập nhật (sử dụng logic giống tạo job)
-            config_xml = f"""<?xml version='1.1' encoding='UTF-8'?>
+            delete_response = await session.post(delete_url, headers=delete_headers)
+            print(f"[DEBUG] Xóa job cũ status: {delete_response.status_code}")
+        except Exception as e:
+            print(f"[DEBUG] Lỗi xóa job cũ: {e}")
+        
+        # Bước 2: Tạo job mới với thông tin cập nhật (sử dụng logic giống tạo job)
+        config_xml = f"""<?xml version='1.1' encoding='UTF-8'?>
 <flow-definition plugin="workflow-job@1339.vd5a_957c2c31">
-    <description>Auto-generated pipeline job for {project.name}</description>
+    <description>Auto-generated pipeline job for {project_name}</description>
     <keepDependencies>false</keepDependencies>
     <properties>
         <hudson.model.ParametersDefinitionProperty>
@@ -926,7 +1009,7 @@ async def update_jenkins_job(job_name: str, job_data: dict):
             <configVersion>2</configVersion>
             <userRemoteConfigs>
                 <hudson.plugins.git.UserRemoteConfig>
-                    <url>{project.repo_link}</url>
+                    <url>{repo_link}</url>
                 </hudson.plugins.git.UserRemoteConfig>
             </userRemoteConfigs>
             <branches>
@@ -944,98 +1027,39 @@ async def update_jenkins_job(job_name: str, job_data: dict):
     <triggers/>
     <disabled>false</disabled>
 </flow-definition>"""
-            
-            # Tạo job mới với logic giống hệt tạo job
-            create_job_url = f"{JENKINS_URL}/createItem?name={new_name}"
-            
-            # Get CSRF crumb cho tạo job (giống logic tạo job)
-            try:
-                crumb_response = session.get(crumb_url, timeout=30)
-                headers = {'Content-Type': 'application/xml'}
-                if crumb_response.status_code == 200:
-                    crumb_data = crumb_response.json()
-                    headers[crumb_data['crumbRequestField']] = crumb_data['crumb']
-                elif crumb_response.status_code == 403:
-                    # Jenkins không yêu cầu CSRF, tiếp tục không có crumb
-                    headers = {'Content-Type': 'application/xml'}
-                else:
-                    logging.warning(f"Không thể lấy CSRF crumb: {crumb_response.status_code}")
-                    headers = {'Content-Type': 'application/xml'}
-            except Exception as e:
-                logging.warning(f"Lỗi khi lấy CSRF crumb: {e}")
-                headers = {'Content-Type': 'application/xml'}
-            
-            # Tạo job với authentication (giống logic tạo job)
-            try:
-                # Thử với authentication trước
-                create_response = session.post(
-                    create_job_url,
-                    data=config_xml,
-                    headers=headers,
-                    auth=HTTPBasicAuth(JENKINS_USER, JENKINS_PASS),
-                    timeout=30
-                )
-                
-                # Nếu lỗi 401/403, thử không có authentication
-                if create_response.status_code in [401, 403]:
-                    logging.info("Jenkins requires authentication, trying without auth...")
-                    create_response = session.post(
-                        create_job_url,
-                        data=config_xml,
-                        headers=headers,
-                        timeout=30
-                    )
-                    
-            except requests.exceptions.RequestException as e:
-                raise HTTPException(status_code=500, detail=f"Lỗi kết nối Jenkins: {str(e)}")
-            
-            print(f"[DEBUG] Tạo job mới status: {create_response.status_code}")
-            
-            if create_response.status_code != 200:
-                print(f"[DEBUG] Lỗi tạo job mới: {create_response.text}")
-                raise HTTPException(status_code=500, detail=f"Không thể tạo job mới trong Jenkins: {create_response.status_code}")
-            
-            # Bước 3: Cập nhật database
-            db_job.name = new_name
-            db_job.project_id = new_project_id
-            db_job.project_name = project.name
-            db_job.repository = project.repo_link
-            db_job.updated_at = datetime.utcnow()
-            
-            db.commit()
-            print(f"[DEBUG] Đã cập nhật job trong database")
-            
-            # Chuyển đổi múi giờ từ UTC sang UTC+7 (Việt Nam)
-            updated_at_vn = None
-            if db_job.updated_at:
-                # Thêm 7 giờ để chuyển từ UTC sang UTC+7
-                updated_at_vn = db_job.updated_at.replace(tzinfo=None) + timedelta(hours=7)
-            
-            return {
-                "success": True,
-                "message": f"Đã cập nhật Jenkins job '{job_name}' thành '{new_name}' thành công",
-                "job": {
-                    "id": db_job.id,
-                    "name": db_job.name,
-                    "project_id": db_job.project_id,
-                    "project_name": db_job.project_name,
-                    "repository": db_job.repository,
-                    "status": db_job.status,
-                    "updated_at": updated_at_vn.isoformat() if updated_at_vn else None
-                }
-            }
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            db.rollback()
-            print(f"[DEBUG] Error updating Jenkins job: {e}")
-            raise HTTPException(status_code=500, detail=f"Lỗi cập nhật Jenkins job: {e}")
-        finally:
-            db.close()
+        
+        # Tạo job mới với logic giống hệt tạo job
+        create_job_url = f"{JENKINS_URL}/createItem?name={new_name}"
+        
+        headers = {'Content-Type': 'application/xml'}
+        try:
+            create_response = await session.post(
+                create_job_url,
+                content=config_xml,
+                headers=headers
+            )
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=500, detail=f"Lỗi kết nối Jenkins: {str(e)}")
+        
+        print(f"[DEBUG] Tạo job mới status: {create_response.status_code}")
+        
+        if create_response.status_code != 200:
+            print(f"[DEBUG] Lỗi tạo job mới: {create_response.text}")
+            raise HTTPException(status_code=500, detail=f"Không thể tạo job mới trong Jenkins: {create_response.status_code}")
+        
+        # Bước 3: Cập nhật database
+        job = await run_in_threadpool(apply_jenkins_job_update, job_name, new_name, new_project_id, project_name, repo_link)
+        invalidate_jenkins_status(job_name)
+        invalidate_jenkins_status(new_name)
+        
+        return {
+            "success": True,
+            "message": f"Đã cập nhật Jenkins job '{job_name}' thành '{new_name}' thành công",
+            "job": job
+        }
             
     except HTTPException:
         raise
     except Exception as e:
         print(f"[DEBUG] Error updating Jenkins job: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi cập nhật Jenkins job: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Lỗi cập nhật Jenkins job: {e}")
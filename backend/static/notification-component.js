@@ -4,14 +4,18 @@ class NotificationComponent {
         this.notifications = [];
         this.unreadCount = 0;
         this.isDropdownOpen = false;
+        this.eventSource = null;
+        this.streamConnected = false;
+        this.streamRetryDelay = 5000;
+        this.streamRetryTimer = null;
+        this.refreshTimer = null;
         this.init();
     }
 
     init() {
         this.createNotificationHTML();
         this.bindEvents();
-        this.loadNotifications();
-        this.startAutoRefresh();
+        this.connectStream();
     }
 
     createNotificationHTML() {
@@ -89,7 +93,11 @@ class NotificationComponent {
         
         if (this.isDropdownOpen) {
             dropdown.classList.add('show');
-            this.loadNotifications(); // Refresh when opening
+            if (!this.streamConnected) {
+                this.loadNotifications(); // Không có luồng SSE thì tải lại khi mở
+            } else {
+                this.renderNotifications(); // Cập nhật "x phút trước"
+            }
         } else {
             dropdown.classList.remove('show');
         }
@@ -167,7 +175,7 @@ class NotificationComponent {
                         <span>${notification.task_id}</span>
                     </div>
                     <div class="notification-time">
-                        ${notification.time_ago}
+                        ${this.formatTimeAgo(notification.created_at) || notification.time_ago}
                     </div>
                 </div>
             </div>
@@ -269,13 +277,107 @@ class NotificationComponent {
         this.loadNotifications();
     }
 
+    connectStream() {
+        // Server đẩy thông báo qua Server-Sent Events: snapshot khi kết nối, sau đó chỉ các thay đổi
+        if (typeof EventSource === 'undefined') {
+            this.loadNotifications();
+            this.startAutoRefresh();
+            return;
+        }
+        this.streamRetryTimer = null;
+        this.eventSource = new EventSource('/api/reports/notifications/stream?limit=10');
+        this.eventSource.addEventListener('snapshot', (e) => {
+            const data = JSON.parse(e.data);
+            this.streamConnected = true;
+            this.streamRetryDelay = 5000;
+            this.stopAutoRefresh();
+            this.notifications = data.notifications;
+            this.unreadCount = data.unread_count;
+            this.updateBadge();
+            this.renderNotifications();
+        });
+        this.eventSource.addEventListener('notification', (e) => {
+            this.applyEvent(JSON.parse(e.data));
+        });
+        this.eventSource.onerror = () => {
+            this.streamConnected = false;
+            if (this.eventSource.readyState === EventSource.CLOSED) {
+                // Trình duyệt không tự kết nối lại (ví dụ 401/5xx lúc deploy) - tạm poll,
+                // thử mở lại luồng với backoff; snapshot tiếp theo sẽ tắt poll
+                this.eventSource.close();
+                this.eventSource = null;
+                this.loadNotifications();
+                this.startAutoRefresh();
+                this.scheduleStreamReconnect();
+            }
+            // CONNECTING: EventSource tự kết nối lại và nhận snapshot mới
+        };
+    }
+
+    scheduleStreamReconnect() {
+        if (this.streamRetryTimer) return;
+        const delay = this.streamRetryDelay;
+        this.streamRetryDelay = Math.min(this.streamRetryDelay * 2, 300000);
+        this.streamRetryTimer = setTimeout(() => this.connectStream(), delay);
+    }
+
+    applyEvent(event) {
+        switch (event.type) {
+            case 'created':
+                if (!this.notifications.some(n => n.id === event.notification.id)) {
+                    this.notifications.unshift(event.notification);
+                    this.notifications = this.notifications.slice(0, 10);
+                }
+                break;
+            case 'read':
+                this.notifications.forEach(n => {
+                    if (event.ids.includes(n.id)) n.is_read = true;
+                });
+                break;
+            case 'read_all':
+                this.notifications.forEach(n => n.is_read = true);
+                break;
+            case 'cleared':
+                this.notifications = [];
+                break;
+            case 'resync':
+                this.loadNotifications();
+                return;
+        }
+        if (typeof event.unread_count === 'number') {
+            this.unreadCount = event.unread_count;
+        }
+        this.updateBadge();
+        this.renderNotifications();
+    }
+
     startAutoRefresh() {
-        // Auto refresh every 30 seconds
-        setInterval(() => {
+        // Chỉ dùng khi không có luồng SSE: auto refresh every 30 seconds
+        if (this.refreshTimer) return;
+        this.refreshTimer = setInterval(() => {
             this.loadNotifications();
         }, 30000);
     }
 
+    stopAutoRefresh() {
+        if (this.refreshTimer) {
+            clearInterval(this.refreshTimer);
+            this.refreshTimer = null;
+        }
+    }
+
+    formatTimeAgo(createdAt) {
+        // created_at là giờ UTC không có timezone
+        if (!createdAt) return '';
+        const created = new Date(/(Z|[+-]\d\d:\d\d)$/i.test(createdAt) ? createdAt : createdAt + 'Z');
+        const seconds = Math.floor((Date.now() - created.getTime()) / 1000);
+        if (isNaN(seconds)) return '';
+        if (seconds >= 86400) return `${Math.floor(seconds / 86400)} ngày trước`;
+        if (seconds >= 3600) return `${Math.floor(seconds / 3600)} giờ trước`;
+        if (seconds >= 60) return `${Math.floor(seconds / 60)} phút trước`;
+        return 'Vừa xong';
+    }
+
     getStatusText(status) {
         switch (status) {
             case 'success': return 'Thành công';
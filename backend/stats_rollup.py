@@ -0,0 +1,303 @@
+"""
+Các bảng thống kê tổng hợp: dashboard_stats (bộ đếm cho dashboard) và
+report_trends (số report theo giờ/ngày cho biểu đồ execution trends).
+
+Các bộ đếm được cập nhật tăng dần bởi trigger PostgreSQL trên projects, executions,
+plans, cicd và reports - nên mọi thay đổi (webhook lưu report, đổi trạng thái task,
+xoá task/report) đều được phản ánh mà không cần COUNT(*) lại toàn bảng.
+Dashboard chỉ đọc một số key cố định theo khoá chính; execution trends chỉ đọc
+các bucket đã tổng hợp sẵn.
+
+Để các transaction ghi report đồng thời không cùng chờ khoá một dòng nóng ('reports.count',
+'reports.total_tests'...), trigger cộng vào một trong DASHBOARD_STAT_STRIPES dòng con
+'<key>#<stripe>' (stripe theo backend pid); get_stats cộng dòng gốc '<key>' (do rebuild ghi)
+với mọi dòng con. Đổi DASHBOARD_STAT_STRIPES thì chạy rebuild.
+
+Rebuild thủ công (backfill, sau khi import dữ liệu trực tiếp vào DB):
+    python stats_rollup.py rebuild
+"""
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import engine, SessionLocal, DashboardStat, ReportTrend
+
+DASHBOARD_STAT_STRIPES = max(1, int(os.getenv("DASHBOARD_STAT_STRIPES", "8")))
+
+TASK_TABLES = {
+    "execution": "executions",
+    "plan": "plans",
+    "cicd": "cicd",
+}
+
+# Trigger tự cập nhật bảng dashboard_stats và report_trends - chạy lại nhiều lần không sao (idempotent)
+INSTALL_STATEMENTS = [
+    f"""
+    CREATE OR REPLACE FUNCTION dashboard_stats_bump(p_key TEXT, p_delta BIGINT) RETURNS void AS $$
+    BEGIN
+        IF p_key IS NULL OR p_delta = 0 THEN
+            RETURN;
+        END IF;
+        INSERT INTO dashboard_stats (stat_key, value, updated_at)
+        VALUES (p_key || '#' || (pg_backend_pid() % {DASHBOARD_STAT_STRIPES}), p_delta, now())
+        ON CONFLICT (stat_key) DO UPDATE
+            SET value = dashboard_stats.value + EXCLUDED.value,
+                updated_at = now();
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION dashboard_stats_task_trigger() RETURNS trigger AS $$
+    DECLARE
+        prefix TEXT := 'tasks.' || TG_ARGV[0];
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status
+                AND OLD.created_at IS NOT DISTINCT FROM NEW.created_at THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM dashboard_stats_bump(prefix || '.total', -1);
+            PERFORM dashboard_stats_bump(prefix || '.status.' || COALESCE(OLD.status, ''), -1);
+            PERFORM dashboard_stats_bump(prefix || '.created.' || to_char(OLD.created_at, 'YYYY-MM-DD'), -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM dashboard_stats_bump(prefix || '.total', 1);
+            PERFORM dashboard_stats_bump(prefix || '.status.' || COALESCE(NEW.status, ''), 1);
+            PERFORM dashboard_stats_bump(prefix || '.created.' || to_char(NEW.created_at, 'YYYY-MM-DD'), 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION dashboard_stats_project_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM dashboard_stats_bump('projects.total', -1);
+            PERFORM dashboard_stats_bump('projects.status.' || COALESCE(OLD.status, ''), -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM dashboard_stats_bump('projects.total', 1);
+            PERFORM dashboard_stats_bump('projects.status.' || COALESCE(NEW.status, ''), 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION dashboard_stats_report_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM dashboard_stats_bump('reports.count', -1);
+            PERFORM dashboard_stats_bump('reports.total_tests', -COALESCE(OLD.total_tests, 0));
+            PERFORM dashboard_stats_bump('reports.passed_tests', -COALESCE(OLD.passed_tests, 0));
+            PERFORM dashboard_stats_bump('reports.failed_tests', -COALESCE(OLD.failed_tests, 0));
+            PERFORM dashboard_stats_bump('reports.created.' || to_char(OLD.created_at, 'YYYY-MM-DD'), -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM dashboard_stats_bump('reports.count', 1);
+            PERFORM dashboard_stats_bump('reports.total_tests', COALESCE(NEW.total_tests, 0));
+            PERFORM dashboard_stats_bump('reports.passed_tests', COALESCE(NEW.passed_tests, 0));
+            PERFORM dashboard_stats_bump('reports.failed_tests', COALESCE(NEW.failed_tests, 0));
+            PERFORM dashboard_stats_bump('reports.created.' || to_char(NEW.created_at, 'YYYY-MM-DD'), 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_task_type(p_task_type TEXT, p_task_id TEXT) RETURNS TEXT AS $$
+        SELECT COALESCE(NULLIF(p_task_type, ''), CASE
+            WHEN p_task_id LIKE 'TASK-%' THEN 'execution'
+            WHEN p_task_id LIKE 'PLAN-%' THEN 'plan'
+            WHEN p_task_id LIKE 'CICD-%' THEN 'cicd'
+            ELSE ''
+        END)
+    $$ LANGUAGE sql IMMUTABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_trends_bump(p_created_at TIMESTAMP, p_project_id INTEGER,
+                                                  p_task_type TEXT, p_status TEXT, p_delta INTEGER) RETURNS void AS $$
+    DECLARE
+        g TEXT;
+    BEGIN
+        IF p_created_at IS NULL THEN
+            RETURN;
+        END IF;
+        FOREACH g IN ARRAY ARRAY['hour', 'day'] LOOP
+            INSERT INTO report_trends (granularity, bucket_start, project_id, task_type, total, success, failed, cancelled)
+            VALUES (
+                g, date_trunc(g, p_created_at), COALESCE(p_project_id, 0), p_task_type, p_delta,
+                CASE WHEN p_status = 'success' THEN p_delta ELSE 0 END,
+                CASE WHEN p_status = 'failure' THEN p_delta ELSE 0 END,
+                CASE WHEN p_status = 'aborted' THEN p_delta ELSE 0 END
+            )
+            ON CONFLICT (granularity, bucket_start, project_id, task_type) DO UPDATE
+                SET total = report_trends.total + EXCLUDED.total,
+                    success = report_trends.success + EXCLUDED.success,
+                    failed = report_trends.failed + EXCLUDED.failed,
+                    cancelled = report_trends.cancelled + EXCLUDED.cancelled;
+        END LOOP;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_trends_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM report_trends_bump(OLD.created_at, OLD.project_id,
+                                       report_task_type(OLD.task_type, OLD.task_id), OLD.status, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM report_trends_bump(NEW.created_at, NEW.project_id,
+                                       report_task_type(NEW.task_type, NEW.task_id), NEW.status, 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_report_trends ON reports",
+    """
+    CREATE TRIGGER trg_report_trends
+    AFTER INSERT OR DELETE OR UPDATE OF status, created_at, project_id, task_type, task_id ON reports
+    FOR EACH ROW EXECUTE FUNCTION report_trends_trigger()
+    """,
+    "DROP TRIGGER IF EXISTS trg_dashboard_stats_projects ON projects",
+    """
+    CREATE TRIGGER trg_dashboard_stats_projects
+    AFTER INSERT OR DELETE OR UPDATE OF status ON projects
+    FOR EACH ROW EXECUTE FUNCTION dashboard_stats_project_trigger()
+    """,
+    "DROP TRIGGER IF EXISTS trg_dashboard_stats_reports ON reports",
+    """
+    CREATE TRIGGER trg_dashboard_stats_reports
+    AFTER INSERT OR DELETE OR UPDATE OF total_tests, passed_tests, failed_tests, created_at ON reports
+    FOR EACH ROW EXECUTE FUNCTION dashboard_stats_report_trigger()
+    """,
+]
+
+for _task_type, _table in TASK_TABLES.items():
+    INSTALL_STATEMENTS += [
+        f"DROP TRIGGER IF EXISTS trg_dashboard_stats_{_table} ON {_table}",
+        f"""
+        CREATE TRIGGER trg_dashboard_stats_{_table}
+        AFTER INSERT OR DELETE OR UPDATE OF status, created_at ON {_table}
+        FOR EACH ROW EXECUTE FUNCTION dashboard_stats_task_trigger('{_task_type}')
+        """,
+    ]
+
+
+def _rebuild_sql():
+    parts = [
+        "SELECT 'projects.total', COUNT(*) FROM projects",
+        "SELECT 'projects.status.' || COALESCE(status, ''), COUNT(*) FROM projects GROUP BY 1",
+        "SELECT 'reports.count', COUNT(*) FROM reports",
+        "SELECT 'reports.total_tests', COALESCE(SUM(total_tests), 0) FROM reports",
+        "SELECT 'reports.passed_tests', COALESCE(SUM(passed_tests), 0) FROM reports",
+        "SELECT 'reports.failed_tests', COALESCE(SUM(failed_tests), 0) FROM reports",
+        "SELECT 'reports.created.' || to_char(created_at, 'YYYY-MM-DD'), COUNT(*) FROM reports "
+        "WHERE created_at IS NOT NULL GROUP BY 1",
+    ]
+    for task_type, table in TASK_TABLES.items():
+        prefix = f"tasks.{task_type}"
+        parts += [
+            f"SELECT '{prefix}.total', COUNT(*) FROM {table}",
+            f"SELECT '{prefix}.status.' || COALESCE(status, ''), COUNT(*) FROM {table} GROUP BY 1",
+            f"SELECT '{prefix}.created.' || to_char(created_at, 'YYYY-MM-DD'), COUNT(*) FROM {table} "
+            f"WHERE created_at IS NOT NULL GROUP BY 1",
+        ]
+    return "INSERT INTO dashboard_stats (stat_key, value) " + "\nUNION ALL ".join(parts)
+
+
+def rebuild_dashboard_stats(db):
+    """
+    Tính lại toàn bộ bảng dashboard_stats từ dữ liệu gốc.
+    Khoá ghi các bảng nguồn trong lúc rebuild để không lệch với trigger.
+    """
+    tables = ", ".join(["projects", "reports"] + list(TASK_TABLES.values()))
+    db.execute(text(f"LOCK TABLE {tables} IN SHARE MODE"))
+    db.execute(text("DELETE FROM dashboard_stats"))
+    db.execute(text(_rebuild_sql()))
+    db.execute(text("INSERT INTO dashboard_stats (stat_key, value) VALUES ('rollup.initialized', 1)"))
+    db.commit()
+    count = db.query(DashboardStat).count()
+    print(f"[DEBUG] Rebuilt dashboard_stats ({count} keys)")
+    return count
+
+
+def rebuild_report_trends(db):
+    """Tính lại toàn bộ bảng report_trends từ bảng reports"""
+    db.execute(text("LOCK TABLE reports IN SHARE MODE"))
+    db.execute(text("DELETE FROM report_trends"))
+    for granularity in ("hour", "day"):
+        db.execute(text("""
+            INSERT INTO report_trends (granularity, bucket_start, project_id, task_type, total, success, failed, cancelled)
+            SELECT :granularity, date_trunc(:granularity, created_at), COALESCE(project_id, 0),
+                   report_task_type(task_type, task_id), COUNT(*),
+                   COUNT(*) FILTER (WHERE status = 'success'),
+                   COUNT(*) FILTER (WHERE status = 'failure'),
+                   COUNT(*) FILTER (WHERE status = 'aborted')
+            FROM reports
+            WHERE created_at IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        """), {"granularity": granularity})
+    db.commit()
+    count = db.query(ReportTrend).count()
+    print(f"[DEBUG] Rebuilt report_trends ({count} buckets)")
+    return count
+
+
+def install_dashboard_stats():
+    """Cài trigger; lần đầu (bảng rỗng) thì backfill từ dữ liệu hiện có"""
+    try:
+        with engine.begin() as connection:
+            for statement in INSTALL_STATEMENTS:
+                connection.execute(text(statement))
+
+        db = SessionLocal()
+        try:
+            initialized = db.query(DashboardStat).filter(DashboardStat.stat_key == "rollup.initialized").first()
+            if not initialized:
+                rebuild_dashboard_stats(db)
+            if db.query(ReportTrend.bucket_start).first() is None:
+                rebuild_report_trends(db)
+        finally:
+            db.close()
+        print("✅ Dashboard stats triggers installed")
+    except Exception as e:
+        print(f"[WARNING] Failed to install dashboard stats triggers: {e}")
+
+
+def get_stats(db, keys):
+    """Đọc các bộ đếm theo key (khoá chính), cộng dòng gốc với các dòng con '#stripe'; key chưa có trả về 0"""
+    keys = list(keys)
+    stat_keys = keys + [f"{key}#{stripe}" for key in keys for stripe in range(DASHBOARD_STAT_STRIPES)]
+    rows = db.query(DashboardStat.stat_key, DashboardStat.value).filter(DashboardStat.stat_key.in_(stat_keys)).all()
+    values = defaultdict(int)
+    for key, value in rows:
+        values[key.split("#", 1)[0]] += int(value or 0)
+    return values
+
+
+def today_key():
+    """Hậu tố ngày theo UTC - khớp với created_at (datetime.utcnow) được lưu trong DB"""
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        session = SessionLocal()
+        try:
+            rebuild_dashboard_stats(session)
+            rebuild_report_trends(session)
+        finally:
+            session.close()
+    else:
+        print("Usage: python stats_rollup.py rebuild")
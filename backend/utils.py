@@ -1,3 +1,7 @@
+import base64
+import json
+from datetime import datetime
+
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
@@ -23,4 +27,207 @@ def reset_report_sequence(db: Session):
     except Exception as e:
         print(f"[DEBUG] Error resetting reports sequence: {e}")
         db.rollback()
-        raise 
\ No newline at end of file
+        raise 
+
+# Report bị huỷ không được coi là kết quả "có ý nghĩa" của task
+SKIPPED_REPORT_STATUSES = ("cancelled", "aborted")
+
+# Report mới nhất của từng task: mỗi task một index scan LIMIT 1 (LATERAL) trên
+# idx_reports_task_meaningful (partial, bỏ cancelled/aborted) hoặc idx_reports_task_created_id
+_LATEST_REPORTS_SQL = """
+    SELECT r.* FROM {tasks}
+    CROSS JOIN LATERAL (
+        SELECT * FROM reports
+        WHERE reports.task_id = t.task_id {condition}
+        ORDER BY reports.created_at DESC, reports.id DESC
+        LIMIT 1
+    ) r
+"""
+_MEANINGFUL_CONDITION = "AND reports.status NOT IN ({})".format(
+    ", ".join(f"'{status}'" for status in SKIPPED_REPORT_STATUSES)
+)
+
+def _query_latest_reports(db: Session, task_ids, condition):
+    from database import Report
+
+    if task_ids is None:
+        tasks = "(SELECT DISTINCT task_id FROM reports) AS t"
+        params = {}
+    else:
+        tasks = "unnest(CAST(:task_ids AS VARCHAR[])) AS t(task_id)"
+        params = {"task_ids": task_ids}
+    statement = text(_LATEST_REPORTS_SQL.format(tasks=tasks, condition=condition))
+    return db.query(Report).from_statement(statement).params(**params).all()
+
+def get_latest_reports(db: Session, task_ids=None):
+    """
+    Lấy report mới nhất có ý nghĩa của mỗi task: report mới nhất không bị cancelled/aborted,
+    nếu không có thì lấy report mới nhất. Một query LATERAL cho tất cả task, thêm một query
+    cho các task chỉ có report bị huỷ. Trả về dict {task_id: Report}. task_ids=None nghĩa là tất cả task.
+    """
+    if task_ids is not None:
+        task_ids = list(set(task_id for task_id in task_ids if task_id))
+        if not task_ids:
+            return {}
+
+    latest = {report.task_id: report for report in _query_latest_reports(db, task_ids, _MEANINGFUL_CONDITION)}
+    if task_ids is None:
+        missing = None
+    else:
+        missing = [task_id for task_id in task_ids if task_id not in latest]
+    if missing is None or missing:
+        for report in _query_latest_reports(db, missing, ""):
+            latest.setdefault(report.task_id, report)
+    return latest
+
+def get_latest_report(db: Session, task_id: str):
+    """Report mới nhất có ý nghĩa của một task (xem get_latest_reports)"""
+    return get_latest_reports(db, [task_id]).get(task_id)
+
+def _empty_project_metrics():
+    return {
+        "tasks": {"execution": {}, "plan": {}, "cicd": {}},  # {task_type: {status: count}}
+        "reports_total": 0,
+        "reports_success": 0,
+        "testcases": 0
+    }
+
+def get_project_metrics(db: Session, project_ids=None):
+    """
+    Số liệu của tất cả project trong 2 query (thay vì vài query cho mỗi project):
+    - số task theo (project_id, loại task, status) - UNION ALL executions/plans/cicd
+    - số report, số report success và số test case theo project_id
+    Trả về dict {project_id: metrics}; project không có dữ liệu không xuất hiện trong dict.
+    """
+    from collections import defaultdict
+    from sqlalchemy import select, union_all, literal, func
+    from database import Execution, Plan, Cicd, Report, TestCase
+
+    metrics = defaultdict(_empty_project_metrics)
+    if project_ids is not None:
+        project_ids = list(set(project_ids))
+        if not project_ids:
+            return {}
+
+    tasks = union_all(
+        select(Execution.project_id.label("project_id"), literal("execution").label("task_type"), Execution.status.label("status")),
+        select(Plan.project_id, literal("plan"), Plan.status),
+        select(Cicd.project_id, literal("cicd"), Cicd.status)
+    ).subquery()
+    task_query = select(tasks.c.project_id, tasks.c.task_type, tasks.c.status, func.count()).group_by(
+        tasks.c.project_id, tasks.c.task_type, tasks.c.status
+    )
+    if project_ids is not None:
+        task_query = task_query.where(tasks.c.project_id.in_(project_ids))
+    for project_id, task_type, status, count in db.execute(task_query):
+        metrics[project_id]["tasks"][task_type][status] = count
+
+    report_query = select(
+        Report.project_id,
+        literal("reports").label("kind"),
+        func.count().label("total"),
+        func.count().filter(Report.status == "success").label("success")
+    ).group_by(Report.project_id)
+    testcase_query = select(
+        TestCase.project_id,
+        literal("testcases"),
+        func.count(),
+        literal(0)
+    ).where(TestCase.deleted_at.is_(None)).group_by(TestCase.project_id)
+    if project_ids is not None:
+        report_query = report_query.where(Report.project_id.in_(project_ids))
+        testcase_query = testcase_query.where(TestCase.project_id.in_(project_ids))
+    for project_id, kind, total, success in db.execute(union_all(report_query, testcase_query)):
+        if project_id is None:
+            continue
+        if kind == "reports":
+            metrics[project_id]["reports_total"] = total
+            metrics[project_id]["reports_success"] = success
+        else:
+            metrics[project_id]["testcases"] = total
+
+    return dict(metrics)
+
+def get_single_project_metrics(db: Session, project_id: int):
+    """Số liệu của một project (xem get_project_metrics)"""
+    return get_project_metrics(db, [project_id]).get(project_id) or _empty_project_metrics()
+
+# Tiền tố task_id theo loại task
+TASK_ID_PREFIXES = {"execution": "TASK-", "plan": "PLAN-", "cicd": "CICD-"}
+
+def encode_cursor(created_at, row_id):
+    """
+    Cursor keyset (created_at, id) dạng chuỗi base64 url-safe.
+    Query phân trang bằng cursor phải loại dòng created_at NULL (so sánh tuple với NULL
+    không bao giờ đúng và decode_cursor không nhận cursor không có thời điểm).
+    """
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Giải mã cursor của encode_cursor; ném ValueError nếu cursor không hợp lệ"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def resolve_tasks(db: Session, task_ids):
+    """
+    Thông tin task cho nhiều task_id bằng tối đa 3 query IN (execution, plan, CI/CD).
+    Trả về dict {task_id: {"task_name": ..., "jenkins_job": ...}}; task không tìm thấy không có trong dict.
+    """
+    from database import Execution, Plan, Cicd
+
+    cicd_ids = {}
+    plan_ids = []
+    execution_ids = []
+    for task_id in set(task_ids):
+        if not task_id:
+            continue
+        if task_id.startswith("CICD-"):
+            # Report CI/CD lưu CICD-<id của bảng cicd>
+            try:
+                cicd_ids[int(task_id.split("-")[1])] = task_id
+            except (IndexError, ValueError):
+                continue
+        elif task_id.startswith("PLAN-"):
+            plan_ids.append(task_id)
+        else:
+            execution_ids.append(task_id)
+
+    tasks = {}
+    if cicd_ids:
+        rows = db.query(Cicd.id, Cicd.cicd_name, Cicd.jenkins_job).filter(Cicd.id.in_(list(cicd_ids)))
+        for cicd_id, name, jenkins_job in rows:
+            tasks[cicd_ids[cicd_id]] = {"task_name": name, "jenkins_job": jenkins_job}
+    if plan_ids:
+        rows = db.query(Plan.plan_id, Plan.plan_name, Plan.jenkins_job).filter(Plan.plan_id.in_(plan_ids))
+        for plan_id, name, jenkins_job in rows:
+            tasks.setdefault(plan_id, {"task_name": name, "jenkins_job": jenkins_job})
+    if execution_ids:
+        rows = db.query(Execution.task_id, Execution.task_name, Execution.jenkins_job).filter(Execution.task_id.in_(execution_ids))
+        for task_id, name, jenkins_job in rows:
+            tasks.setdefault(task_id, {"task_name": name, "jenkins_job": jenkins_job})
+    return tasks
+
+def resolve_task_names(db: Session, task_ids):
+    """Tên task cho nhiều task_id: dict {task_id: task_name} (xem resolve_tasks)"""
+    return {task_id: task["task_name"] for task_id, task in resolve_tasks(db, task_ids).items()}
+
+def estimate_count(db: Session, query):
+    """
+    Số dòng ước lượng của query theo planner PostgreSQL (EXPLAIN), không quét bảng.
+    Trả về None nếu không ước lượng được.
+    """
+    try:
+        compiled = query.statement.compile(dialect=db.get_bind().dialect)
+        result = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        print(f"[DEBUG] Could not estimate row count: {e}")
+        return None
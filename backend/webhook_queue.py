@@ -0,0 +1,274 @@
+"""
+Hàng đợi xử lý webhook Jenkins.
+
+Webhook endpoint chỉ lưu payload vào bảng webhook_events rồi trả về 202 ngay;
+việc tải output.xml, lưu report, gửi email và tạo thông báo được chạy trong
+một worker pool giới hạn số luồng, có retry với backoff và idempotency key
+theo (job_name, build_number). Report, email (outbox) và thông báo đều idempotent theo build
+nên event được xử lý lại chỉ chạy các bước còn thiếu. Bước không có khoá idempotent trong DB
+(POST cấu hình job Jenkins của plan/CI/CD) được ghi vào webhook_events.progress khi xong
+và không chạy lại ở các lần retry.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from database import SessionLocal, WebhookEvent
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "300"))
+# Thời gian tối đa để xử lý một event (tải output.xml, lưu report); event 'processing' quá lease
+# được coi là worker đã dừng và được nhận lại
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "900"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_timers = set()
+_shutting_down = False
+
+
+def make_idempotency_key(job_name, build_number):
+    """Idempotency key cho một lần build Jenkins"""
+    return f"{job_name}#{build_number}"
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix="webhook-worker")
+        return _executor
+
+
+def _retry_delay(attempts):
+    """Exponential backoff: base * 2^(attempts-1), có giới hạn trên"""
+    return min(WEBHOOK_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), WEBHOOK_RETRY_MAX_SECONDS)
+
+
+def enqueue_webhook(task_id, job_name, build_number, body, db):
+    """
+    Lưu webhook vào bảng webhook_events và đưa vào worker pool.
+    Trả về (event, created). created=False nếu build này đã được nhận trước đó.
+    """
+    key = make_idempotency_key(job_name, build_number)
+    existing = db.query(WebhookEvent).filter(WebhookEvent.idempotency_key == key).first()
+    if existing:
+        return existing, False
+
+    event = WebhookEvent(
+        idempotency_key=key,
+        task_id=task_id,
+        job_name=job_name,
+        build_number=int(build_number),
+        payload=body,
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.add(event)
+    try:
+        db.commit()
+    except Exception:
+        # Jenkins gửi trùng cùng lúc - unique constraint trên idempotency_key
+        db.rollback()
+        existing = db.query(WebhookEvent).filter(WebhookEvent.idempotency_key == key).first()
+        if existing:
+            return existing, False
+        raise
+    db.refresh(event)
+
+    submit_event(event.id)
+    return event, True
+
+
+def submit_event(event_id, delay=0):
+    """Đưa event vào worker pool, có thể trì hoãn (retry)"""
+    if _shutting_down:
+        return
+    if delay and delay > 0:
+        timer = threading.Timer(delay, _submit_from_timer, args=(event_id,))
+        timer.daemon = True
+        _timers.add(timer)
+        timer.start()
+    else:
+        _get_executor().submit(process_event, event_id)
+
+
+def _submit_from_timer(event_id):
+    _timers.discard(threading.current_thread())
+    submit_event(event_id)
+
+
+def _claim_event(event_id, db):
+    """
+    Chuyển event sang 'processing' một cách nguyên tử để tránh xử lý trùng.
+    Event 'processing' có lease quá WEBHOOK_LEASE_SECONDS (worker đã dừng) cũng được nhận lại.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(WebhookEvent).filter(
+        WebhookEvent.id == event_id,
+        or_(
+            WebhookEvent.status.in_(["pending", "retry"]),
+            and_(
+                WebhookEvent.status == "processing",
+                or_(
+                    WebhookEvent.claimed_at.is_(None),
+                    WebhookEvent.claimed_at < now - timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+                )
+            )
+        )
+    ).update(
+        {
+            WebhookEvent.status: "processing",
+            WebhookEvent.attempts: WebhookEvent.attempts + 1,
+            WebhookEvent.claimed_at: now,
+            WebhookEvent.updated_at: now
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    if not claimed:
+        return None
+    return db.query(WebhookEvent).filter(WebhookEvent.id == event_id).first()
+
+
+def _refresh_jenkins_config_once(event, task, task_type, db):
+    """Cập nhật cấu hình job Jenkins một lần cho mỗi build; ghi (commit) progress ngay khi xong"""
+    from routes.reports import refresh_plan_jenkins_config, refresh_cicd_jenkins_config
+
+    refresh = {'plan': refresh_plan_jenkins_config, 'cicd': refresh_cicd_jenkins_config}.get(task_type)
+    progress = dict(event.progress or {})
+    if refresh is None or progress.get("jenkins_config"):
+        return
+    if refresh(task, event.job_name):
+        progress["jenkins_config"] = datetime.utcnow().isoformat()
+        event.progress = progress
+        db.commit()
+
+
+def process_event(event_id):
+    """Worker: xử lý một webhook event đã được lưu"""
+    from routes.reports import (
+        find_task_by_id, get_task_type_from_id,
+        process_execution_webhook, process_plan_webhook, process_cicd_webhook
+    )
+    from routes.log import log_backend_event
+
+    db = SessionLocal()
+    try:
+        event = _claim_event(event_id, db)
+        if event is None:
+            return
+
+        body = event.payload or {}
+        build_result = body.get('build', {}).get('result')
+
+        try:
+            # Mỗi bước (report, email, thông báo) idempotent theo build: khi event được xử lý lại
+            # sau khi report đã commit, các bước còn thiếu vẫn được chạy lại
+            task = find_task_by_id(event.task_id, db)
+            if task is None:
+                raise ValueError(f"Task not found for TASK_ID: {event.task_id}")
+
+            task_type = get_task_type_from_id(event.task_id)
+            _refresh_jenkins_config_once(event, task, task_type, db)
+            if task_type == 'execution':
+                result = process_execution_webhook(task, event.job_name, event.build_number, build_result, body, db)
+            elif task_type == 'plan':
+                result = process_plan_webhook(task, event.job_name, event.build_number, build_result, body, db)
+            elif task_type == 'cicd':
+                result = process_cicd_webhook(task, event.job_name, event.build_number, build_result, body, db)
+            else:
+                raise ValueError(f"Invalid TASK_ID format: {event.task_id}")
+
+            event.status = "done"
+            event.result = result
+            event.last_error = None
+            db.commit()
+            print(f"[DEBUG] Webhook event {event.idempotency_key} processed")
+
+        except Exception as e:
+            db.rollback()
+            error = getattr(e, 'detail', None) or str(e)
+            event = db.query(WebhookEvent).filter(WebhookEvent.id == event_id).first()
+            event.last_error = str(error)
+            if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                event.status = "failed"
+                db.commit()
+                print(f"[ERROR] Webhook event {event.idempotency_key} failed after {event.attempts} attempts: {error}")
+                log_backend_event("ERROR", f"Webhook {event.idempotency_key} failed after {event.attempts} attempts: {error}", db)
+            else:
+                delay = _retry_delay(event.attempts)
+                event.status = "retry"
+                event.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                db.commit()
+                print(f"[WARNING] Webhook event {event.idempotency_key} attempt {event.attempts} failed: {error} - retry in {delay}s")
+                submit_event(event_id, delay)
+    except Exception as e:
+        print(f"[ERROR] Webhook worker error for event {event_id}: {e}")
+    finally:
+        db.close()
+
+
+def recover_pending_events():
+    """
+    Gọi khi khởi động: đưa lại vào hàng đợi các event chưa xử lý xong (pending/retry).
+    Event 'processing' có thể đang được worker khác xử lý - chỉ được hẹn nhận lại lúc lease
+    hết hạn (_claim_event bỏ qua nếu lúc đó event đã xong).
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        events = db.query(
+            WebhookEvent.id, WebhookEvent.status, WebhookEvent.next_attempt_at, WebhookEvent.claimed_at
+        ).filter(
+            WebhookEvent.status.in_(["pending", "retry", "processing"])
+        ).all()
+        for event_id, status, next_attempt_at, claimed_at in events:
+            if status == "processing":
+                due = claimed_at + timedelta(seconds=WEBHOOK_LEASE_SECONDS) if claimed_at else now
+            else:
+                due = next_attempt_at or now
+            submit_event(event_id, (due - now).total_seconds())
+        if events:
+            print(f"[DEBUG] Recovered {len(events)} pending webhook events")
+        return len(events)
+    except Exception as e:
+        print(f"[WARNING] Failed to recover webhook events: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def get_queue_status(db):
+    """Thống kê số event theo trạng thái"""
+    from sqlalchemy import func
+    rows = db.query(WebhookEvent.status, func.count(WebhookEvent.id)).group_by(WebhookEvent.status).all()
+    counts = {status: count for status, count in rows}
+    return {
+        "workers": WEBHOOK_WORKERS,
+        "max_attempts": WEBHOOK_MAX_ATTEMPTS,
+        "pending": counts.get("pending", 0),
+        "processing": counts.get("processing", 0),
+        "retry": counts.get("retry", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0)
+    }
+
+
+def shutdown_queue(wait=True):
+    """Dừng worker pool khi tắt server; event chưa xong được nhận lại khi lease hết hạn (lần khởi động sau)"""
+    global _shutting_down, _executor
+    _shutting_down = True
+    for timer in list(_timers):
+        timer.cancel()
+    _timers.clear()
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
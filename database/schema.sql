@@ -30,12 +30,19 @@ CREATE TABLE testcases (
     name VARCHAR(200) NOT NULL,
     description TEXT,
     project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
-    status VARCHAR(20) DEFAULT 'active',
+    status VARCHAR(20) DEFAULT 'active', -- active, removed (đã xoá khỏi repo)
     priority VARCHAR(20) DEFAULT 'medium',
+    source_path VARCHAR(500), -- Đường dẫn file .robot trong repo
+    line_number INTEGER,
+    tags JSON,
+    deleted_at TIMESTAMP, -- Soft delete khi test không còn trong repo
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Khoá tự nhiên cho đồng bộ incremental test cases
+CREATE UNIQUE INDEX idx_testcases_source ON testcases(project_id, source_path, name);
+
 -- Executions table (with task name and description)
 CREATE TABLE executions (
     id SERIAL PRIMARY KEY,
@@ -60,6 +67,7 @@ CREATE TABLE plans (
     schedule_time VARCHAR(100) NOT NULL,
     status VARCHAR(20) DEFAULT 'initialized',
     email_recipients TEXT,
+    email_digest VARCHAR(10), -- off, hourly, daily, auto (NULL = EMAIL_DIGEST_DEFAULT)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -74,6 +82,7 @@ CREATE TABLE cicd (
     project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
     status VARCHAR(20) DEFAULT 'initialized',
     email_recipients TEXT,
+    email_digest VARCHAR(10), -- off, hourly, daily, auto (NULL = EMAIL_DIGEST_DEFAULT)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -99,14 +108,20 @@ CREATE TABLE reports (
     task_type VARCHAR(20)
 );
 
--- Logs table
+-- Logs table (phân vùng theo tháng trên created_at; backend tạo partition mới và DROP partition hết hạn)
+CREATE SEQUENCE logs_id_seq;
 CREATE TABLE logs (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
     level VARCHAR(20) NOT NULL,
     message TEXT NOT NULL,
     source VARCHAR(50),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    job_name VARCHAR(200),
+    build_number INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE logs_id_seq OWNED BY logs.id;
+CREATE TABLE logs_default PARTITION OF logs DEFAULT;
 
 -- Add indexes for better performance
 CREATE INDEX idx_plans_project_id ON plans(project_id);
@@ -117,6 +132,16 @@ CREATE INDEX idx_reports_project_id ON reports(project_id);
 CREATE INDEX idx_reports_task_id ON reports(task_id);
 CREATE INDEX idx_reports_execution_id ON reports(execution_id);
 CREATE INDEX idx_reports_cicd_id ON reports(cicd_id);
+CREATE INDEX idx_reports_task_created_id ON reports(task_id, created_at DESC, id DESC);
+CREATE INDEX idx_reports_task_meaningful ON reports(task_id, created_at DESC, id DESC) WHERE status NOT IN ('cancelled', 'aborted');
+CREATE INDEX idx_reports_created_at_id ON reports(created_at DESC, id DESC);
+CREATE INDEX idx_reports_task_build ON reports(task_id, build_number);
+CREATE INDEX idx_logs_source_level_created_at ON logs(source, level, created_at);
+CREATE INDEX idx_logs_created_at ON logs(created_at);
+CREATE INDEX idx_logs_job_build_created_at ON logs(job_name, build_number, created_at);
+CREATE INDEX idx_logs_message_fts ON logs USING gin (to_tsvector('simple', message));
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_logs_message_trgm ON logs USING gin (message gin_trgm_ops);
 
 -- Notifications table
 CREATE TABLE notifications (
@@ -129,7 +154,8 @@ CREATE TABLE notifications (
     message TEXT NOT NULL, -- Nội dung thông báo
     is_read BOOLEAN DEFAULT FALSE, -- Đã đọc chưa
     read_at TIMESTAMP, -- Thời gian đọc
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- Thời gian tạo
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Thời gian tạo
+    idempotency_key VARCHAR(100) -- task_id#build_number cho thông báo kết quả build
 );
 
 -- Jenkins Jobs table
@@ -150,10 +176,164 @@ CREATE INDEX idx_notifications_task_type ON notifications(task_type);
 CREATE INDEX idx_notifications_status ON notifications(status);
 CREATE INDEX idx_notifications_is_read ON notifications(is_read);
 CREATE INDEX idx_notifications_created_at ON notifications(created_at);
+CREATE INDEX idx_notifications_unread ON notifications(is_read) WHERE is_read = false;
+CREATE UNIQUE INDEX idx_notifications_idempotency_key ON notifications(idempotency_key);
 CREATE INDEX idx_jenkins_jobs_project_id ON jenkins_jobs(project_id);
 CREATE INDEX idx_jenkins_jobs_name ON jenkins_jobs(name);
 CREATE INDEX idx_jenkins_jobs_status ON jenkins_jobs(status);
 
+-- Webhook events table (hàng đợi xử lý webhook Jenkins)
+CREATE TABLE webhook_events (
+    id SERIAL PRIMARY KEY,
+    idempotency_key VARCHAR(300) UNIQUE NOT NULL, -- job_name#build_number
+    task_id VARCHAR(50) NOT NULL,
+    job_name VARCHAR(200) NOT NULL,
+    build_number INTEGER NOT NULL,
+    payload JSON NOT NULL, -- Body gốc Jenkins gửi về
+    status VARCHAR(20) DEFAULT 'pending', -- pending, processing, retry, done, failed
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    result JSON,
+    progress JSON, -- Bước không idempotent đã xong (jenkins_config)
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP, -- Lúc worker nhận event (lease của trạng thái processing)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_webhook_events_status ON webhook_events(status);
+
+-- Test results table (kết quả từng test case của mỗi report)
+CREATE TABLE test_results (
+    id BIGSERIAL PRIMARY KEY,
+    report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+    suite VARCHAR(500), -- Tên đầy đủ của suite (Root.Child)
+    name VARCHAR(500) NOT NULL, -- Tên test case
+    status VARCHAR(10) NOT NULL, -- PASS, FAIL, SKIP, NOT RUN
+    duration_ms INTEGER,
+    message_hash VARCHAR(32) -- md5 của message lỗi
+);
+
+-- Test messages table (message lỗi được lưu một lần theo hash)
+CREATE TABLE test_messages (
+    message_hash VARCHAR(32) PRIMARY KEY,
+    message TEXT NOT NULL
+);
+
+CREATE INDEX idx_test_results_report_id ON test_results(report_id, id);
+CREATE INDEX idx_test_results_report_status ON test_results(report_id, status, id);
+CREATE INDEX idx_test_results_name_report ON test_results(name, report_id DESC, id DESC);
+
+-- Dashboard stats table (bộ đếm tổng hợp cho dashboard)
+-- Được cập nhật bởi trigger trên projects/executions/plans/cicd/reports,
+-- trigger được cài khi backend khởi động (backend/stats_rollup.py)
+CREATE TABLE dashboard_stats (
+    stat_key VARCHAR(100) PRIMARY KEY, -- projects.total, tasks.execution.status.running, reports.created.2024-01-31 (trigger ghi vào '<key>#<stripe>')
+    value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Report trends table (số report theo giờ/ngày, project và loại task)
+-- Được cập nhật bởi trigger trên reports (backend/stats_rollup.py)
+CREATE TABLE report_trends (
+    granularity VARCHAR(10) NOT NULL, -- hour, day
+    bucket_start TIMESTAMP NOT NULL,
+    project_id INTEGER NOT NULL DEFAULT 0, -- 0 = không có project
+    task_type VARCHAR(20) NOT NULL DEFAULT '', -- execution, plan, cicd
+    total INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, project_id, task_type)
+);
+
+-- Repository heads table (commit mới nhất + ETag GitHub cho request có điều kiện)
+CREATE TABLE repository_heads (
+    owner VARCHAR(100) NOT NULL,
+    repo VARCHAR(100) NOT NULL,
+    ref VARCHAR(200) NOT NULL DEFAULT 'HEAD',
+    commit_sha VARCHAR(40) NOT NULL,
+    etag VARCHAR(200),
+    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner, repo, ref)
+);
+
+-- Repository inventories table (danh sách file .robot theo commit, backend/robot_inventory.py)
+CREATE TABLE repository_inventories (
+    owner VARCHAR(100) NOT NULL,
+    repo VARCHAR(100) NOT NULL,
+    commit_sha VARCHAR(40) NOT NULL,
+    files JSON NOT NULL, -- name, path, size, sha, download_url
+    complete BOOLEAN, -- TRUE khi dựng từ cây đầy đủ
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner, repo, commit_sha)
+);
+
+CREATE INDEX idx_repository_inventories_last_used ON repository_inventories(last_used_at);
+
+-- Robot blobs table (test case đã parse từ file .robot, theo git blob SHA)
+CREATE TABLE robot_blobs (
+    blob_sha VARCHAR(40) PRIMARY KEY,
+    test_cases JSON NOT NULL, -- [{name, tags, line}]
+    parsed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_robot_blobs_last_used_at ON robot_blobs(last_used_at);
+
+-- Thống kê log theo giờ (cập nhật bởi backend khi ghi log theo lô)
+CREATE TABLE IF NOT EXISTS log_stats_hourly (
+    bucket_start TIMESTAMP NOT NULL,
+    source VARCHAR(50) NOT NULL DEFAULT '',
+    level VARCHAR(20) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, source, level)
+);
+
+CREATE TABLE IF NOT EXISTS log_error_stats (
+    bucket_start TIMESTAMP NOT NULL,
+    source VARCHAR(50) NOT NULL DEFAULT '',
+    message_key VARCHAR(200) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    sample_message TEXT,
+    last_seen TIMESTAMP,
+    PRIMARY KEY (bucket_start, source, message_key)
+);
+
+-- Hàng đợi email gửi đi (backend gửi ở luồng nền, retry với backoff)
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    idempotency_key VARCHAR(300) NOT NULL UNIQUE,
+    kind VARCHAR(30) NOT NULL DEFAULT 'task_report',
+    task_id VARCHAR(50),
+    payload JSON NOT NULL,
+    recipients JSON NOT NULL,
+    delivered_recipients JSON, -- Địa chỉ đã nhận (lô RCPT TO đã gửi xong)
+    status VARCHAR(20) DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP, -- Lúc worker nhận email (lease của trạng thái sending)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next_attempt ON email_outbox(status, next_attempt_at);
+
+-- Report chờ gộp vào email digest (một email mỗi người nhận mỗi cửa sổ giờ/ngày)
+CREATE TABLE IF NOT EXISTS email_digest_items (
+    id SERIAL PRIMARY KEY,
+    recipient VARCHAR(255) NOT NULL,
+    digest_window VARCHAR(10) NOT NULL, -- hourly, daily
+    window_start TIMESTAMP NOT NULL,
+    report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+    task_id VARCHAR(50),
+    build_number INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_email_digest_items_window ON email_digest_items(recipient, digest_window, window_start, report_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_email_digest_items_build ON email_digest_items(recipient, digest_window, task_id, build_number);
+
 -- Add comments for documentation
 COMMENT ON COLUMN cicd.cicd_id IS 'ID định danh duy nhất cho CI/CD task (format: CICD-001, CICD-002, ...)';
 COMMENT ON COLUMN reports.task_id IS 'ID của task (TASK001, PLAN001, CICD001) - dùng để phân biệt loại task';